@@ -16,6 +16,7 @@ from pyon.public import log
 
 # Standard imports.
 import uuid
+from logging import DEBUG
 
 # 3rd party.
 import gevent
@@ -31,7 +32,8 @@ from interface.objects import StreamRoute
 from pyon.core.bootstrap import get_obj_registry
 from pyon.core.object import IonObjectDeserializer
 
-from ion.agents.populate_rdt import populate_rdt
+from ion.agents.populate_rdt import ParticleColumns, COLUMNS
+from ion.agents.data.parsers.parser_utils import DataParticleKey
 
 class AgentStreamPublisher(object):
     """
@@ -74,6 +76,7 @@ class AgentStreamPublisher(object):
                     rdt = RecordDictionaryTool(stream_definition_id=stream_def)    
                 self._agent.aparam_streams[stream_name] = rdt.fields
                 self._agent.aparam_pubrate[stream_name] = 0
+                self._stream_buffers[stream_name] = ParticleColumns(rdt.fields, rdt.temporal_parameter)
             except Exception as e:
                 errmsg = 'Instrument agent %s' % self._agent._proc_name
                 errmsg += 'error constructing stream %s. ' % stream_name
@@ -94,9 +97,10 @@ class AgentStreamPublisher(object):
                                     stream_id=stream_id, stream_route=route)
                 self._publishers[stream_name] = publisher
                 self._stream_greenlets[stream_name] = None
-                self._stream_buffers[stream_name] = []
         
             except Exception as e:
+                # Samples for a stream without a publisher are rejected rather than buffered
+                self._stream_buffers.pop(stream_name, None)
                 errmsg = 'Instrument agent %s' % self._agent._proc_name
                 errmsg += 'error constructing publisher for stream %s. ' % stream_name
                 errmsg += str(e)
@@ -111,7 +115,7 @@ class AgentStreamPublisher(object):
         
         try:
             stream_name = sample['stream_name']
-            self._stream_buffers[stream_name].insert(0, sample)
+            self._stream_buffers[stream_name].append(sample)
             if not self._stream_greenlets[stream_name]:
                 self._publish_stream_buffer(stream_name)
 
@@ -127,7 +131,7 @@ class AgentStreamPublisher(object):
         for sample in sample_list:
             try:
                 stream_name = sample['stream_name']
-                self._stream_buffers[stream_name].insert(0, sample)
+                self._stream_buffers[stream_name].append(sample)
                 streams.add(stream_name)
             except KeyError:
                 log.warning('Instrument agent %s received sample with bad stream name %s.',
@@ -138,6 +142,31 @@ class AgentStreamPublisher(object):
                 self._publish_stream_buffer(stream_name)
 
 
+    def on_stream_samples(self, stream_name, samples):
+        """
+        Enqueues samples already grouped by stream, particle dicts or column
+        batches, publishes them and returns the number of particles enqueued
+        """
+        try:
+            stream_buffer = self._stream_buffers[stream_name]
+        except KeyError:
+            log.warning('Instrument agent %s received sample with bad stream name %s.',
+                      self._agent._proc_name, stream_name)
+            return 0
+
+        count = 0
+        for sample in samples:
+            if COLUMNS in sample:
+                count += stream_buffer.extend_columns(sample[COLUMNS],
+                    sample.get(DataParticleKey.PREFERRED_TIMESTAMP, DataParticleKey.DRIVER_TIMESTAMP))
+            else:
+                stream_buffer.append(sample)
+                count += 1
+
+        if not self._stream_greenlets[stream_name]:
+            self._publish_stream_buffer(stream_name)
+        return count
+
     def aparam_set_streams(self, params):
         return -1
     
@@ -199,24 +228,17 @@ class AgentStreamPublisher(object):
                 
             publisher = self._publishers[stream_name]
                 
-            vals = []
-            for x in xrange(buf_len):
-                vals.append(self._stream_buffers[stream_name].pop())
-    
-            rdt = populate_rdt(rdt, vals)
+            rdt = self._stream_buffers[stream_name].fill(rdt)
             
-            log.info('Outgoing granule: %s',
-                     ['%s: %s'%(k,v) for k,v in rdt.iteritems()])
-            log.info('Outgoing granule preferred timestamp: %s' % rdt['preferred_timestamp'][0])
-            log.info('Outgoing granule destined for stream: %s', stream_name)
+            if log.isEnabledFor(DEBUG):
+                log.debug('Outgoing granule destined for stream %s: %s', stream_name,
+                          ['%s: %s'%(k,v) for k,v in rdt.iteritems()])
             g = rdt.to_granule(data_producer_id=self._agent.resource_id, connection_id=self._connection_ID.hex,
                     connection_index=str(self._connection_index[stream_name]))
             
             publisher.publish(g)
-            log.info('Instrument agent %s published data granule on stream %s.',
-                self._agent._proc_name, stream_name)
-            log.info('Connection id: %s, connection index: %i.',
-                     self._connection_ID.hex, self._connection_index[stream_name])
+            log.info('Instrument agent %s published data granule of %i particles on stream %s, connection id: %s, connection index: %i.',
+                self._agent._proc_name, buf_len, stream_name, self._connection_ID.hex, self._connection_index[stream_name])
             self._connection_index[stream_name] += 1
         except:
             log.exception('Instrument agent %s could not publish data on stream %s.',
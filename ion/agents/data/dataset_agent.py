@@ -22,6 +22,7 @@ __author__ = 'Christopher Mueller, Jonathan Newbrough, Bill French'
 
 
 import os, sys, gevent, json, math, time
+from collections import OrderedDict
 
 from ooi.logging import log
 from ooi.poller import DirectoryPoller
@@ -38,6 +39,7 @@ from pyon.ion.stream import StandaloneStreamPublisher
 from ion.agents.instrument.exceptions import InstrumentStateException
 from ion.agents.instrument.common import BaseEnum
 from ion.agents.instrument.instrument_agent import InstrumentAgent
+from ion.agents.populate_rdt import COLUMNS, VALUES, VALUE_ID, VALUE
 from ion.core.includes.mi import DriverEvent
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
 
@@ -275,20 +277,33 @@ class DataSetAgent(InstrumentAgent):
         """
         Publish particles to the agent.
 
-        TODO: currently we are generating JSON serialized objects
-        we should be able to send with objects because we don't have
-        the zmq boundray issue in this client.
+        The driver runs in this process, so particles are handed over without
+        the JSON encoding needed across the zmq boundary: particle objects are
+        turned into dicts, dicts are taken as they are, and column batches
+        (dicts with a stream_name and a columns dict of equal length value
+        sequences) go straight into the stream buffers.  Particles are grouped
+        by stream and each group is published in one go.  The particles before
+        one that fails are still published.
 
         @return: number of records published
         """
         publish_count = 0
+        streams = OrderedDict()
         try:
-            for p in particle:
-                # Can we use p.generate_dict() here?
-                p_obj = p.generate()
-                log.info("Particle received: %s", p_obj)
-                self._async_driver_event_sample(p_obj, None)
-                publish_count += 1
+            try:
+                for p in particle:
+                    sample = p if isinstance(p, dict) else p.generate_dict()
+                    log.debug("Particle received: %s", sample)
+
+                    if sample.get('new_sequence') == True:
+                        # Particles before the flag belong to the old connection
+                        publish_count += self._publish_samples(streams)
+                        log.info("New sequence flag detected in particle.  Resetting connection ID")
+                        self._asp.reset_connection()
+
+                    streams.setdefault(sample['stream_name'], []).append(sample)
+            finally:
+                publish_count += self._publish_samples(streams)
         except Exception as e:
             log.error("Error logging particle: %s", e, exc_info=True)
 
@@ -306,6 +321,35 @@ class DataSetAgent(InstrumentAgent):
 
         return publish_count
 
+    def _publish_samples(self, streams):
+        """
+        Publish the samples of each stream and evaluate the alerts on their values.
+        Streams are removed as they are published, so none is published twice.
+        @return: number of records published
+        """
+        publish_count = 0
+        while streams:
+            stream_name, samples = streams.popitem(last=False)
+            publish_count += self._asp.on_stream_samples(stream_name, samples)
+
+            # Without alerts only the aggregate status is refreshed, which
+            # the last sample does as well as all of them.
+            if not self.aparam_alerts:
+                samples = samples[-1:]
+            try:
+                for sample in samples:
+                    if COLUMNS in sample:
+                        for value_id, values in sample[COLUMNS].iteritems():
+                            for value in values:
+                                self._aam.process_alerts(stream_name=stream_name, value=value, value_id=value_id)
+                    else:
+                        for v in sample[VALUES]:
+                            self._aam.process_alerts(stream_name=stream_name, value=v[VALUE], value_id=v[VALUE_ID])
+            except Exception:
+                log.error('Dataset agent %s could not process alerts for stream %s',
+                          self._proc_name, stream_name, exc_info=True)
+        return publish_count
+
     def exception_callback(self, exception):
         """
         Callback passed to the driver which handles exceptions raised when
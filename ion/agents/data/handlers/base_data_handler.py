@@ -477,7 +477,8 @@ class BaseDataHandler(object):
         """
         rr_cli = ResourceRegistryServiceClient()
         try:
-            attachment_objs = rr_cli.find_attachments(resource_id=res_id, include_content=True, id_only=False)
+            # Newest first, an interrupted update can leave the previous attachment behind
+            attachment_objs = rr_cli.find_attachments(resource_id=res_id, include_content=True, id_only=False, descending=True)
             for attachment_obj in attachment_objs:
                 kwds = set(attachment_obj.keywords)
                 if 'NewDataCheck' in kwds:
@@ -489,31 +490,40 @@ class BaseDataHandler(object):
             raise InstrumentException('ExternalDatasetResource \'{0}\' not found'.format(res_id))
 
     @classmethod
-    def _update_new_data_check_attachment(cls, res_id, new_content):
+    def _update_new_data_check_attachment(cls, res_id, new_content, replace_id=None):
         """
         Update the list of data files for the external dataset resource
+        The new attachment is created before the old one is deleted, so an interrupted update
+        leaves the previous list in place rather than none
 
         @param res_id the ID of the external dataset resource
         @param new_content list of new files found on data host
+        @param replace_id the ID of the attachment being replaced, looked up by keyword if not given
         @throws InstrumentException if external dataset resource can't be found
         @retval the attachment ID
         """
         rr_cli = ResourceRegistryServiceClient()
         try:
-            # Delete any attachments with the "NewDataCheck" keyword
-            attachment_objs = rr_cli.find_attachments(resource_id=res_id, include_content=False, id_only=False)
-            for attachment_obj in attachment_objs:
-                kwds = set(attachment_obj.keywords)
-                if 'NewDataCheck' in kwds:
-                    log.debug('Delete NewDataCheck attachment: {0}'.format(attachment_obj._id))
-                    rr_cli.delete_attachment(attachment_obj._id)
-                else:
-                    log.debug('Found attachment: {0}'.format(attachment_obj))
-
             # Create the new attachment
             att = Attachment(name='new_data_check', attachment_type=AttachmentType.ASCII, keywords=['NewDataCheck', ], content_type='text/plain', content=msgpack.packb(new_content))
             att_id = rr_cli.create_attachment(resource_id=res_id, attachment=att)
 
+            # Delete any other attachments with the "NewDataCheck" keyword
+            if replace_id:
+                old_ids = [replace_id]
+            else:
+                old_ids = []
+                attachment_objs = rr_cli.find_attachments(resource_id=res_id, include_content=False, id_only=False)
+                for attachment_obj in attachment_objs:
+                    kwds = set(attachment_obj.keywords)
+                    if 'NewDataCheck' in kwds and attachment_obj._id != att_id:
+                        old_ids.append(attachment_obj._id)
+                    else:
+                        log.debug('Found attachment: {0}'.format(attachment_obj))
+            for old_id in old_ids:
+                log.debug('Delete NewDataCheck attachment: {0}'.format(old_id))
+                rr_cli.delete_attachment(old_id)
+
         except NotFound:
             raise InstrumentException('ExternalDatasetResource \'{0}\' not found'.format(res_id))
 
@@ -543,6 +553,9 @@ class BaseDataHandler(object):
                 constraints = cls._constraints_for_new_request(config)
             except NoNewDataWarning:
                 #log.info(nndw.message)
+                # Nothing to publish, but the new data check may still have changed
+                if update_new_data_check_attachment and get_safe(config, 'set_new_data_check') not in (None, get_safe(config, 'new_data_check')):
+                    update_new_data_check_attachment(config['external_dataset_res_id'], config['set_new_data_check'])
                 if get_safe(config, 'TESTING'):
                     #log.debug('Publish TestingFinished event')
                     pub = EventPublisher('DeviceCommonLifecycleEvent')
@@ -613,6 +626,8 @@ class BaseDataHandler(object):
     def _publish_data(cls, publisher, data_generator, config=None, update_new_data_check_attachment=None):
         """
         Iterates over the data_generator and publishes granules to the stream indicated in stream_id
+        The new data check state in config['set_new_data_check'] is kept in memory and checkpointed
+        by a NewDataCheckCheckpoint, never ahead of the granules that have been published
         @param publisher to publish the data with
         @param data_generator enumerator to cycle through the data
         @throws InstrumentDataException if data_generator isn't an enumerator
@@ -620,14 +635,30 @@ class BaseDataHandler(object):
         if data_generator is None or not hasattr(data_generator, '__iter__'):
             raise InstrumentDataException('Invalid object returned from _get_data: returned object cannot be None and must have \'__iter__\' attribute')
 
-        for count, gran in enumerate(data_generator):
-            if isinstance(gran, Granule):
-                #log.warn('_publish_data: {0}\n{1}'.format(count, gran))
-                publisher.publish(gran)
-                if config and 'set_new_data_check' in config:
-                    update_new_data_check_attachment(config['external_dataset_res_id'], config['set_new_data_check'])
-            else:
-                log.warn('Could not publish object of {0} returned by _get_data: {1}'.format(type(gran), gran))
+        checkpoint = None
+        if config and update_new_data_check_attachment:
+            checkpoint = NewDataCheckCheckpoint(config, update_new_data_check_attachment)
+
+        publishing = False
+        try:
+            for count, gran in enumerate(data_generator):
+                if isinstance(gran, Granule):
+                    #log.warn('_publish_data: {0}\n{1}'.format(count, gran))
+                    publishing = True
+                    publisher.publish(gran)
+                    publishing = False
+                    if checkpoint:
+                        checkpoint.published()
+                else:
+                    log.warn('Could not publish object of {0} returned by _get_data: {1}'.format(type(gran), gran))
+        except Exception:
+            # The state already covers a granule that failed to publish, keep the last checkpoint
+            if checkpoint and not publishing:
+                checkpoint.flush()
+            raise
+
+        if checkpoint:
+            checkpoint.flush()
 
         publisher.close()
         #TODO: Persist the 'state' of this operation so that it can be re-established in case of failure
@@ -635,6 +666,43 @@ class BaseDataHandler(object):
         #TODO: When finished publishing, update (either directly, or via an event callback to the agent) the UpdateDescription
 
 
+class NewDataCheckCheckpoint(object):
+    """
+    Keeps the new data check state of an acquisition cycle, config['set_new_data_check'], in memory
+    and writes it to the external dataset resource after every 'new_data_check_interval' published
+    granules or 'new_data_check_period' seconds, whichever comes first, and when the cycle ends.
+    Nothing is written when no granule was published since the last write or the state is unchanged.
+    """
+
+    def __init__(self, config, update_new_data_check_attachment):
+        self._config = config
+        self._update = update_new_data_check_attachment
+        self.interval = get_safe(config, 'new_data_check_interval', 100)
+        self.period = get_safe(config, 'new_data_check_period', 60)
+        self._pending = 0
+        self._last_time = time.time()
+        self._last_content = None
+        self._attachment_id = None
+
+    def published(self):
+        self._pending += 1
+        if self._pending >= self.interval or time.time() - self._last_time >= self.period:
+            self.flush()
+
+    def flush(self):
+        if not self._pending or 'set_new_data_check' not in self._config:
+            return
+        self._pending = 0
+        self._last_time = time.time()
+
+        new_data_check = self._config['set_new_data_check']
+        content = msgpack.packb(new_data_check)
+        if content == self._last_content:
+            return
+        self._attachment_id = self._update(self._config['external_dataset_res_id'], new_data_check, self._attachment_id)
+        self._last_content = content
+
+
 class DataHandlerError(Exception):
     """
     Base DataHandler error
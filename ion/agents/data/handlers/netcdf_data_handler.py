@@ -11,9 +11,10 @@
 from pyon.public import log
 from pyon.util.containers import get_safe
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
-from ion.agents.data.handlers.base_data_handler import BaseDataHandler
+from ion.agents.data.handlers.base_data_handler import BaseDataHandler, NoNewDataWarning
 from ion.agents.data.handlers.handler_utils import calculate_iteration_count
 import hashlib
+import zlib
 import numpy as np
 from pyon.core.interceptor.encode import encode_ion, decode_ion
 import msgpack
@@ -27,43 +28,35 @@ class NetcdfDataHandler(BaseDataHandler):
     @classmethod
     def _constraints_for_new_request(cls, config):
         """
-        Returns a constraints dictionary with
+        Returns a constraints dictionary with the temporal slice of the data that is new since the last acquisition
+        The new data check is the fingerprint of the temporal variable from _time_fingerprint, read from
+        config['new_data_check'] or else the external dataset's update description, which may also hold the full
+        array of old timestamps
         @param config Dict of configuration parameters - may be used to generate the returned 'constraints' dict
         @retval dict that contains the constraints for retrieval of new data from the external dataset or None
+        @throws NoNewDataWarning if there is no new data
         """
-        #TODO: Sort out what the config needs to look like - dataset_in??
         ext_dset_res = get_safe(config, 'external_dataset_res', None)
         #log.debug('ExternalDataset Resource: {0}'.format(ext_dset_res))
         if ext_dset_res:
-            #TODO: Use the external dataset resource to determine what data is new (i.e. pull 'old' fingerprint from here)
-            #log.debug('ext_dset_res.dataset_description = {0}'.format(ext_dset_res.dataset_description))
-            #log.debug('ext_dset_res.update_description = {0}'.format(ext_dset_res.update_description))
-
             # Get the Dataset object from the config (should have been instantiated in _init_acquisition_cycle)
             ds = get_safe(config, 'dataset_object')
 
-            base_nd_check = get_safe(ext_dset_res.update_description.parameters, 'new_data_check')
-
-            t_slice = slice(None)
-            if base_nd_check:
-                t_new_vname = ext_dset_res.dataset_description.parameters['temporal_dimension']
-                t_new_arr = ds.variables[t_new_vname][t_slice]
-
-                new_data = msgpack.packb(t_new_arr, default=encode_ion)
-                if new_data != base_nd_check:
-                    #new time data has arrived, figure out what's different and build the new slice
-                    first_index = -1
-                    last_index = -1
-                    t_old_arr = msgpack.unpackb(base_nd_check, object_hook=decode_ion)
-                    for new_data in t_new_arr:
-                        if not new_data in t_old_arr:
-                            if first_index == -1:
-                                first_index = np.nonzero(t_new_arr == new_data)[0][0]
-                                last_index = np.nonzero(t_new_arr == new_data)[0][0]
-                            else:
-                                last_index = np.nonzero(t_new_arr == new_data)[0][0]
-
-                    t_slice = slice(first_index, last_index)
+            old_check = get_safe(config, 'new_data_check')
+            if old_check is None:
+                base_nd_check = get_safe(ext_dset_res.update_description.parameters, 'new_data_check')
+                if base_nd_check:
+                    old_check = msgpack.unpackb(base_nd_check, object_hook=decode_ion)
+
+            t_vname = ext_dset_res.dataset_description.parameters['temporal_dimension']
+            t_slice, new_check = cls._find_new_data(ds.variables[t_vname], old_check, get_safe(config, 'new_data_check_verify', False))
+            # The fingerprint of all timestamps is the new_data_check for the next acquisition, also kept when
+            # nothing is new but it changed (an old full list of timestamps or a rewritten file)
+            if t_slice.start == t_slice.stop:
+                if new_check != old_check:
+                    config['set_new_data_check'] = new_check
+                raise NoNewDataWarning()
+            config['set_new_data_check'] = new_check
 
             return {
                 'temporal_slice': t_slice
@@ -71,6 +64,56 @@ class NetcdfDataHandler(BaseDataHandler):
 
         return None
 
+    @classmethod
+    def _time_fingerprint(cls, t_arr, count=0, crc=0, last=None):
+        """
+        Returns the compact new data check of a temporal variable: the number of timestamps, the last one
+        and a crc32 of them all.  The fingerprint of the first count timestamps, given by its crc and last
+        timestamp, is extended with the timestamps in t_arr without reading the others
+        """
+        t_arr = np.ascontiguousarray(np.ma.getdata(t_arr), dtype='<f8')
+        if t_arr.size:
+            last = t_arr[-1].item()
+        return {'count': count + t_arr.size, 'last': last, 'crc': zlib.crc32(t_arr.tostring(), crc) & 0xffffffff}
+
+    @classmethod
+    def _find_new_data(cls, t_var, old_check, verify=False):
+        """
+        Determines which timestamps of a temporal variable are new since old_check
+        When the timestamp at the old count is still the old last one the file is taken to be appended to
+        and only the tail is read, unless verify is set, then all timestamps are read and the old ones
+        checked against the crc.  Otherwise the file was rewritten and the timestamps after the old last
+        one are new.  A legacy check, the full array of old timestamps, is compared as sorted sets.
+        @param t_var the temporal variable
+        @param old_check the fingerprint from the last acquisition, the array of old timestamps or None
+        @param verify read all timestamps to check the old ones are unchanged
+        @retval the slice of new timestamps and the fingerprint of all timestamps
+        """
+        size = t_var.shape[0]
+        if isinstance(old_check, dict):
+            count, last, crc = old_check['count'], old_check['last'], old_check['crc']
+            if count <= size:
+                if verify:
+                    t_arr = t_var[:]
+                    old = cls._time_fingerprint(t_arr[:count])
+                    if old['crc'] == crc:
+                        return slice(count, size), cls._time_fingerprint(t_arr[count:], count, crc, last)
+                elif not count or float(t_var[count - 1]) == last:
+                    return slice(count, size), cls._time_fingerprint(t_var[count:size], count, crc, last)
+
+            log.info('Temporal variable was rewritten, taking the timestamps after %s as new', last)
+            t_arr = np.ma.getdata(t_var[:])
+            new = np.arange(size) if last is None else np.nonzero(t_arr > last)[0]
+        else:
+            t_arr = np.ma.getdata(t_var[:])
+            if old_check is None:
+                new = np.arange(size)
+            else:
+                new = np.nonzero(~np.in1d(t_arr, np.asarray(old_check)))[0]
+
+        t_slice = slice(int(new[0]), int(new[-1]) + 1) if new.size else slice(size, size)
+        return t_slice, cls._time_fingerprint(t_arr)
+
     @classmethod
     def _constraints_for_historical_request(cls, config):
         """
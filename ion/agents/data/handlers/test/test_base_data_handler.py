@@ -21,7 +21,7 @@ from ion.agents.instrument.exceptions import InstrumentParameterException,\
 from interface.objects import Granule, Attachment, StreamRoute
 
 from ion.agents.data.handlers.base_data_handler import BaseDataHandler,\
-    ConfigurationError, DummyDataHandler, FibonacciDataHandler
+    ConfigurationError, DummyDataHandler, FibonacciDataHandler, NoNewDataWarning
 from ion.services.dm.utility.granule.record_dictionary import\
     RecordDictionaryTool
 from pyon.agent.agent import ResourceAgentState
@@ -91,6 +91,35 @@ class TestBaseDataHandlerUnit(PyonTestCase):
         expected = [call(granule1), call(granule2), call(granule3)]
         self.assertEqual(publisher.publish.call_args_list, expected)
 
+    def test__publish_data_new_data_check(self):
+        publisher = Mock()
+        checkpoints = []
+        def update_new_data_check_attachment(res_id, content, replace_id):
+            checkpoints.append((res_id, list(content), replace_id))
+            return 'att_%d' % content[-1]
+        config = {'external_dataset_res_id': 'external_ds', 'new_data_check_interval': 3, 'set_new_data_check': []}
+
+        def data_generator():
+            for i in xrange(8):
+                config['set_new_data_check'].append(i)
+                yield Mock(spec=Granule)
+
+        BaseDataHandler._publish_data(publisher, data_generator(), config, update_new_data_check_attachment)
+
+        self.assertEqual(publisher.publish.call_count, 8)
+        self.assertEqual(checkpoints, [('external_ds', range(3), None), ('external_ds', range(6), 'att_2'), ('external_ds', range(8), 'att_5')])
+
+    def test__publish_data_new_data_check_publish_error(self):
+        publisher = Mock()
+        publisher.publish.side_effect = [None, None, Exception('publish failed')]
+        update_new_data_check_attachment = Mock()
+        config = {'external_dataset_res_id': 'external_ds', 'set_new_data_check': ['file']}
+
+        with self.assertRaises(Exception):
+            BaseDataHandler._publish_data(publisher, [Mock(spec=Granule)] * 3, config, update_new_data_check_attachment)
+        # The state covers the granule that could not be published
+        self.assertFalse(update_new_data_check_attachment.called)
+
     @patch('ion.agents.data.handlers.base_data_handler.log')
     def test__publish_data_no_granules(self, log_mock):
         publisher = Mock()
@@ -180,6 +209,30 @@ class TestBaseDataHandlerUnit(PyonTestCase):
         _get_data_mock.assert_called_once_with(config)
         _publish_data_mock.assert_called_once_with(publisher, data_generator, config, update_new_data_check_attachment)
 
+    @patch.object(BaseDataHandler, '_init_acquisition_cycle')
+    @patch.object(BaseDataHandler, '_publish_data')
+    @patch.object(BaseDataHandler, '_constraints_for_new_request')
+    @patch('ion.agents.data.handlers.base_data_handler.gevent')
+    def test__acquire_sample_no_new_data(self, gevent_mock, _constraints_for_new_request_mock, _publish_data_mock, _init_acquisition_cycle_mock):
+        def no_new_data(config):
+            config['set_new_data_check'] = {'count': 2}
+            raise NoNewDataWarning()
+        _constraints_for_new_request_mock.side_effect = no_new_data
+
+        config = {'external_dataset_res_id': 'ext_ds_id', 'new_data_check': [1, 2]}
+        update_new_data_check_attachment = Mock()
+        BaseDataHandler._acquire_sample(config=config, publisher=Mock(), unlock_new_data_callback=Mock(), update_new_data_check_attachment=update_new_data_check_attachment)
+
+        # Nothing is published, the changed new data check is still written
+        self.assertFalse(_publish_data_mock.called)
+        update_new_data_check_attachment.assert_called_once_with('ext_ds_id', {'count': 2})
+
+        # Unchanged it is not
+        config['new_data_check'] = {'count': 2}
+        update_new_data_check_attachment.reset_mock()
+        BaseDataHandler._acquire_sample(config=config, publisher=Mock(), unlock_new_data_callback=Mock(), update_new_data_check_attachment=update_new_data_check_attachment)
+        self.assertFalse(update_new_data_check_attachment.called)
+
     @patch.object(BaseDataHandler, '_init_acquisition_cycle')
     @patch.object(BaseDataHandler, '_get_data')
     @patch.object(BaseDataHandler, '_constraints_for_new_request')
@@ -518,7 +571,8 @@ class TestBaseDataHandlerUnit(PyonTestCase):
         self.assertEqual(ret, 'content')
         rr_cli.find_attachments.assert_called_once_with(resource_id='res_id',
             include_content=True,
-            id_only=False)
+            id_only=False,
+            descending=True)
 
     @patch('ion.agents.data.handlers.base_data_handler.ResourceRegistryServiceClient')
     def test__find_new_data_check_attachment_no_newdatacheck(self, rr_cli_cls):
@@ -533,7 +587,8 @@ class TestBaseDataHandlerUnit(PyonTestCase):
         self.assertEqual(ret, None)
         rr_cli.find_attachments.assert_called_once_with(resource_id='res_id',
             include_content=True,
-            id_only=False)
+            id_only=False,
+            descending=True)
 
     @patch('ion.agents.data.handlers.base_data_handler.ResourceRegistryServiceClient')
     def test__find_new_data_check_attachment_raise_notfound(self, rr_cli_cls):
@@ -545,7 +600,8 @@ class TestBaseDataHandlerUnit(PyonTestCase):
 
         rr_cli.find_attachments.assert_called_once_with(resource_id='not_found',
             include_content=True,
-            id_only=False)
+            id_only=False,
+            descending=True)
 
     @patch('ion.agents.data.handlers.base_data_handler.ResourceRegistryServiceClient')
     def test__update_new_data_check_attachment(self, rr_cli_cls):
@@ -592,6 +648,17 @@ class TestBaseDataHandlerUnit(PyonTestCase):
             id_only=False)
         self.assertTrue(rr_cli.create_attachment.called)
 
+    @patch('ion.agents.data.handlers.base_data_handler.ResourceRegistryServiceClient')
+    def test__update_new_data_check_attachment_replace_id(self, rr_cli_cls):
+        rr_cli = rr_cli_cls.return_value
+        rr_cli.create_attachment.return_value = 'attachment_2'
+
+        ret = self._bdh._update_new_data_check_attachment(res_id='res_id',
+            new_content='new_content', replace_id='attachment_1')
+        self.assertEqual(ret, 'attachment_2')
+        self.assertFalse(rr_cli.find_attachments.called)
+        rr_cli.delete_attachment.assert_called_once_with('attachment_1')
+
     @patch('ion.agents.data.handlers.base_data_handler.ResourceRegistryServiceClient')
     def test__update_new_data_check_attachment_raise_notfound(self, rr_cli_cls):
         rr_cli = rr_cli_cls.return_value
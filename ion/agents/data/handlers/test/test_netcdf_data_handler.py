@@ -14,10 +14,26 @@ from mock import Mock, sentinel, MagicMock, patch
 
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
 from ion.agents.data.handlers.netcdf_data_handler import NetcdfDataHandler
+from ion.agents.data.handlers.base_data_handler import NoNewDataWarning
 from interface.objects import ContactInformation, UpdateDescription, DatasetDescription, ExternalDataset, Granule
 from netCDF4 import Dataset
 from pyon.core.interceptor.encode import encode_ion
 import msgpack
+import numpy as np
+
+
+class TimeVariable(object):
+    """
+    Records the reads from a temporal variable
+    """
+    def __init__(self, values):
+        self.values = values
+        self.shape = values.shape
+        self.reads = []
+
+    def __getitem__(self, item):
+        self.reads.append(item)
+        return self.values[item]
 
 
 @attr('UNIT', group='eoi')
@@ -101,7 +117,46 @@ class TestNetcdfDataHandlerUnit(PyonTestCase):
 
         ret = NetcdfDataHandler._constraints_for_new_request(config)
         #log.debug('test__constraints_for_new_request: {0}'.format(ret['temporal_slice']))
-        self.assertEqual(ret['temporal_slice'], slice(281, 295, None))
+        self.assertEqual(ret['temporal_slice'], slice(281, 296, None))
+        self.assertEqual(config['set_new_data_check']['count'], 296)
+
+        # The fingerprint from this acquisition finds nothing new in the same file
+        new_check = config.pop('set_new_data_check')
+        config['new_data_check'] = new_check
+        with self.assertRaises(NoNewDataWarning):
+            NetcdfDataHandler._constraints_for_new_request(config)
+        self.assertNotIn('set_new_data_check', config)
+
+        # Nothing new either in the full list of old timestamps, whose fingerprint is kept
+        config['new_data_check'] = list(config['dataset_object'].variables['time'][:])
+        with self.assertRaises(NoNewDataWarning):
+            NetcdfDataHandler._constraints_for_new_request(config)
+        self.assertEqual(config['set_new_data_check'], new_check)
+
+    def test__find_new_data(self):
+        t_slice, check = NetcdfDataHandler._find_new_data(TimeVariable(np.arange(10.)), None)
+        self.assertEqual(t_slice, slice(0, 10))
+        self.assertEqual((check['count'], check['last']), (10, 9.))
+
+        # Appended to, only the last old timestamp and the tail are read
+        t_var = TimeVariable(np.arange(15.))
+        t_slice, new_check = NetcdfDataHandler._find_new_data(t_var, check)
+        self.assertEqual(t_slice, slice(10, 15))
+        self.assertEqual(t_var.reads, [9, slice(10, 15)])
+        self.assertEqual(new_check, NetcdfDataHandler._time_fingerprint(np.arange(15)))
+        self.assertEqual(NetcdfDataHandler._find_new_data(TimeVariable(np.arange(15.)), check, verify=True), (t_slice, new_check))
+
+        # Rewritten, the timestamps after the old last one are new
+        t_slice, new_check = NetcdfDataHandler._find_new_data(TimeVariable(np.arange(5., 20.)), check)
+        self.assertEqual(t_slice, slice(5, 15))
+        t_arr = np.arange(15.)
+        t_arr[3] = 3.5
+        # A changed old timestamp is only caught when verifying
+        self.assertEqual(NetcdfDataHandler._find_new_data(TimeVariable(t_arr), check, verify=True)[1], NetcdfDataHandler._time_fingerprint(t_arr))
+
+        self.assertEqual(NetcdfDataHandler._find_new_data(TimeVariable(np.arange(10.)), check)[0], slice(10, 10))
+        # The full array of old timestamps is still understood
+        self.assertEqual(NetcdfDataHandler._find_new_data(TimeVariable(np.arange(15.)), np.arange(12.))[0], slice(12, 15))
 
     def test__constrainst_for_historical_request(self):
         config = {}
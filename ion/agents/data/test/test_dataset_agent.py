@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+@file ion/agents/data/test/test_dataset_agent.py
+@brief Tests for the in process particle path of the dataset agent
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.data.dataset_agent import DataSetAgent
+from nose.plugins.attrib import attr
+from mock import Mock, call
+
+
+class Particle(object):
+    def __init__(self, sample):
+        self.sample = sample
+
+    def generate_dict(self):
+        if self.sample is None:
+            raise ValueError('bad particle')
+        return self.sample
+
+
+def sample(i, stream_name='parsed', **kwargs):
+    sample = {'stream_name' : stream_name, 'driver_timestamp' : 3578927113. + i,
+              'values' : [{'value_id' : 'temp', 'value' : 10. + i}]}
+    sample.update(kwargs)
+    return sample
+
+
+@attr('UNIT', group='mi')
+class TestDataSetAgentPublish(PyonTestCase):
+    def setUp(self):
+        self.agent = DataSetAgent.__new__(DataSetAgent)
+        self.agent._asp = Mock()
+        self.agent._asp.on_stream_samples.side_effect = lambda stream_name, samples: len(samples)
+        self.agent._aam = Mock()
+        self.agent._event_publisher = Mock()
+        self.agent.aparam_alerts = []
+        self.agent.resource_id = 'dataset_agent'
+        self.agent._proc_name = 'dataset_agent'
+
+    def test_publish_callback(self):
+        samples = [sample(0, 'raw'), sample(1), sample(2, new_sequence=True), sample(3, 'raw'), sample(4)]
+        particles = [Particle(samples[0]), samples[1], Particle(samples[2]), samples[3], Particle(samples[4]),
+                     Particle(None), sample(5)]
+
+        self.assertEquals(self.agent.publish_callback(particles), 5)
+        # Grouped by stream, the groups before the new sequence and the bad particle are published
+        self.assertEquals(self.agent._asp.method_calls,
+                          [call.on_stream_samples('raw', [samples[0]]),
+                           call.on_stream_samples('parsed', [samples[1]]),
+                           call.reset_connection(),
+                           call.on_stream_samples('parsed', [samples[2], samples[4]]),
+                           call.on_stream_samples('raw', [samples[3]]),
+                           call.reset_connection()])
+        self.assertEquals(self.agent._event_publisher.publish_event.call_args[1]['event_type'], 'ResourceAgentErrorEvent')
+
+        # Without alerts only the last sample of each group refreshes the aggregate status
+        self.assertEquals(self.agent._aam.process_alerts.call_count, 4)
@@ -12,14 +12,18 @@ __license__ = 'Apache 2.0'
 from gevent import monkey
 monkey.patch_all()
 from gevent import spawn
+from gevent.socket import wait_read, timeout as socket_timeout
 
 
 import time
 import thread
+import cPickle
+import msgpack
 
 # We import "regular" zmq, not the patched version because
 # we handle the nonblocking sockets directly as they need to work
-# with unpatched threads as well.
+# with unpatched threads as well. Readiness is awaited on the socket's
+# file descriptor through gevent, see ZmqDriverClient._wait_socket.
 import zmq
 
 from ooi.logging import log
@@ -28,6 +32,31 @@ from pyon.core.exception import InstDriverClientTimeoutError
 
 
 EXCEPTION_FACTORY = ExceptionFactory()
+
+# Event frames starting with this header carry a msgpack list of events
+# rather than a single pickled event. No pickle starts with a null byte.
+BATCH_FRAME_HEADER = '\x00BAT'
+
+def encode_event_batch(events):
+    """
+    Pack a list of driver events, e.g. sample events whose values are
+    particle dicts, into one batched event frame.
+    @param events List of event dicts.
+    @retval Frame string to publish on the driver event socket.
+    """
+    return BATCH_FRAME_HEADER + msgpack.packb(events)
+
+def decode_event_frame(frame):
+    """
+    Unpack a driver event frame, either a single pickled event or a batched
+    frame made by encode_event_batch.
+    @param frame Frame string received on the driver event socket.
+    @retval List of events.
+    """
+    if frame.startswith(BATCH_FRAME_HEADER):
+        return msgpack.unpackb(frame[len(BATCH_FRAME_HEADER):])
+    return [cPickle.loads(frame)]
+
 class DriverClient(object):
     """
     Base class for driver clients, subclassed for specific messaging
@@ -90,6 +119,8 @@ class ZmqDriverClient(DriverClient):
     A class for communicating with a ZMQ-based driver process using python
     thread for catching asynchronous driver events.
     """
+    # Longest wait on the event socket before checking for stop, in seconds.
+    POLL_INTERVAL = 0.5
     
     def __init__(self, host, cmd_port, event_port):
         """
@@ -136,16 +167,22 @@ class ZmqDriverClient(DriverClient):
             """
             self.stop_event_thread = False
             while not self.stop_event_thread:
-                try:
-                    evt = self.zmq_evt_socket.recv_pyobj(flags=zmq.NOBLOCK)
-                    log.debug('got event: %s' % str(evt))
-                    if self.evt_callback:
-                        self.evt_callback(evt)
-                except zmq.ZMQError:
-                    time.sleep(.5)
-                except Exception, e:
-                    log.error('Driver client error reading from zmq event socket: ' + str(e))
-                    log.error('Driver client error type: ' + str(type(e)))                    
+                if not self._wait_socket(self.zmq_evt_socket, zmq.POLLIN, self.POLL_INTERVAL):
+                    continue
+                # Deliver everything that has arrived before waiting again.
+                while not self.stop_event_thread:
+                    try:
+                        frame = self.zmq_evt_socket.recv(flags=zmq.NOBLOCK)
+                    except zmq.ZMQError:
+                        break
+                    try:
+                        for evt in decode_event_frame(frame):
+                            log.debug('got event: %s', evt)
+                            if self.evt_callback:
+                                self.evt_callback(evt)
+                    except Exception, e:
+                        log.error('Driver client error reading from zmq event socket: ' + str(e))
+                        log.error('Driver client error type: ' + str(type(e)))
             log.info('Client event socket closed.')
 
         self.event_thread = spawn(recv_evt_messages)
@@ -167,6 +204,28 @@ class ZmqDriverClient(DriverClient):
             self.zmq_context = None
         self.evt_callback = None
         log.info('Driver client messaging closed.')
+
+    def _wait_socket(self, socket, event, timeout):
+        """
+        Yield to other greenlets until a zmq socket is ready for an event.
+        The zmq file descriptor is edge triggered, so the socket's pending
+        events are checked again after every wakeup.
+        @param socket The zmq socket.
+        @param event zmq.POLLIN or zmq.POLLOUT.
+        @param timeout Seconds to wait.
+        @retval True if the socket is ready, False on timeout.
+        """
+        deadline = time.time() + timeout
+        fd = socket.getsockopt(zmq.FD)
+        while not socket.getsockopt(zmq.EVENTS) & event:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                wait_read(fd, timeout=remaining)
+            except socket_timeout:
+                pass
+        return True
     
     def cmd_dvr(self, cmd, *args, **kwargs):
         """
@@ -183,11 +242,11 @@ class ZmqDriverClient(DriverClient):
         msg = {'cmd':cmd,'args':args,'kwargs':kwargs}
 
         log.debug('Sending command %s.' % str(msg))
-        start_send = time.time()
+        deadline = time.time() + driver_timeout
         while True:
             try:
                 # Attempt command send. Retry if necessary.
-                self.zmq_cmd_socket.send_pyobj(msg)
+                self.zmq_cmd_socket.send_pyobj(msg, flags=zmq.NOBLOCK)
                 if msg == 'stop_driver_process':
                     return 'driver stopping'
 
@@ -195,10 +254,8 @@ class ZmqDriverClient(DriverClient):
                 break    
 
             except zmq.ZMQError:
-                # Socket not ready to accept send. Sleep and retry later.
-                time.sleep(.5)
-                delta = time.time() - start_send
-                if delta >= driver_timeout:
+                # Socket not ready to accept send. Wait until it is.
+                if not self._wait_socket(self.zmq_cmd_socket, zmq.POLLOUT, deadline - time.time()):
                     raise InstDriverClientTimeoutError()
 
             except Exception,e:
@@ -207,7 +264,7 @@ class ZmqDriverClient(DriverClient):
                 raise SystemError('exception writing to zmq socket: ' + str(e))
             
         log.trace('Awaiting reply.')
-        start_reply = time.time()
+        deadline = time.time() + driver_timeout
         while True:
             try:
                 # Attempt reply recv. Retry if necessary.
@@ -215,10 +272,8 @@ class ZmqDriverClient(DriverClient):
                 # Reply recieved, break and return.
                 break
             except zmq.ZMQError:
-                # Socket not ready with the reply. Sleep and retry later.
-                time.sleep(.5)
-                delta = time.time() - start_reply
-                if delta >= driver_timeout:
+                # Socket not ready with the reply. Wait until it is.
+                if not self._wait_socket(self.zmq_cmd_socket, zmq.POLLIN, deadline - time.time()):
                     raise InstDriverClientTimeoutError()
 
             except Exception,e:
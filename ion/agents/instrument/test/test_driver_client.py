@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+@file ion/agents/instrument/test/test_driver_client.py
+@brief Tests for the driver client event frames and event delivery
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.agents.instrument.driver_client import ZmqDriverClient, encode_event_batch, decode_event_frame
+from nose.plugins.attrib import attr
+
+import gevent
+import cPickle
+import time
+import zmq
+
+
+@attr('UNIT', group='mi')
+class TestDriverClient(PyonTestCase):
+    def sample(self, i):
+        return {'type' : 'DRIVER_ASYNC_EVENT_SAMPLE', 'time' : 3575139438.0 + i,
+                'value' : {'stream_name' : 'parsed', 'values' : [{'value_id' : 'temp', 'value' : 19.0 + i}]}}
+
+    def test_frames(self):
+        samples = [self.sample(i) for i in xrange(3)]
+        self.assertEquals(decode_event_frame(encode_event_batch(samples)), samples)
+        self.assertEquals(decode_event_frame(cPickle.dumps(samples[0], -1)), samples[:1])
+        self.assertEquals(decode_event_frame(cPickle.dumps(samples[0], 0)), samples[:1])
+
+    def test_event_delivery(self):
+        context = zmq.Context()
+        self.addCleanup(context.destroy, linger=0)
+        publisher = context.socket(zmq.PUB)
+        event_port = publisher.bind_to_random_port('tcp://127.0.0.1')
+        command = context.socket(zmq.REP)
+        command_port = command.bind_to_random_port('tcp://127.0.0.1')
+
+        events = []
+        client = ZmqDriverClient('127.0.0.1', command_port, event_port)
+        client.start_messaging(events.append)
+        self.addCleanup(client.stop_messaging)
+
+        # Wait for the subscription to reach the publisher
+        for i in xrange(50):
+            publisher.send_pyobj(self.sample(-1))
+            gevent.sleep(0.1)
+            if events:
+                break
+        self.assertTrue(events)
+        gevent.sleep(0.1)
+        del events[:]
+
+        samples = [self.sample(i) for i in xrange(100)]
+        then = time.time()
+        publisher.send_pyobj(samples[0])
+        publisher.send(encode_event_batch(samples[1:]))
+        while len(events) < 100 and time.time() - then < 5:
+            gevent.sleep(0.001)
+        self.assertEquals(events, samples)
+        # Delivered on arrival rather than on the next poll
+        self.assertTrue(time.time() - then < client.POLL_INTERVAL)
@@ -15,6 +15,113 @@ import base64
 from pyon.public import log
 from ion.agents.data.parsers.parser_utils import DataParticleKey
 
+VALUES   = DataParticleKey.VALUES
+VALUE_ID = DataParticleKey.VALUE_ID
+VALUE    = DataParticleKey.VALUE
+# Key of a column batch, a sample carrying a dictionary of equal length value sequences
+# per field in place of a single particle
+COLUMNS  = 'columns'
+
+
+class ParticleColumns(object):
+    """
+    Accumulates the data particles of a stream as columns, one preallocated list per
+    stream field, so particles are walked once when they arrive and publishing hands the
+    columns to an RDT without going back over the particle dictionaries.  A field a
+    particle doesn't set stays None as in populate_rdt, each column is converted to a
+    typed array with a single numpy.array when it is handed off.  Only the fields set since
+    the last hand off are handed to the RDT.
+    """
+    def __init__(self, fields, temporal_parameter, capacity=64):
+        self.fields = set(fields)
+        self.temporal_parameter = temporal_parameter
+        self._capacity = capacity
+        self._size = 0
+        self._columns = {temporal_parameter : [None] * capacity}
+        self._touched = set([temporal_parameter])
+
+    def __len__(self):
+        return self._size
+
+    def _new_column(self, name):
+        column = self._columns[name] = [None] * self._capacity
+        return column
+
+    def _grow(self):
+        for column in self._columns.itervalues():
+            column.extend([None] * self._capacity)
+        self._capacity *= 2
+
+    def append(self, particle):
+        i = self._size
+        if i == self._capacity:
+            self._grow()
+        fields = self.fields
+        columns = self._columns
+        touched = self._touched
+        preferred_timestamp = particle.get(DataParticleKey.PREFERRED_TIMESTAMP, DataParticleKey.DRIVER_TIMESTAMP)
+
+        for k,v in particle.iteritems():
+            if k == VALUES:
+                for value_dict in v:
+                    value_id = value_dict[VALUE_ID]
+                    if value_id in fields:
+                        value = value_dict[VALUE]
+                        if 'binary' in value_dict:
+                            value = base64.b64decode(value)
+                        (columns.get(value_id) or self._new_column(value_id))[i] = value
+                        touched.add(value_id)
+
+            elif k in fields:
+                (columns.get(k) or self._new_column(k))[i] = v
+                touched.add(k)
+
+            if k == preferred_timestamp:
+                columns[self.temporal_parameter][i] = v
+        self._size = i + 1
+
+    def extend(self, particles):
+        for particle in particles:
+            self.append(particle)
+
+    def extend_columns(self, columns, preferred_timestamp=DataParticleKey.DRIVER_TIMESTAMP):
+        """
+        Appends a column batch, a dictionary of equal length value sequences per field,
+        and returns the number of particles it holds
+        """
+        if not columns:
+            return 0
+        n = len(next(columns.itervalues()))
+        i = self._size
+        while i + n > self._capacity:
+            self._grow()
+        fields = self.fields
+        for k, values in columns.iteritems():
+            if k in fields:
+                (self._columns.get(k) or self._new_column(k))[i:i + n] = values
+                self._touched.add(k)
+        if preferred_timestamp in columns:
+            self._columns[self.temporal_parameter][i:i + n] = columns[preferred_timestamp]
+        self._size = i + n
+        return n
+
+    def fill(self, rdt):
+        """
+        Moves the accumulated particles into rdt and empties the columns
+        """
+        size = self._size
+        try:
+            for k in self._touched:
+                rdt[k] = numpy.array(self._columns[k][:size])
+        finally:
+            # A rejected column must not leave the particles behind for the next hand off
+            for column in self._columns.itervalues():
+                column[:size] = [None] * size
+            self._size = 0
+            self._touched = set([self.temporal_parameter])
+        return rdt
+
+
 def populate_rdt(rdt, vals):
     """
     Populate a RecordDictionaryTool object with values from a data particle
@@ -39,43 +146,6 @@ def populate_rdt(rdt, vals):
          u'driver_timestamp': 3578927113.75216}]
     @retval A valid, filled RDT structure
     """
-    array_size = len(vals)
-    data_arrays = {}    
-        
-    # Populate the temporal parameter.
-    data_arrays[rdt.temporal_parameter] = [None] * array_size
-        
-    found_preferred_timestamp = False
-
-    for i, particle in enumerate(vals):
-        preferred_timestamp = DataParticleKey.DRIVER_TIMESTAMP
-        if DataParticleKey.PREFERRED_TIMESTAMP in particle:
-            preferred_timestamp = particle[DataParticleKey.PREFERRED_TIMESTAMP]
-
-        for k,v in particle.iteritems():
-            if k == DataParticleKey.VALUES:
-                for value_dict in v:
-                    value_id = value_dict[DataParticleKey.VALUE_ID]
-                    value = value_dict[DataParticleKey.VALUE]
-                    if value_id in rdt:
-                        if value_id not in data_arrays:
-                            data_arrays[value_id] = [None] * array_size
-                        if 'binary' in value_dict:
-                            value = base64.b64decode(value)
-                        data_arrays[value_id][i] = value
-            
-            elif k in rdt:
-                if k not in data_arrays:
-                    data_arrays[k] = [None] * array_size
-                data_arrays[k][i] = v
-
-            if k == preferred_timestamp:
-                data_arrays[rdt.temporal_parameter][i] = v
-                found_preferred_timestamp = True
-
-    for k,v in data_arrays.iteritems():
-        rdt[k] = numpy.array(v)
-
-    return rdt
-
-            
+    columns = ParticleColumns(rdt.fields, rdt.temporal_parameter, capacity=max(len(vals), 1))
+    columns.extend(vals)
+    return columns.fill(rdt)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+'''
+@file ion/agents/test/test_populate_rdt.py
+@brief Tests for the columnar particle buffer of the agent stream publisher
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.agents.populate_rdt import ParticleColumns, populate_rdt
+from ion.agents.agent_stream_publisher import AgentStreamPublisher
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+import numpy
+import uuid
+import time
+
+
+class FakeRDT(dict):
+    fields = ['time', 'temp', 'pressure', 'raw', 'quality_flag', 'driver_timestamp', 'preferred_timestamp']
+    temporal_parameter = 'time'
+
+    def to_granule(self, **kwargs):
+        return self
+
+
+class IntegerRDT(FakeRDT):
+    fields = FakeRDT.fields + ['count']
+
+    def __setitem__(self, name, value):
+        if name == 'count' and None in value.tolist():
+            raise TypeError('count is an integer parameter')
+        FakeRDT.__setitem__(self, name, value)
+
+
+def particle(i, **kwargs):
+    particle = {'quality_flag' : 'ok',
+                'preferred_timestamp' : 'driver_timestamp',
+                'stream_name' : 'parsed',
+                'driver_timestamp' : 3578927113. + i,
+                'pkt_format_id' : 'JSON_Data',
+                'values' : [{'value_id' : 'temp', 'value' : 10. + i},
+                            {'value_id' : 'pressure', 'value' : 100. + i},
+                            {'value_id' : 'ignored', 'value' : 1}]}
+    particle.update(kwargs)
+    return particle
+
+
+@attr('UNIT')
+class TestParticleColumns(PyonTestCase):
+    def test_fill(self):
+        columns = ParticleColumns(FakeRDT.fields, FakeRDT.temporal_parameter, capacity=2)
+        columns.extend([particle(i) for i in xrange(3)])
+        columns.append(particle(3, values=[{'value_id' : 'raw', 'binary' : True, 'value' : 'ZAA='}]))
+        self.assertEquals(len(columns), 4)
+
+        rdt = columns.fill(FakeRDT())
+        self.assertEquals(len(columns), 0)
+        self.assertEquals(sorted(rdt.keys()), ['driver_timestamp', 'preferred_timestamp', 'pressure', 'quality_flag', 'raw', 'temp', 'time'])
+        numpy.testing.assert_array_equal(rdt['time'], rdt['driver_timestamp'])
+        self.assertEquals(rdt['temp'].tolist(), [10., 11., 12., None])
+        self.assertEquals(rdt['raw'].tolist(), [None, None, None, 'd\x00'])
+
+        # Emptied columns are reused for the next granule
+        columns.append(particle(4))
+        self.assertEquals(columns.fill(FakeRDT())['temp'].tolist(), [14.])
+
+    def test_missing_fields(self):
+        columns = ParticleColumns(IntegerRDT.fields, IntegerRDT.temporal_parameter, capacity=2)
+        with_count = lambda i: particle(i, values=[{'value_id' : 'temp', 'value' : 10. + i}, {'value_id' : 'count', 'value' : i}])
+        columns.extend([with_count(0), with_count(1)])
+        self.assertEquals(columns.fill(IntegerRDT())['count'].tolist(), [0, 1])
+
+        # A field missing from a batch is left out rather than published as None
+        columns.extend([particle(2), particle(3)])
+        rdt = columns.fill(IntegerRDT())
+        self.assertNotIn('count', rdt)
+        self.assertEquals(rdt['temp'].tolist(), [12., 13.])
+
+        # A column the RDT rejects doesn't keep its particles for the next batch
+        columns.extend([with_count(4), particle(5)])
+        with self.assertRaises(TypeError):
+            columns.fill(IntegerRDT())
+        self.assertEquals(len(columns), 0)
+        columns.append(particle(6))
+        rdt = columns.fill(IntegerRDT())
+        self.assertEquals(rdt['temp'].tolist(), [16.])
+        self.assertNotIn('count', rdt)
+
+    def test_extend_columns(self):
+        columns = ParticleColumns(FakeRDT.fields, FakeRDT.temporal_parameter, capacity=2)
+        columns.append(particle(0))
+        self.assertEquals(columns.extend_columns({'driver_timestamp' : [1., 2., 3.], 'temp' : numpy.array([20., 21., 22.]), 'ignored' : [0, 0, 0]}), 3)
+        self.assertEquals(columns.extend_columns({}), 0)
+        self.assertEquals(len(columns), 4)
+
+        rdt = columns.fill(FakeRDT())
+        self.assertEquals(rdt['time'].tolist(), [3578927113., 1., 2., 3.])
+        self.assertEquals(rdt['temp'].tolist(), [10., 20., 21., 22.])
+        self.assertEquals(rdt['pressure'].tolist(), [100., None, None, None])
+        self.assertNotIn('ignored', rdt)
+
+    def test_populate_rdt(self):
+        rdt = populate_rdt(FakeRDT(), [particle(i) for i in xrange(3)])
+        self.assertEquals(rdt['pressure'].dtype, numpy.float64)
+        self.assertEquals(rdt['quality_flag'].tolist(), ['ok'] * 3)
+
+
+@attr('UNIT')
+class TestAgentStreamPublisher(PyonTestCase):
+    def test_on_stream_samples(self):
+        agent = Mock()
+        agent.CFG = {}
+        publisher = AgentStreamPublisher(agent)
+        publisher._stream_greenlets['parsed'] = None
+        publisher._stream_buffers['parsed'] = ParticleColumns(FakeRDT.fields, FakeRDT.temporal_parameter)
+        publisher._publish_stream_buffer = Mock()
+
+        samples = [particle(0), {'stream_name' : 'parsed', 'columns' : {'driver_timestamp' : [1., 2.], 'temp' : [3., 4.]}}]
+        self.assertEquals(publisher.on_stream_samples('parsed', samples), 3)
+        self.assertEquals(len(publisher._stream_buffers['parsed']), 3)
+        publisher._publish_stream_buffer.assert_called_once_with('parsed')
+        self.assertEquals(publisher.on_stream_samples('unknown', samples), 0)
+
+    @patch('ion.agents.agent_stream_publisher.StreamPublisher')
+    @patch('ion.agents.agent_stream_publisher.RecordDictionaryTool')
+    def test_stream_without_publisher(self, rdt_cls, publisher_cls):
+        rdt_cls.side_effect = lambda **kwargs: FakeRDT()
+        agent = Mock()
+        agent.aparam_streams = {}
+        agent.aparam_pubrate = {}
+        agent.CFG = {'stream_config' : {
+            'parsed' : {'stream_definition_ref' : 'stream_def_id', 'exchange_point' : 'xp', 'routing_key' : 'parsed', 'stream_id' : 'stream_id'},
+            # No stream_id, the publisher can't be constructed
+            'raw' : {'stream_definition_ref' : 'stream_def_id', 'exchange_point' : 'xp', 'routing_key' : 'raw'}}}
+        publisher = AgentStreamPublisher(agent)
+        self.assertEquals(publisher._stream_buffers.keys(), ['parsed'])
+        publisher._publish_stream_buffer = Mock()
+
+        raw = particle(0)
+        raw['stream_name'] = 'raw'
+        publisher.on_sample(raw)
+        publisher.on_sample_mult([raw, particle(1)])
+        publisher._publish_stream_buffer.assert_called_once_with('parsed')
+        self.assertNotIn('raw', publisher._stream_buffers)
+
+
+
+@attr('BENCHMARK')
+class BenchmarkAgentStreamPublisher(PyonTestCase):
+    def test_particle_rate(self):
+        agent = Mock()
+        agent.CFG = {}
+        publisher = AgentStreamPublisher(agent)
+        publisher._stream_defs['parsed'] = 'stream_def_id'
+        publisher._publishers['parsed'] = Mock()
+        publisher._stream_greenlets['parsed'] = True # Published on demand below
+        publisher._stream_buffers['parsed'] = ParticleColumns(FakeRDT.fields, FakeRDT.temporal_parameter)
+        publisher._connection_ID = uuid.uuid4()
+        publisher._connection_index = {'parsed' : 0}
+
+        particles = [particle(i) for i in xrange(100000)]
+        with patch('ion.agents.agent_stream_publisher.RecordDictionaryTool') as rdt_cls:
+            rdt_cls.side_effect = lambda **kwargs: FakeRDT()
+            then = time.time()
+            for i in xrange(0, len(particles), 1000):
+                publisher.on_sample_mult(particles[i:i+1000])
+                publisher._publish_stream_buffer('parsed')
+            elapsed = time.time() - then
+        log.info('Published %d particles in %.3fs, %d particles/s', len(particles), elapsed, len(particles) / elapsed)
+        self.assertEquals(publisher._publishers['parsed'].publish.call_count, 100)
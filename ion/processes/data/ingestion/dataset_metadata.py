@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/ingestion/dataset_metadata.py
+@description Accumulates dataset metadata (bounds, extents, last values) in memory
+             and writes it to the object store in batches
+'''
+
+from pyon.core.exception import Conflict, BadRequest, NotFound
+from pyon.public import log
+from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
+
+import gevent
+import numpy as np
+
+numpy_walk = DatasetManagementService.numpy_walk
+
+
+class DatasetSummary(object):
+    '''
+    Partial metadata for a dataset.  Summaries merge commutatively: bounds
+    widen, extents and sizes add up and the last values belong to whichever
+    summary holds the latest time.
+    '''
+    def __init__(self):
+        self.bounds      = {}
+        self.extents     = {}
+        self.last_values = {}
+        self.last_time   = None
+        self.size        = 0
+
+    @classmethod
+    def from_rdt(cls, rdt):
+        summary = cls()
+        elements = len(rdt)
+        for k,v in rdt.iteritems():
+            v = np.asanyarray(v[:]).ravel() # Get the numpy representation (dense array).
+            if v.size and v.dtype.char not in ('S', 'O', 'U', 'V'):
+                summary.bounds[k] = (v.min(), v.max())
+                summary.last_values[k] = v[-1]
+            summary.extents[k] = elements
+            summary.size += elements * 4
+        if summary.last_values and rdt.temporal_parameter in summary.last_values:
+            summary.last_time = summary.last_values[rdt.temporal_parameter]
+        return summary
+
+    def _newer(self, other):
+        if other.last_time is None or self.last_time is None:
+            return True
+        return other.last_time >= self.last_time
+
+    def merge(self, other):
+        '''
+        Folds another summary into this one
+        '''
+        for k, (o_min, o_max) in other.bounds.iteritems():
+            if k in self.bounds:
+                l_min, l_max = self.bounds[k]
+                self.bounds[k] = (min(l_min, o_min), max(l_max, o_max))
+            else:
+                self.bounds[k] = (o_min, o_max)
+        for k, n in other.extents.iteritems():
+            self.extents[k] = self.extents.get(k, 0) + n
+        if self._newer(other):
+            self.last_values.update(other.last_values)
+            if other.last_time is not None:
+                self.last_time = other.last_time
+        else:
+            for k, v in other.last_values.iteritems():
+                self.last_values.setdefault(k, v)
+        self.size += other.size
+        return self
+
+    @classmethod
+    def from_doc(cls, doc):
+        summary = cls()
+        summary.bounds      = dict((k, tuple(v)) for k,v in doc.get('bounds', {}).iteritems())
+        summary.extents     = dict(doc.get('extents', {}))
+        summary.last_values = dict(doc.get('last_values', {}))
+        summary.last_time   = doc.get('last_time', None)
+        summary.size        = doc.get('size', 0)
+        return summary
+
+    def to_doc(self, doc=None):
+        doc = doc if doc is not None else {}
+        doc['bounds']      = self.bounds
+        doc['extents']     = self.extents
+        doc['last_values'] = self.last_values
+        doc['last_time']   = self.last_time
+        doc['size']        = self.size
+        return doc
+
+
+class DatasetMetadataAccumulator(object):
+    '''
+    Keeps a DatasetSummary per dataset and writes it to the object store
+    on flush().  Writes are read-merge-update cycles retried on revision
+    conflicts, so several workers can update the same document.
+    '''
+    MAX_RETRIES = 10
+
+    def __init__(self, object_store):
+        self.object_store = object_store
+        self._pending = {}
+
+    def add(self, dataset_id, rdt):
+        summary = DatasetSummary.from_rdt(rdt)
+        if dataset_id in self._pending:
+            self._pending[dataset_id].merge(summary)
+        else:
+            self._pending[dataset_id] = summary
+
+    def pending(self):
+        return self._pending.keys()
+
+    def flush(self, dataset_id=None):
+        dataset_ids = [dataset_id] if dataset_id is not None else self._pending.keys()
+        for dataset_id in dataset_ids:
+            summary = self._pending.pop(dataset_id, None)
+            if summary is None:
+                continue
+            try:
+                self.write(dataset_id, summary)
+            except:
+                # Keep the summary so the next flush tries again
+                if dataset_id in self._pending:
+                    summary.merge(self._pending[dataset_id])
+                self._pending[dataset_id] = summary
+                log.exception('Failed to update the metadata for dataset %s', dataset_id)
+
+    def write(self, dataset_id, summary):
+        for attempt in xrange(self.MAX_RETRIES):
+            try:
+                doc = self.object_store.read_doc(dataset_id)
+            except NotFound:
+                doc = numpy_walk(summary.to_doc())
+                try:
+                    self.object_store.create_doc(doc, object_id=dataset_id)
+                    return
+                except (BadRequest, Conflict):
+                    continue # Someone else created it first
+
+            doc = numpy_walk(doc)
+            merged = DatasetSummary.from_doc(doc).merge(summary)
+            doc = numpy_walk(merged.to_doc(doc))
+            try:
+                self.object_store.update_doc(doc)
+                return
+            except Conflict:
+                log.debug('Revision conflict updating the metadata for dataset %s, retrying', dataset_id)
+                gevent.sleep(0.01 * (attempt + 1))
+        raise Conflict('Could not update the metadata document for dataset %s' % dataset_id)
@@ -16,10 +16,15 @@ from ion.services.dm.inventory.dataset_management_service import DatasetManageme
 from interface.objects import Granule
 from ion.core.process.transform import TransformStreamListener, TransformStreamProcess
 from ion.util.time_utils import TimeUtils
+from ion.util.time_index import TimeIndex
+from ion.util.summary_pyramid import SummaryPyramid
+from ion.services.dm.utility.coverage_pool import CoveragePool
+from ion.processes.data.ingestion.dataset_metadata import DatasetMetadataAccumulator
 from ion.util.stored_values import StoredValueManager
 from interface.services.dm.iingestion_worker import BaseIngestionWorker
 from pyon.ion.stream import StreamSubscriber
 from gevent.coros import RLock
+from gevent.event import Event
 
 
 from coverage_model.parameter_values import SparseConstantValue
@@ -36,11 +41,28 @@ import uuid
 import numpy as np
 from gevent.queue import Queue
 
-numpy_walk = DatasetManagementService.numpy_walk
-
 REPORT_FREQUENCY=100
 MAX_RETRY_TIME=3600
 
+class GranuleBatch(object):
+    '''
+    Record dictionaries buffered for a single stream, waiting to be committed
+    to the coverage as one append.
+    '''
+    def __init__(self):
+        self.rdts = []
+        self.created = time.time()
+
+    def append(self, rdt):
+        self.rdts.append(rdt)
+
+    def age(self):
+        """ Age of the oldest buffered granule in milliseconds """
+        return (time.time() - self.created) * 1000.
+
+    def __len__(self):
+        return len(self.rdts)
+
 class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker):
     CACHE_LIMIT=CFG.get_safe('container.ingestion_cache',5)
 
@@ -51,13 +73,50 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         #--------------------------------------------------------------------------------
         # Ingestion Cache
         # - Datasets
-        # - Coverage instances
+        # - Coverage instances are shared through the container's coverage pool, every
+        #   dataset opened for appending is remembered to close its handle on stop
         #--------------------------------------------------------------------------------
         self._datasets  = collections.OrderedDict()
-        self._coverages = collections.OrderedDict()
+        self._appended_datasets = set()
+        self.coverage_pool = CoveragePool.instance()
 
         self._bad_coverages = {}
 
+        #--------------------------------------------------------------------------------
+        # Micro-batching
+        # - batch_size of 1 disables batching and every granule is persisted on arrival
+        # - Batches queue up per stream, a stream is persisted by one greenlet at a time
+        #   and outside of the batch lock
+        #--------------------------------------------------------------------------------
+        self._batches       = {}
+        self._flushing      = set()
+        self._batch_lock    = RLock()
+        self._batch_stop    = Event()
+        self._batch_thread  = None
+        self.batch_size     = 1
+        self.batch_timeout  = 1000
+
+        #--------------------------------------------------------------------------------
+        # Dataset metadata
+        # - metadata_interval of 0 writes the metadata document for every granule,
+        #   before the DatasetModified event goes out.  Batching is opt-in, with an
+        #   interval readers may see the document lag behind the event.
+        #--------------------------------------------------------------------------------
+        self._metadata_stop   = Event()
+        self._metadata_thread = None
+        self.metadata_interval = 0
+
+        #--------------------------------------------------------------------------------
+        # Summary pyramids
+        # - Pyramids updated in memory, saved every summary_interval seconds and when
+        #   the worker stops, a save rewrites the whole pyramid
+        #--------------------------------------------------------------------------------
+        self._summaries = {}
+        self._summary_stop   = Event()
+        self._summary_thread = None
+        self.summary_pyramid = True
+        self.summary_interval = 60
+
         self.time_stats = Accumulator(format='%3f')
         # unique ID to identify this worker in log msgs
         self._id = uuid.uuid1()
@@ -88,14 +147,22 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
 
         self.event_publisher = EventPublisher(OT.DatasetModified)
         self.stored_value_manager = StoredValueManager(self.container)
+        self.metadata = DatasetMetadataAccumulator(self.container.object_store)
+        self.metadata_interval = self.CFG.get_safe('process.metadata_interval', self.CFG.get_safe('service.ingestion.metadata_interval', 0))
 
         self.lookup_docs = self.CFG.get_safe('process.lookup_docs',[])
         self.input_product = self.CFG.get_safe('process.input_product','')
         self.qc_enabled = self.CFG.get_safe('process.qc_enabled', True)
         self.ignore_gaps = self.CFG.get_safe('service.ingestion.ignore_gaps', False)
+        self.batch_size = self.CFG.get_safe('process.batch_size', self.CFG.get_safe('service.ingestion.batch_size', 1))
+        self.batch_timeout = self.CFG.get_safe('process.batch_timeout', self.CFG.get_safe('service.ingestion.batch_timeout', 1000))
+        self.summary_pyramid = self.CFG.get_safe('process.summary_pyramid', self.CFG.get_safe('service.ingestion.summary_pyramid', True))
+        self.summary_interval = self.CFG.get_safe('process.summary_interval', self.CFG.get_safe('service.ingestion.summary_interval', 60))
         self.new_lookups = Queue()
         self.lookup_monitor = EventSubscriber(event_type=OT.ExternalReferencesUpdatedEvent, callback=self._add_lookups, auto_delete=True)
         self.add_endpoint(self.lookup_monitor)
+        self.stream_def_monitor = EventSubscriber(event_type=OT.ResourceModifiedEvent, origin_type=RT.StreamDefinition, callback=self._stream_def_modified, auto_delete=True)
+        self.add_endpoint(self.stream_def_monitor)
         self.qc_publisher = EventPublisher(event_type=OT.ParameterQCEvent)
         self.connection_id = ''
         self.connection_index = None
@@ -107,12 +174,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         self.qc_publisher.close()
         if self.subscriber_thread:
             self.stop_listener()
-        for stream, coverage in self._coverages.iteritems():
-            try:
-                coverage.close(timeout=5)
-            except:
-                log.exception('Problems closing the coverage')
-        self._coverages.clear()
+        self.close_coverages()
         TransformStreamListener.on_quit(self)
         BaseIngestionWorker.on_quit(self)
 
@@ -121,18 +183,37 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         # We use a lock here to prevent possible race conditions from starting multiple listeners and coverage clobbering
         with self.thread_lock:
             self.subscriber_thread = self._process.thread_manager.spawn(self.subscriber.listen, thread_name='%s-subscriber' % self.id)
+            if self.batching:
+                self._batch_stop.clear()
+                self._batch_thread = self._process.thread_manager.spawn(self.batch_monitor, thread_name='%s-batcher' % self.id)
+            if self.metadata_interval:
+                self._metadata_stop.clear()
+                self._metadata_thread = self._process.thread_manager.spawn(self.metadata_monitor, thread_name='%s-metadata' % self.id)
+            if self.summary_pyramid:
+                self._summary_stop.clear()
+                self._summary_thread = self._process.thread_manager.spawn(self.summary_monitor, thread_name='%s-summary' % self.id)
 
     def stop_listener(self):
         # Avoid race conditions with coverage operations (Don't start a listener at the same time as closing one)
         with self.thread_lock:
             self.subscriber.close()
             self.subscriber_thread.join(timeout=10)
-            for stream, coverage in self._coverages.iteritems():
-                try:
-                    coverage.close(timeout=5)
-                except:
-                    log.exception('Problems closing the coverage')
-            self._coverages.clear()
+            if self._batch_thread is not None:
+                self._batch_stop.set()
+                self._batch_thread.join(timeout=10)
+                self._batch_thread = None
+            self.flush_batches()
+            if self._metadata_thread is not None:
+                self._metadata_stop.set()
+                self._metadata_thread.join(timeout=10)
+                self._metadata_thread = None
+            self.metadata.flush()
+            if self._summary_thread is not None:
+                self._summary_stop.set()
+                self._summary_thread.join(timeout=10)
+                self._summary_thread = None
+            self.flush_summaries()
+            self.close_coverages()
             self.subscriber_thread = None
 
     def pause(self):
@@ -150,6 +231,9 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             if isinstance(event.reference_keys, list):
                 self.new_lookups.put(event.reference_keys)
 
+    def _stream_def_modified(self, event, *args, **kwargs):
+        RecordDictionaryTool.invalidate_stream_def(event.origin)
+
     def _new_dataset(self, stream_id):
         '''
         Adds a new dataset to the internal cache of the ingestion worker
@@ -160,71 +244,22 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             return datasets[0]
         return None
 
-    def initialize_metadata(self, dataset_id, rdt):
+    def update_metadata(self, dataset_id, rdt):
         '''
-        Initializes a metadata document in the object store. The document
-        contains information about the bounds and extents of the dataset as
-        well other metadata to improve performance.
-
+        Folds the granule into the dataset's metadata summary, the summary is
+        written to the object store every metadata_interval seconds
         '''
+        self.metadata.add(dataset_id, rdt)
+        if not self.metadata_interval:
+            self.metadata.flush(dataset_id)
 
-        object_store = self.container.object_store
-        key = dataset_id
-        bounds = {}
-        extents = {}
-        last_values = {}
-        rough_size = 0
-        for k,v in rdt.iteritems():
-            v = v[:].flatten()
-            if v.dtype.char not in ('S', 'O', 'U', 'V'):
-                bounds[k] = (np.min(v), np.max(v))
-                last_values[k] = v[-1]
-            extents[k] = len(rdt)
-            rough_size += len(rdt) * 4
-
-        doc = {'bounds':bounds, 'extents':extents, 'last_values':last_values, 'size': rough_size}
-        doc = numpy_walk(doc)
-        object_store.create_doc(doc, object_id=key)
-        return 
-
-    def update_metadata(self, dataset_id, rdt):
+    def metadata_monitor(self):
         '''
-        Updates the metada document with the latest information available
+        Periodically writes the accumulated dataset metadata
         '''
-        # Grab the document
-        object_store = self.container.object_store
-        key = dataset_id
-        try:
-            doc = object_store.read_doc(key)
-        except NotFound:
-            return self.initialize_metadata(dataset_id, rdt)
-        # These are the fields we're interested in
-        bounds = doc['bounds']
-        extents = doc['extents']
-        last_values = doc['last_values']
-        rough_size = doc['size']
-        for k,v in rdt.iteritems():
-            if k not in bounds:
-                continue
-
-            v = v[:].flatten() # Get the numpy representation (dense array).
-            if v.dtype.char not in ('S', 'O', 'U', 'V'):
-                l_min = np.min(v)
-                l_max = np.max(v)
-                o_min, o_max = bounds[k]
-                bounds[k] = (min(l_min, o_min), max(l_max, o_max))
-                last_values[k] = v[-1]
-            # Update the bounds
-            # Increase the extents
-            extents[k] = extents[k] + len(rdt)
-            # How about the last value?
-
-            rough_size += len(rdt) * 4
-        # Sanitize it
-        doc = numpy_walk(doc)
-        object_store.update_doc(doc)
+        while not self._metadata_stop.wait(timeout=self.metadata_interval):
+            self.metadata.flush()
 
-    
     def get_dataset(self,stream_id):
         '''
         Memoization (LRU) of _new_dataset
@@ -242,40 +277,90 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
 
     def get_coverage(self, stream_id):
         '''
-        Memoization (LRU) of _get_coverage
+        Acquires the stream's coverage from the coverage pool, every coverage
+        acquired must be handed back with release_coverage
         '''
-        try:
-            result = self._coverages.pop(stream_id)
-        except KeyError:
-            dataset_id = self.get_dataset(stream_id)
-            if dataset_id is None:
-                return None
-            result = DatasetManagementService._get_simplex_coverage(dataset_id, mode='a')
-            if result is None:
-                return None
-            if len(self._coverages) >= self.CACHE_LIMIT:
-                k, coverage = self._coverages.popitem(0)
-                coverage.close(timeout=5)
-        self._coverages[stream_id] = result
-        return result
+        dataset_id = self.get_dataset(stream_id)
+        if dataset_id is None:
+            return None
+        self._appended_datasets.add(dataset_id)
+        return self.coverage_pool.acquire(dataset_id, 'a', DatasetManagementService._get_simplex_coverage)
+
+    def release_coverage(self, stream_id, coverage):
+        self.coverage_pool.release(self.get_dataset(stream_id), 'a', coverage)
+
+    def discard_coverage(self, stream_id):
+        '''
+        Stops the stream's coverage from being reused, it's closed once released
+        '''
+        dataset_id = self.get_dataset(stream_id)
+        if dataset_id is not None:
+            self.coverage_pool.invalidate(dataset_id, 'a')
+
+    def close_coverages(self):
+        '''
+        Closes the append handles of every dataset this worker wrote to, not only
+        the ones still in the dataset cache
+        '''
+        while self._appended_datasets:
+            self.coverage_pool.invalidate(self._appended_datasets.pop(), 'a')
 
     def gap_coverage(self,stream_id):
+        dataset_id = self.get_dataset(stream_id)
+        if not self.coverage_pool.contains(dataset_id, 'a'):
+            return None
+        old_cov = self.get_coverage(stream_id)
         try:
-            old_cov = self._coverages.pop(stream_id)
-            dataset_id = self.get_dataset(stream_id)
             sdom, tdom = time_series_domain()
             new_cov = DatasetManagementService._create_simplex_coverage(dataset_id, old_cov.parameter_dictionary, sdom, tdom, old_cov._persistence_layer.inline_data_writes)
-            old_cov.close()
-            result = new_cov
-        except KeyError:
-            result = self.get_coverage(stream_id)
-        self._coverages[stream_id] = result
-        return result
+        finally:
+            self.release_coverage(stream_id, old_cov)
+        self.coverage_pool.put(dataset_id, 'a', new_cov)
+        return new_cov
 
 
     def dataset_changed(self, dataset_id, extents, window):
         self.event_publisher.publish_event(origin=dataset_id, author=self.id, extents=extents, window=window)
 
+    def update_time_index(self, coverage):
+        '''
+        Appends the newly written timesteps to the coverage's time index
+        '''
+        try:
+            TimeIndex.for_coverage(coverage)
+        except Exception:
+            # The index is rebuilt by the next reader, don't fail the ingestion over it
+            log.warning('Failed to update the time index for %s', coverage.persistence_dir, exc_info=True)
+
+    def update_summary(self, coverage):
+        '''
+        Summarizes the newly written timesteps in the coverage's summary
+        pyramid, the pyramid is saved every summary_interval seconds
+        '''
+        if not self.summary_pyramid:
+            return
+        try:
+            pyramid = SummaryPyramid.for_coverage(coverage)
+            self._summaries[SummaryPyramid.pyramid_path(coverage)] = pyramid
+        except Exception:
+            # Readers summarize whatever the pyramid is missing, don't fail the ingestion over it
+            log.warning('Failed to update the summary pyramid for %s', coverage.persistence_dir, exc_info=True)
+
+    def summary_monitor(self):
+        '''
+        Periodically saves the summary pyramids updated since the last save
+        '''
+        while not self._summary_stop.wait(timeout=self.summary_interval):
+            self.flush_summaries()
+
+    def flush_summaries(self):
+        for path in self._summaries.keys():
+            pyramid = self._summaries.pop(path)
+            try:
+                pyramid.save(path)
+            except (IOError, OSError):
+                log.warning('Failed to save the summary pyramid %s', path, exc_info=True)
+
     def evaluate_qc(self, rdt, dataset_id):
         if self.qc_enabled:
             for field in rdt.fields:
@@ -351,7 +436,96 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             log.debug('Empty granule for stream %s', stream_id)
             return
 
-        self.persist_or_timeout(stream_id, rdt)
+        if self.batching:
+            self.buffer_granule(stream_id, rdt)
+        else:
+            self.persist_or_timeout(stream_id, rdt)
+
+    @property
+    def batching(self):
+        return self.batch_size > 1
+
+    def is_contiguous(self, previous, rdt):
+        '''
+        Determines if rdt can be appended to the same batch as previous, a
+        batch never spans a change of stream definition or a connection gap.
+        '''
+        if previous._stream_def != rdt._stream_def:
+            return False
+        if self.ignore_gaps:
+            return True
+        if rdt.connection_id != previous.connection_id:
+            return False
+        if rdt.connection_index:
+            try:
+                return int(rdt.connection_index) == int(previous.connection_index) + 1
+            except (TypeError, ValueError):
+                pass
+        return True
+
+    def buffer_granule(self, stream_id, rdt):
+        '''
+        Buffers the record dictionary for the stream, a batch is committed once it
+        holds batch_size granules or its oldest granule is older than batch_timeout ms.
+        '''
+        with self._batch_lock:
+            batches = self._batches.setdefault(stream_id, collections.deque())
+            if not batches or len(batches[-1]) >= self.batch_size or not self.is_contiguous(batches[-1].rdts[-1], rdt):
+                batches.append(GranuleBatch())
+            batches[-1].append(rdt)
+        self.flush_batch(stream_id, partial=False)
+
+    def flush_batch(self, stream_id, partial=True):
+        '''
+        Commits the batches buffered for a stream to the coverage, each as a single append.
+        Unless partial, the batch still being filled is left buffered.  If the stream is
+        already being flushed the granules are left to that flush.  A batch that fails
+        to persist is put back and retried by the next flush.
+        '''
+        with self._batch_lock:
+            if stream_id in self._flushing:
+                return
+            self._flushing.add(stream_id)
+        try:
+            while True:
+                with self._batch_lock:
+                    batches = self._batches.get(stream_id)
+                    if not batches:
+                        self._batches.pop(stream_id, None)
+                        return
+                    if not partial and len(batches) == 1 and len(batches[0]) < self.batch_size:
+                        return
+                    batch = batches.popleft()
+                try:
+                    self.persist_or_timeout(stream_id, RecordDictionaryTool.concatenate(batch.rdts))
+                except:
+                    with self._batch_lock:
+                        self._batches.setdefault(stream_id, collections.deque()).appendleft(batch)
+                    raise
+                # The batch was gap-checked against its first granule, resume from the last one
+                last = batch.rdts[-1]
+                self.update_connection_index(last.connection_id, last.connection_index)
+        finally:
+            with self._batch_lock:
+                self._flushing.discard(stream_id)
+
+    def flush_batches(self, expired_only=False):
+        with self._batch_lock:
+            stream_ids = [stream_id for stream_id, batches in self._batches.iteritems()
+                          if not expired_only or batches[0].age() >= self.batch_timeout]
+        for stream_id in stream_ids:
+            try:
+                self.flush_batch(stream_id)
+            except:
+                log.exception('Failed to persist batch for stream %s, it is kept for the next flush', stream_id)
+
+    def batch_monitor(self):
+        '''
+        Periodically commits the batches that have been buffered for longer than batch_timeout
+        '''
+        interval = max(self.batch_timeout / 4000., 0.01)
+        while not self._batch_stop.wait(timeout=interval):
+            self.flush_batches(expired_only=True)
 
     def persist_or_timeout(self, stream_id, rdt):
         """ retry writing coverage multiple times and eventually time out """
@@ -369,9 +543,8 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
                     log.error("We're giving up, the coverage needs to be inspected %s", DatasetManagementService._get_coverage_path(dataset_id))
                     raise
 
-                if stream_id in self._coverages:
-                    log.info('Popping coverage for stream %s', stream_id)
-                    self._coverages.pop(stream_id)
+                log.info('Discarding coverage for stream %s', stream_id)
+                self.discard_coverage(stream_id)
 
                 gevent.sleep(timeout)
                 if timeout > (60 * 5):
@@ -387,7 +560,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             log.error("Couldn't insert time steps for coverage: %s",
                       coverage.persistence_dir, exc_info=True)
             try:
-                coverage.close()
+                self.discard_coverage(stream_id)
             finally:
                 self._bad_coverages[stream_id] = 1
                 raise CorruptionError(e.message)
@@ -435,7 +608,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
                 log.error("Couldn't insert values for coverage: %s",
                           coverage.persistence_dir, exc_info=True)
                 try:
-                    coverage.close()
+                    self.discard_coverage(stream_id)
                 finally:
                     self._bad_coverages[stream_id] = 1
                     raise CorruptionError(e.message)
@@ -455,7 +628,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
                 log.error("Couldn't insert values for coverage: %s",
                           coverage.persistence_dir, exc_info=True)
                 try:
-                    coverage.close()
+                    self.discard_coverage(stream_id)
                 finally:
                     self._bad_coverages[stream_id] = 1
                     raise CorruptionError(e.message)
@@ -520,45 +693,50 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         # Actual persistence
         #--------------------------------------------------------------------------------
 
-        elements = len(rdt)
-        if rdt[rdt.temporal_parameter] is None:
-            elements = 0 
+        try:
+            elements = len(rdt)
+            if rdt[rdt.temporal_parameter] is None:
+                elements = 0 
 
-        self.insert_sparse_values(coverage,rdt,stream_id)
+            self.insert_sparse_values(coverage,rdt,stream_id)
         
-        if debugging:
-            timer.complete_step('checks') # lightweight ops, should be zero
+            if debugging:
+                timer.complete_step('checks') # lightweight ops, should be zero
         
-        self.expand_coverage(coverage, elements, stream_id)
+            self.expand_coverage(coverage, elements, stream_id)
         
-        if debugging:
-            timer.complete_step('insert')
+            if debugging:
+                timer.complete_step('insert')
 
-        self.insert_values(coverage, rdt, stream_id)
+            self.insert_values(coverage, rdt, stream_id)
         
-        if debugging:
-            timer.complete_step('keys')
+            if debugging:
+                timer.complete_step('keys')
         
-        DatasetManagementService._save_coverage(coverage)
+            DatasetManagementService._save_coverage(coverage)
+            self.update_time_index(coverage)
+            self.update_summary(coverage)
         
-        if debugging:
-            timer.complete_step('save')
+            if debugging:
+                timer.complete_step('save')
         
-        start_index = coverage.num_timesteps - elements
+            start_index = coverage.num_timesteps - elements
 
-        if not self.ignore_gaps and gap_found:
-            self.splice_coverage(dataset_id, coverage)
+            if not self.ignore_gaps and gap_found:
+                self.splice_coverage(dataset_id, coverage)
 
-        self.evaluate_qc(rdt, dataset_id)
+            self.evaluate_qc(rdt, dataset_id)
         
-        if debugging:
-            timer.complete_step('notify')
-            self._add_timing_stats(timer)
+            if debugging:
+                timer.complete_step('notify')
+                self._add_timing_stats(timer)
 
-        self.update_connection_index(rdt.connection_id, rdt.connection_index)
+            self.update_connection_index(rdt.connection_id, rdt.connection_index)
 
-        self.update_metadata(dataset_id, rdt)
-        self.dataset_changed(dataset_id,coverage.num_timesteps,(start_index,start_index+elements))
+            self.update_metadata(dataset_id, rdt)
+            self.dataset_changed(dataset_id,coverage.num_timesteps,(start_index,start_index+elements))
+        finally:
+            self.release_coverage(stream_id, coverage)
 
     def _add_timing_stats(self, timer):
         """ add stats from latest coverage operation to Accumulator and periodically log results """
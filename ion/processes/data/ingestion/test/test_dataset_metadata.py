@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/ingestion/test/test_dataset_metadata.py
+@brief Tests for the dataset metadata accumulator
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.core.exception import Conflict, NotFound
+from ion.processes.data.ingestion.dataset_metadata import DatasetSummary, DatasetMetadataAccumulator
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import numpy as np
+
+
+class FakeRDT(dict):
+    temporal_parameter = 'time'
+
+    def __len__(self):
+        return len(self['time'])
+
+
+@attr('UNIT',group='dm')
+class DatasetMetadataTest(PyonTestCase):
+    def rdt(self, time, temp):
+        return FakeRDT(time=np.array(time, dtype='float64'), temp=np.array(temp, dtype='float32'), name=np.array(['a'] * len(time)))
+
+    def test_merge_commutes(self):
+        s1 = DatasetSummary.from_rdt(self.rdt([0, 1, 2], [10, 5, 7]))
+        s2 = DatasetSummary.from_rdt(self.rdt([3, 4], [2, 12]))
+
+        for merged in (DatasetSummary.from_rdt(self.rdt([0, 1, 2], [10, 5, 7])).merge(s2),
+                       DatasetSummary.from_rdt(self.rdt([3, 4], [2, 12])).merge(s1)):
+            self.assertEquals(merged.bounds['temp'], (2, 12))
+            self.assertEquals(merged.bounds['time'], (0, 4))
+            self.assertEquals(merged.extents, {'time':5, 'temp':5, 'name':5})
+            self.assertEquals(merged.last_values['temp'], 12)
+            self.assertEquals(merged.last_time, 4)
+            self.assertNotIn('name', merged.bounds)
+
+    def test_accumulator_batches_writes(self):
+        object_store = Mock()
+        object_store.read_doc.side_effect = NotFound()
+        accumulator = DatasetMetadataAccumulator(object_store)
+        for i in xrange(10):
+            accumulator.add('dataset_id', self.rdt([i], [i]))
+        self.assertFalse(object_store.create_doc.called)
+
+        accumulator.flush()
+        self.assertEquals(object_store.create_doc.call_count, 1)
+        doc = object_store.create_doc.call_args[0][0]
+        self.assertEquals(doc['extents']['time'], 10)
+        self.assertEquals(doc['bounds']['temp'], (0, 9))
+        self.assertEquals(doc['last_values']['time'], 9)
+        self.assertEquals(accumulator.pending(), [])
+
+    def test_accumulator_retries_conflicts(self):
+        stored = {'_id':'dataset_id', 'bounds':{'temp':[-1, 3]}, 'extents':{'time':4, 'temp':4}, 'last_values':{'time':3, 'temp':3}, 'size':32}
+        object_store = Mock()
+        object_store.read_doc.side_effect = lambda key: dict(stored)
+        object_store.update_doc.side_effect = [Conflict(), None]
+
+        accumulator = DatasetMetadataAccumulator(object_store)
+        accumulator.add('dataset_id', self.rdt([4, 5], [20, 1]))
+        accumulator.flush()
+
+        self.assertEquals(object_store.update_doc.call_count, 2)
+        doc = object_store.update_doc.call_args[0][0]
+        self.assertEquals(doc['bounds']['temp'], (-1, 20))
+        self.assertEquals(doc['extents']['temp'], 6)
+        self.assertEquals(doc['last_values']['temp'], 1)
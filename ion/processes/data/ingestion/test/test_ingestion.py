@@ -7,7 +7,11 @@
 
 from pyon.util.unit_test import PyonTestCase
 from ion.processes.data.ingestion.science_granule_ingestion_worker import ScienceGranuleIngestionWorker
+from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
+from ion.util.summary_pyramid import SummaryPyramid
 from nose.plugins.attrib import attr
+from mock import Mock, patch
+import gevent
 
 
 @attr('UNIT',group='dm')
@@ -39,5 +43,104 @@ class IngestionTest(PyonTestCase):
         self.assertFalse(ingestion.has_gap('',''))
         self.assertFalse(ingestion.has_gap('',''))
 
+    def test_ingestion_batching(self):
+        ingestion = ScienceGranuleIngestionWorker()
+        ingestion.batch_size = 3
+        ingestion.ignore_gaps = False
+        ingestion.persist_or_timeout = Mock()
+
+        def granule(connection_index):
+            rdt = Mock()
+            rdt._stream_def = 'stream_def_id'
+            rdt.connection_id = 'c1'
+            rdt.connection_index = connection_index
+            return rdt
+
+        with patch.object(RecordDictionaryTool, 'concatenate') as concatenate:
+            ingestion.buffer_granule('stream_id', granule('1'))
+            ingestion.buffer_granule('stream_id', granule('2'))
+            self.assertFalse(ingestion.persist_or_timeout.called)
+            ingestion.buffer_granule('stream_id', granule('3'))
+            self.assertEquals(ingestion.persist_or_timeout.call_count, 1)
+            self.assertEquals(len(concatenate.call_args[0][0]), 3)
+            self.assertEquals(ingestion.connection_index, 3)
+
+            # A gap in the connection index commits the pending batch before buffering
+            ingestion.buffer_granule('stream_id', granule('4'))
+            ingestion.buffer_granule('stream_id', granule('9'))
+            self.assertEquals(ingestion.persist_or_timeout.call_count, 2)
+            self.assertEquals(len(concatenate.call_args[0][0]), 1)
+
+            ingestion.flush_batches()
+            self.assertEquals(ingestion.persist_or_timeout.call_count, 3)
+            self.assertFalse(ingestion._batches)
+
+    def test_ingestion_batch_failure(self):
+        ingestion = ScienceGranuleIngestionWorker()
+        ingestion.batch_size = 2
+        ingestion.ignore_gaps = True
+
+        def unlocked():
+            if ingestion._batch_lock.acquire(blocking=False):
+                ingestion._batch_lock.release()
+                return True
+            return False
+
+        def persist(stream_id, rdts):
+            # Other streams can be buffered while a batch is persisted
+            self.assertTrue(gevent.spawn(unlocked).get(timeout=1))
+            persisted.append(list(rdts))
+            if fail:
+                raise IOError('coverage unavailable')
+        persisted = []
+        ingestion.persist_or_timeout = Mock(side_effect=persist)
+
+        rdts = [Mock(_stream_def='stream_def_id', connection_id='', connection_index='') for i in xrange(3)]
+        with patch.object(RecordDictionaryTool, 'concatenate', side_effect=lambda rdts: rdts):
+            fail = True
+            ingestion.buffer_granule('stream_id', rdts[0])
+            with self.assertRaises(IOError):
+                ingestion.buffer_granule('stream_id', rdts[1])
+            # The batch is kept and retried, ahead of the granules buffered since
+            with self.assertRaises(IOError):
+                ingestion.buffer_granule('stream_id', rdts[2])
+            fail = False
+            ingestion.flush_batches()
+        self.assertEquals(persisted, [rdts[:2], rdts[:2], rdts[:2], [rdts[2]]])
+        self.assertFalse(ingestion._batches)
+        self.assertFalse(ingestion._flushing)
+
+    def test_summary_pyramid(self):
+        ingestion = ScienceGranuleIngestionWorker()
+        pyramid = Mock()
+        coverage = Mock(persistence_dir='/tmp/dataset_id')
+
+        with patch.object(SummaryPyramid, 'for_coverage', return_value=pyramid) as for_coverage:
+            # Granules only update the pyramid in memory
+            ingestion.update_summary(coverage)
+            ingestion.update_summary(coverage)
+            self.assertEquals(for_coverage.call_count, 2)
+            self.assertFalse(pyramid.save.called)
+
+        ingestion.flush_summaries()
+        pyramid.save.assert_called_once_with('/tmp/dataset_id/summary_pyramid.npz')
+        ingestion.flush_summaries()
+        self.assertEquals(pyramid.save.call_count, 1)
+
+    def test_close_coverages(self):
+        ingestion = ScienceGranuleIngestionWorker()
+        ingestion.CACHE_LIMIT = 1
+        ingestion._new_dataset = lambda stream_id: 'dataset_%s' % stream_id
+        ingestion.coverage_pool = Mock()
 
+        ingestion.get_coverage('s1')
+        ingestion.get_coverage('s2')
+        self.assertEquals(ingestion._datasets.values(), ['dataset_s2'])
 
+        # Datasets evicted from the cache still have their append handles closed
+        ingestion.close_coverages()
+        self.assertEquals(sorted(call[0] for call in ingestion.coverage_pool.invalidate.call_args_list),
+                          [('dataset_s1', 'a'), ('dataset_s2', 'a')])
+        ingestion.coverage_pool.invalidate.reset_mock()
+        ingestion.close_coverages()
+        self.assertFalse(ingestion.coverage_pool.invalidate.called)
@@ -15,6 +15,7 @@ from pyon.util.log import log
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
 from ion.util.time_utils import TimeUtils
+from ion.util.summary_pyramid import SummaryPyramid
 
 from coverage_model import utils
 from coverage_model.parameter_functions import ParameterFunctionException
@@ -44,11 +45,18 @@ class ReplayProcess(BaseReplayProcess):
         start_time: 0         # Start time (index value) to be replayed
         end_time:   0         # End time (index value) to be replayed
         parameters: []        # List of parameters to form in the granule
+        publish_limit: 10     # Number of records per published granule
+        chunk_size: 0         # Number of records read from the coverage at a time
+        chunk_bytes: 0        # Approximate size in bytes of each read, used if chunk_size is unset
+        read_ahead: False     # Read the next chunk on a greenlet while the current one publishes
       
 
     '''
     process_type  = 'standalone'
     publish_limit = 10
+    chunk_size    = 0
+    chunk_bytes   = 0
+    read_ahead    = False
     dataset_id    = None
     delivery_format = {}
     start_time      = None
@@ -82,6 +90,9 @@ class ReplayProcess(BaseReplayProcess):
         self.stride_time     = self.CFG.get_safe('process.query.stride_time', None)
         self.parameters      = self.CFG.get_safe('process.query.parameters',None)
         self.publish_limit   = self.CFG.get_safe('process.query.publish_limit', 10)
+        self.chunk_size      = self.CFG.get_safe('process.query.chunk_size', 0)
+        self.chunk_bytes     = self.CFG.get_safe('process.query.chunk_bytes', 0)
+        self.read_ahead      = self.CFG.get_safe('process.query.read_ahead', False)
         self.tdoa            = self.CFG.get_safe('process.query.tdoa',None)
         self.stream_id       = self.CFG.get_safe('process.publish_streams.output', '')
         self.stream_def      = pubsub.read_stream_definition(stream_id=self.stream_id)
@@ -145,6 +156,50 @@ class ReplayProcess(BaseReplayProcess):
         return rdt
 
 
+    @classmethod
+    def _summary_to_granule(cls, coverage, resolution, start_time=None, end_time=None, aggregate='mean', parameters=None, stream_def_id=None):
+        '''
+        Builds a granule of one record per bucket of the coverage's summary pyramid, each parameter holding the
+        aggregate (mean, min or max) of its values in the bucket.  Returns None if a requested field isn't
+        summarized (e.g. parameter functions or non-numeric parameters) or no level of the pyramid is fine
+        enough for the resolution, then the raw values have to be read instead.
+        '''
+        if aggregate not in ('mean', 'min', 'max'):
+            raise BadRequest('Unknown aggregate %s' % aggregate)
+        try:
+            resolution = float(resolution)
+        except (TypeError, ValueError):
+            raise BadRequest('resolution must be a number of seconds')
+        if stream_def_id:
+            rdt = RecordDictionaryTool(stream_definition_id=stream_def_id)
+        else:
+            rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
+        fields = [field for field in rdt.fields if field != coverage.temporal_parameter_name and (parameters is None or field in parameters)]
+
+        pyramid = SummaryPyramid.for_coverage(coverage, persist=False)
+        if not set(fields).issubset(pyramid.parameters):
+            return None
+        if start_time is not None:
+            start_time = cls.convert_time(coverage, start_time)
+        if end_time is not None:
+            end_time = cls.convert_time(coverage, end_time)
+        summary = pyramid.query(resolution, start_time, end_time, fields)
+        if summary is None:
+            return None
+        level, times, stats = summary
+        log.debug('Serving %s buckets from summary level %s of %s', times.shape[0], level, coverage.persistence_dir)
+
+        if not times.shape[0]:
+            return rdt
+        rdt[coverage.temporal_parameter_name] = times
+        for field in fields:
+            values = stats[field][aggregate]
+            missing = np.isnan(values)
+            if missing.any():
+                values = np.where(missing, coverage.get_parameter_context(field).fill_value, values)
+            rdt[field] = values
+        return rdt
+
     @classmethod
     def _coverage_to_granule(cls, coverage, start_time=None, end_time=None, stride_time=None, fuzzy_stride=True, parameters=None, stream_def_id=None, tdoa=None):
         slice_ = slice(None) # Defaults to all values
@@ -163,7 +218,7 @@ class ReplayProcess(BaseReplayProcess):
         
         elif stride_time is not None and not fuzzy_stride: # SLOW 
             ugly_range = np.arange(start_time, end_time, stride_time)
-            idx_values = [cls.get_time_idx(coverage,i) for i in ugly_range]
+            idx_values = TimeUtils.get_relative_times(coverage, [cls.convert_time(coverage, i) for i in ugly_range])
             idx_values = list(set(idx_values)) # Removing duplicates - also mixes the order of the list!!!
             idx_values.sort()
             slice_ = [idx_values]
@@ -290,21 +345,97 @@ class ReplayProcess(BaseReplayProcess):
         
         return rdt.to_granule()
 
-    def _replay(self):
-        coverage = DatasetManagementService._get_coverage(self.dataset_id,mode='r')
-        rdt = self._coverage_to_granule(coverage=coverage, start_time=self.start_time, end_time=self.end_time, stride_time=self.stride_time, parameters=self.parameters, stream_def_id=self.stream_def_id)
-        elements = len(rdt)
-        
-        for i in xrange(elements / self.publish_limit):
-            outgoing = RecordDictionaryTool(stream_definition_id=self.stream_def_id)
-            fields = self.parameters or outgoing.fields
-            for field in fields:
-                v = rdt[field]
-                if v is not None:
-                    outgoing[field] = v[(i*self.publish_limit) : ((i+1)*self.publish_limit)]
-            yield outgoing
-        coverage.close(timeout=5)
-        return 
+    @classmethod
+    def _record_size(cls, coverage, fields):
+        '''
+        Rough estimate of the number of bytes a single record occupies in memory
+        '''
+        size = 0
+        for field in fields:
+            try:
+                size += np.dtype(coverage.get_parameter_context(field).param_type.value_encoding).itemsize
+            except (AttributeError, KeyError, TypeError):
+                size += 8
+        return max(size, 1)
+
+    def _window_size(self, coverage, fields):
+        '''
+        Number of records read from the coverage at a time, always a multiple of publish_limit
+        '''
+        if self.chunk_size:
+            window = self.chunk_size
+        elif self.chunk_bytes:
+            window = self.chunk_bytes / self._record_size(coverage, fields)
+        else:
+            window = self.publish_limit * 100
+        window = max(window, self.publish_limit)
+        return window - (window % self.publish_limit)
+
+    @classmethod
+    def _replay_slices(cls, start_idx, end_idx, stride, window):
+        '''
+        Splits the index range [start_idx, end_idx) into slices yielding at most window records each
+        '''
+        span = window * stride
+        for lower in xrange(start_idx, end_idx, span):
+            yield slice(lower, min(lower + span, end_idx), stride)
+
+    def _read_windows(self, coverage, slices):
+        '''
+        Reads each slice of the coverage into a record dictionary, optionally reading the
+        next window on a greenlet while the caller is busy with the current one
+        '''
+        def read(slice_):
+            return self._coverage_to_granule(coverage=coverage, parameters=self.parameters, stream_def_id=self.stream_def_id, tdoa=slice_)
 
+        if not self.read_ahead:
+            for slice_ in slices:
+                yield read(slice_)
+            return
 
+        pending = upcoming = None
+        try:
+            for slice_ in slices:
+                upcoming = gevent.spawn(read, slice_)
+                if pending is not None:
+                    yield pending.get()
+                pending = upcoming
+            if pending is not None:
+                yield pending.get()
+        finally:
+            # The consumer may stop early, don't leave a read running against a closing coverage
+            if upcoming is not None:
+                upcoming.kill()
 
+    def _replay(self):
+        '''
+        Reads the requested range from the coverage in bounded windows and yields
+        granules of at most publish_limit records, including the final partial one.
+        '''
+        coverage = DatasetManagementService._get_coverage(self.dataset_id,mode='r')
+        try:
+            start_idx = 0
+            end_idx = coverage.num_timesteps
+            if self.start_time is not None:
+                validate_is_instance(self.start_time, Number, 'start_time must be a number for striding.')
+                start_idx = self.get_time_idx(coverage, self.start_time)
+            if self.end_time is not None:
+                validate_is_instance(self.end_time, Number, 'end_time must be a number for striding.')
+                end_idx = self.get_time_idx(coverage, self.end_time)
+            stride = int(self.stride_time or 1)
+
+            fields = self.parameters or RecordDictionaryTool(stream_definition_id=self.stream_def_id).fields
+            window = self._window_size(coverage, fields)
+            slices = self._replay_slices(start_idx, end_idx, stride, window)
+
+            for rdt in self._read_windows(coverage, slices):
+                elements = len(rdt)
+                for i in xrange(0, elements, self.publish_limit):
+                    outgoing = RecordDictionaryTool(stream_definition_id=self.stream_def_id)
+                    for field in self.parameters or outgoing.fields:
+                        v = rdt[field]
+                        if v is not None:
+                            outgoing[field] = v[i:i+self.publish_limit]
+                    yield outgoing
+        finally:
+            coverage.close(timeout=5)
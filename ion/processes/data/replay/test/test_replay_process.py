@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/replay/test/test_replay_process.py
+@brief Unit tests for the replay process
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.replay.replay_process import ReplayProcess
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+import numpy as np
+
+
+@attr('UNIT',group='dm')
+class ReplayProcessUnitTest(PyonTestCase):
+    def test_replay_slices(self):
+        slices = list(ReplayProcess._replay_slices(0, 25, 1, 10))
+        self.assertEquals(slices, [slice(0,10,1), slice(10,20,1), slice(20,25,1)])
+
+        # Every record in the range is covered exactly once
+        covered = []
+        for slice_ in ReplayProcess._replay_slices(3, 1003, 3, 40):
+            covered.extend(range(slice_.start, slice_.stop, slice_.step))
+        self.assertEquals(covered, range(3, 1003, 3))
+
+        self.assertEquals(list(ReplayProcess._replay_slices(5, 5, 1, 10)), [])
+
+    def test_window_size(self):
+        replay = ReplayProcess()
+        replay.publish_limit = 10
+        replay.chunk_size = 25
+        self.assertEquals(replay._window_size(None, []), 20)
+
+        replay.chunk_size = 0
+        replay.chunk_bytes = 8000
+        replay._record_size = lambda coverage, fields: 16
+        self.assertEquals(replay._window_size(None, []), 500)
+
+        replay.chunk_bytes = 1
+        self.assertEquals(replay._window_size(None, []), 10)
+
+    @patch('ion.processes.data.replay.replay_process.SummaryPyramid')
+    @patch('ion.processes.data.replay.replay_process.RecordDictionaryTool')
+    def test_summary_to_granule(self, rdt_cls, pyramid_cls):
+        coverage = Mock(temporal_parameter_name='time')
+        rdt = {}
+        rdt_cls.return_value = Mock(fields=['time', 'temp', 'density'])
+        rdt_cls.return_value.__setitem__ = lambda self, field, values: rdt.__setitem__(field, values)
+        pyramid = pyramid_cls.for_coverage.return_value
+        pyramid.parameters = ['temp']
+        pyramid.query.return_value = (1, np.array([0., 600.]), {'temp': {'mean': np.array([1., 2.])}})
+
+        # density (e.g. a parameter function) isn't summarized, the raw values are read instead
+        self.assertIsNone(ReplayProcess._summary_to_granule(coverage, 600))
+        self.assertFalse(pyramid.query.called)
+
+        ReplayProcess._summary_to_granule(coverage, 600, parameters=['temp'])
+        pyramid.query.assert_called_once_with(600., None, None, ['temp'])
+        self.assertEquals(sorted(rdt), ['temp', 'time'])
+        np.testing.assert_array_equal(rdt['temp'], [1., 2.])
@@ -12,8 +12,8 @@ from pyon.util.async import spawn
 from pyon.core.exception import BadRequest, NotFound
 from ion.core.process.transform import TransformEventListener
 from pyon.event.event import EventSubscriber
-from ion.services.dm.utility.uns_utility_methods import send_email, calculate_reverse_user_info
-from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, check_user_notification_interest
+from ion.services.dm.utility.subscription_index import SubscriptionIndex
+from ion.services.dm.utility.email_delivery import EmailDelivery
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 
 import gevent, time
@@ -25,6 +25,7 @@ class NotificationWorker(TransformEventListener):
     """
     def on_init(self):
         self.user_info = {}
+        self.subscriptions = SubscriptionIndex()
         self.resource_registry = ResourceRegistryServiceClient()
         self.q = gevent.queue.Queue()
 
@@ -42,13 +43,17 @@ class NotificationWorker(TransformEventListener):
         self.reverse_user_info = None
         self.user_info = None
 
+        self.email_delivery = EmailDelivery(self.resource_registry)
+        self.email_delivery.start(self._process.thread_manager)
+
         #------------------------------------------------------------------------------------
         # Start by loading the user info and reverse user info dictionaries
         #------------------------------------------------------------------------------------
 
         try:
             self.user_info = self.load_user_info()
-            self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+            self.subscriptions.update(self.user_info)
+            self.reverse_user_info = self.subscriptions.reverse_user_info()
 
             log.debug("On start up, notification workers loaded the following user_info dictionary: %s" % self.user_info)
             log.debug("The calculated reverse user info: %s" % self.reverse_user_info )
@@ -73,7 +78,10 @@ class NotificationWorker(TransformEventListener):
             except NotFound:
                 log.warning("ElasticSearch has not yet loaded the user_index.")
 
-            self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+            # Only the users whose subscriptions changed are reindexed
+            changed = self.subscriptions.update(self.user_info or {})
+            log.debug("Reindexed the subscriptions of %s users", len(changed))
+            self.reverse_user_info = self.subscriptions.reverse_user_info()
             self.test_hook(self.user_info, self.reverse_user_info)
 
             #log.debug("After a reload, the user_info: %s" % self.user_info)
@@ -99,34 +107,30 @@ class NotificationWorker(TransformEventListener):
 
         self.add_endpoint(self.userinfo_rsc_mod_subscriber)
 
+    def on_quit(self):
+        self.email_delivery.stop()
+        log.debug('Notification worker email delivery: %s', self.email_delivery.stats())
+        super(NotificationWorker, self).on_quit()
+
     def process_event(self, msg, headers):
         """
         Callback method for the subscriber listening for all events
         """
         #------------------------------------------------------------------------------------
-        # From the reverse user info dict find out which users have subscribed to that event
+        # From the subscription index find out which users have subscribed to that event
         #------------------------------------------------------------------------------------
 
-        user_ids = []
-        if self.reverse_user_info:
-            user_ids = check_user_notification_interest(event = msg, reverse_user_info = self.reverse_user_info)
-
-            #log.debug('process_event  user_ids: %s', user_ids)
+        user_ids = self.subscriptions.match(msg)
 
-            #log.debug("Notification worker found interested users %s" % user_ids)
+        #log.debug("Notification worker found interested users %s" % user_ids)
 
         #------------------------------------------------------------------------------------
-        # Send email to the users
+        # Queue the emails to the users, they're sent asynchronously
         #------------------------------------------------------------------------------------
 
         for user_id in user_ids:
             msg_recipient = self.user_info[user_id]['user_contact'].email
-            self.smtp_client = setting_up_smtp_client()
-            send_email(event=msg,
-                       msg_recipient=msg_recipient,
-                       smtp_client=self.smtp_client,
-                       rr_client=self.resource_registry)
-            self.smtp_client.quit()
+            self.email_delivery.notify(msg, msg_recipient)
 
     def get_user_notifications(self, user_info_id=''):
         """
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/transforms/test/test_highcharts.py
+@brief Tests for the HighCharts series builder and its downsampling
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from pyon.core.exception import BadRequest
+from ion.processes.data.transforms.viz.highcharts import VizTransformHighChartsAlgorithm
+from ion.processes.data.transforms.viz.downsampling import minmax_indices, lttb_indices
+from nose.plugins.attrib import attr
+
+import numpy as np
+import time
+
+
+@attr('UNIT',group='dm')
+class HighChartsSeriesTest(PyonTestCase):
+    def test_series_data_num(self):
+        timestamps = np.array([1., 2., -9999., 4.])
+        values = np.array([1.23456, -9999., 3., np.nan])
+        data = VizTransformHighChartsAlgorithm.form_series_data_num(timestamps, values, None, -9999., -9999., 2)
+        self.assertEquals(data.tolist(), [[1000., 1.23], [2000., None], [4000., None]])
+
+        values = np.array([[1., 10.], [2., 20.], [3., 30.], [4., 40.]])
+        data = VizTransformHighChartsAlgorithm.form_series_data_num(timestamps, values, 1, -9999., -9999., 2)
+        self.assertEquals(data.tolist(), [[1000., 10.], [2000., 20.], [4000., 40.]])
+
+    def test_series_data_str(self):
+        timestamps = np.array([1., 2., 3., 4.])
+        values = np.array(['a', '', 'fill', 'd'])
+        data = VizTransformHighChartsAlgorithm.form_series_data_str(timestamps, values, None, -9999., 'fill')
+        self.assertEquals(data.tolist(), [[1000., 'a'], [2000., None], [3000., None], [4000., 'd']])
+
+        values = np.array([1, None, 0, 'x'], dtype=object)
+        data = VizTransformHighChartsAlgorithm.form_series_data_str(timestamps, values, None, -9999., None)
+        self.assertEquals(data.tolist(), [[1000., '1'], [2000., None], [3000., None], [4000., 'x']])
+
+    def test_downsample_config(self):
+        self.assertIsNone(VizTransformHighChartsAlgorithm.downsample_config({'parameters' : []}))
+        self.assertEquals(VizTransformHighChartsAlgorithm.downsample_config({'pixel_width' : '800'}), ('minmax', 800))
+        self.assertEquals(VizTransformHighChartsAlgorithm.downsample_config({'pixel_width' : 800, 'downsample' : 'lttb'}), ('lttb', 800))
+        with self.assertRaises(BadRequest):
+            VizTransformHighChartsAlgorithm.downsample_config({'pixel_width' : 800, 'downsample' : 'average'})
+
+    def test_minmax(self):
+        x = np.arange(100, dtype='float64')
+        y = np.sin(x)
+        indices = minmax_indices(x, y, 10)
+        self.assertTrue(len(indices) <= 20)
+        for bucket in xrange(10):
+            selected = indices[(indices >= bucket * 10) & (indices < bucket * 10 + 10)]
+            window = y[bucket * 10:bucket * 10 + 10]
+            self.assertEquals(sorted(y[selected]), [window.min(), window.max()])
+        # Short series are left alone
+        np.testing.assert_array_equal(minmax_indices(x, y, 50), np.arange(100))
+
+    def test_lttb(self):
+        x = np.arange(1000, dtype='float64')
+        y = np.zeros(1000)
+        y[500] = 100. # A spike has to survive
+        indices = lttb_indices(x, y, 50)
+        self.assertEquals(len(indices), 50)
+        self.assertEquals((indices[0], indices[-1]), (0, 999))
+        self.assertIn(500, indices)
+        self.assertTrue((np.diff(indices) > 0).all())
+
+    def test_downsampled_series(self):
+        timestamps = np.arange(10000, dtype='float64')
+        values = np.random.random(10000)
+        values[5000] = -9999.
+        data = VizTransformHighChartsAlgorithm.form_series_data_num(timestamps, values, None, -9999., -9999., 5, ('lttb', 500))
+        self.assertEquals(data.shape, (500, 2))
+        self.assertNotIn(None, data[:, 1].tolist())
+
+
+@attr('BENCHMARK',group='dm')
+class HighChartsSeriesBenchmark(PyonTestCase):
+    def test_series_throughput(self):
+        timestamps = np.arange(1000000, dtype='float64') + 3600000000.
+        values = np.random.random(1000000)
+
+        then = time.time()
+        data = VizTransformHighChartsAlgorithm.form_series_data_num(timestamps, values, None, -9999., -9999., 5)
+        elapsed = time.time() - then
+        log.info('Built a 1,000,000 point series in %.3fs', elapsed)
+        self.assertEquals(len(data), 1000000)
+
+        for method in ('minmax', 'lttb'):
+            then = time.time()
+            data = VizTransformHighChartsAlgorithm.form_series_data_num(timestamps, values, None, -9999., -9999., 5, (method, 1200))
+            log.info('Downsampled a 1,000,000 point series to %d points with %s in %.3fs', len(data), method, time.time() - then)
+            self.assertTrue(len(data) <= 2400)
@@ -8,6 +8,7 @@
 from ion.services.dm.utility.granule import RecordDictionaryTool
 from pyon.ion.stream import StandaloneStreamPublisher,StandaloneStreamSubscriber, StreamPublisher
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from coverage_model import ParameterContext, AxisTypeEnum, QuantityType, ConstantType, NumexprFunction, ParameterFunctionType, VariabilityEnum 
 from interface.services.sa.idata_process_management_service import DataProcessManagementServiceClient
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
@@ -20,7 +21,71 @@ import numpy as np
 import unittest
 import os
 from gevent.event import Event
-from ion.processes.data.transforms.transform_prime import TransformPrime
+from ion.processes.data.transforms.transform_prime import TransformPrime, TransformPlan
+from mock import Mock
+from collections import OrderedDict
+
+
+@attr('UNIT',group='dm')
+class TestTransformPlan(PyonTestCase):
+    def function(self, args, param_map=None):
+        ptype = Mock(spec=ParameterFunctionType)
+        ptype.function = DotDict(arg_list=args, param_map=param_map)
+        return ptype
+
+    def test_evaluation_order(self):
+        parsed = DotDict()
+        parsed.fields = ['density', 'salinity', 'time', 'temp', 'pressure']
+        parsed.param_types = {
+            'density'  : self.function(['s', 't', 'p'], {'s':'salinity', 't':'temp', 'p':'pressure'}),
+            'salinity' : self.function(['temp', 'pressure']),
+            'time'     : Mock(),
+            'temp'     : Mock(),
+            'pressure' : self.function(['time']),
+        }
+        self.assertEquals(TransformPlan.evaluation_order(parsed), ['pressure', 'salinity', 'density'])
+
+    def test_plan_invalidation(self):
+        transform = TransformPrime()
+        transform._plans = {}
+        transform._stream_defs = OrderedDict()
+        transform._compile = Mock(side_effect=lambda streams, actor=None: TransformPlan(DotDict(_id='def_in'), DotDict(_id='def_out')))
+
+        plan = transform.get_plan(('in', 'out'))
+        plan.lookups = []
+        self.assertIs(transform.get_plan(('in', 'out')), plan)
+        self.assertEquals(transform._compile.call_count, 1)
+
+        # Lookup documents only reset the lookup values
+        transform.input_data_product_ids = transform.output_data_product_ids = []
+        transform._add_lookups(DotDict(origin='product', reference_keys=[]))
+        self.assertIs(transform.get_plan(('in', 'out')), plan)
+        self.assertIsNone(plan.lookups)
+
+        transform._stream_def_modified(DotDict(origin='unrelated'))
+        self.assertIs(transform.get_plan(('in', 'out')), plan)
+        transform._stream_def_modified(DotDict(origin='def_out'))
+        self.assertIsNot(transform.get_plan(('in', 'out')), plan)
+        self.assertEquals(transform._compile.call_count, 2)
+
+    def test_stream_def_limit(self):
+        transform = TransformPrime()
+        transform.STREAM_DEF_LIMIT = 2
+        transform._plans = {}
+        transform._stream_defs = OrderedDict()
+        transform.pubsub_management = Mock()
+        transform.pubsub_management.read_stream_definition.side_effect = lambda stream_id: DotDict(_id='def_%s' % stream_id)
+
+        transform.read_stream_def('a')
+        transform.read_stream_def('b')
+        transform.read_stream_def('a')
+        self.assertEquals(transform.pubsub_management.read_stream_definition.call_count, 2)
+        # The least recently used definition makes room
+        transform.read_stream_def('c')
+        self.assertEquals(transform._stream_defs.keys(), ['a', 'c'])
+
+        transform._stream_def_modified(DotDict(origin='def_a'))
+        self.assertEquals(transform._stream_defs.keys(), ['c'])
 
 
 @attr('INT',group='dm')
@@ -9,19 +9,76 @@ from ion.core.process.transform import TransformDataProcess
 from coverage_model import ParameterDictionary
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceProcessClient
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
+from ion.services.dm.utility.granule.pdict_cache import ParsedParameterDictionary, ParameterDictionaryCache
 from coverage_model import get_value_class
 from coverage_model.parameter_types import ParameterFunctionType
-from pyon.util.memoize import memoize_lru
 from pyon.util.log import log
 from pyon.core.exception import NotFound
 from pyon.ion.event import EventSubscriber
 from ion.util.stored_values import StoredValueManager
-from pyon.public import OT
+from pyon.public import OT, RT
 
 from gevent.event import Event
 from gevent.queue import Queue
+import collections
+
+
+class TransformPlan(object):
+    '''
+    Everything TransformPrime needs to run a route that doesn't depend on the
+    granule: the output stream definition and either the resolved actor or the
+    merged parameter dictionary, the fields to copy from the input, the
+    parameter functions in evaluation order and the lookup values.
+    '''
+    def __init__(self, stream_def_in, stream_def_out):
+        self.stream_def_in  = stream_def_in
+        self.stream_def_out = stream_def_out
+        self.executor       = None
+        self.parsed         = None
+        self.copy_fields    = []
+        self.functions      = []
+        self.out_fields     = []
+        self.lookups        = None # [(field, value, per_record)], resolved on first use
+
+    def depends_on(self, stream_def_id):
+        return stream_def_id in (self.stream_def_in._id, self.stream_def_out._id)
+
+    @staticmethod
+    def function_arguments(ptype):
+        '''
+        Names of the parameters a parameter function is evaluated from
+        '''
+        function = getattr(ptype, 'function', None)
+        param_map = getattr(function, 'param_map', None) or {}
+        args = [param_map.get(a, a) for a in getattr(function, 'arg_list', None) or []]
+        return [a for a in args if isinstance(a, basestring)]
+
+    @classmethod
+    def evaluation_order(cls, parsed):
+        '''
+        The parameter functions of a dictionary, each one after the functions it's evaluated from
+        '''
+        functions = [f for f in parsed.fields if isinstance(parsed.param_types[f], ParameterFunctionType)]
+        function_set = set(functions)
+        ordered, visited = [], set()
+        def visit(field, path):
+            if field in visited or field in path:
+                return # Done, or a cycle which gets evaluated in dictionary order
+            path.add(field)
+            for arg in cls.function_arguments(parsed.param_types[field]):
+                if arg in function_set:
+                    visit(arg, path)
+            path.discard(field)
+            visited.add(field)
+            ordered.append(field)
+        for field in functions:
+            visit(field, set())
+        return ordered
+
+
 class TransformPrime(TransformDataProcess):
     binding=['output']
+    STREAM_DEF_LIMIT = 100 # Stream definitions kept
     '''
     Transforms which have an incoming stream and an outgoing stream.
 
@@ -41,22 +98,99 @@ class TransformPrime(TransformDataProcess):
         self.output_data_product_ids = self.CFG.get_safe('process.output_products', [])
         self.lookup_docs = self.CFG.get_safe('process.lookup_docs',[])
         self.new_lookups = Queue()
+        self._stream_defs = collections.OrderedDict() # LRU of the stream definitions read
+        self._plans = {}
         self.lookup_monitor = EventSubscriber(event_type=OT.ExternalReferencesUpdatedEvent,callback=self._add_lookups, auto_delete=True)
         self.lookup_monitor.start()
+        self.stream_def_monitor = EventSubscriber(event_type=OT.ResourceModifiedEvent, origin_type=RT.StreamDefinition, callback=self._stream_def_modified, auto_delete=True)
+        self.stream_def_monitor.start()
 
     def on_quit(self):
         self.lookup_monitor.stop()
+        self.stream_def_monitor.stop()
         TransformDataProcess.on_quit(self)
 
     def _add_lookups(self, event, *args, **kwargs):
         if event.origin in self.input_data_product_ids + self.output_data_product_ids:
             if isinstance(event.reference_keys, list):
                 self.new_lookups.put(event.reference_keys)
+        # Lookup documents changed, the plans resolve their lookup values again
+        for plan in self._plans.itervalues():
+            plan.lookups = None
 
+    def _stream_def_modified(self, event, *args, **kwargs):
+        stream_def_id = event.origin
+        for stream_id in [k for k,v in self._stream_defs.iteritems() if v._id == stream_def_id]:
+            del self._stream_defs[stream_id]
+        for route in [k for k,v in self._plans.iteritems() if v.depends_on(stream_def_id)]:
+            del self._plans[route]
+        RecordDictionaryTool.invalidate_stream_def(stream_def_id)
 
-    @memoize_lru(100)
     def read_stream_def(self,stream_id):
-        return self.pubsub_management.read_stream_definition(stream_id=stream_id)
+        '''
+        Memoization (LRU) of the stream definitions, entries are dropped when their definition is modified
+        '''
+        try:
+            stream_def = self._stream_defs.pop(stream_id)
+        except KeyError:
+            stream_def = self.pubsub_management.read_stream_definition(stream_id=stream_id)
+            if len(self._stream_defs) >= self.STREAM_DEF_LIMIT:
+                self._stream_defs.popitem(last=False)
+        self._stream_defs[stream_id] = stream_def
+        return stream_def
+
+    def get_plan(self, streams, actor=None):
+        '''
+        Returns the compiled plan for a route, compiling it the first time the route is used
+        '''
+        try:
+            return self._plans[streams]
+        except KeyError:
+            plan = self._plans[streams] = self._compile(streams, actor)
+            return plan
+
+    def _compile(self, streams, actor=None):
+        stream_in_id, stream_out_id = streams
+        plan = TransformPlan(self.read_stream_def(stream_in_id), self.read_stream_def(stream_out_id))
+        if actor is not None:
+            plan.executor = self._load_actor(actor)
+            return plan
+
+        plan.parsed = ParsedParameterDictionary(self._merge_pdicts(plan.stream_def_in.parameter_dictionary, plan.stream_def_out.parameter_dictionary))
+        incoming_fields = ParameterDictionaryCache.get(plan.stream_def_in.parameter_dictionary, plan.stream_def_in._id).field_set
+        plan.copy_fields = [f for f in plan.parsed.fields if f in incoming_fields and not isinstance(plan.parsed.param_types[f], ParameterFunctionType)]
+        plan.functions   = TransformPlan.evaluation_order(plan.parsed)
+        plan.out_fields  = RecordDictionaryTool(stream_definition_id=plan.stream_def_out._id).fields
+        log.debug('Compiled the transform plan for %s: %s fields copied, %s functions', streams, len(plan.copy_fields), len(plan.functions))
+        return plan
+
+    def _resolve_lookups(self, plan):
+        '''
+        Reads the lookup values for the fields of a plan's merged dictionary
+        '''
+        lookups = []
+        lookup_fields = [f for f in plan.parsed.fields if hasattr(plan.parsed.contexts[f], 'lookup_value')]
+
+        document_fields = [f for f in lookup_fields if plan.parsed.contexts[f].document_key]
+        if document_fields:
+            doc_keys = list(set(plan.parsed.contexts[f].document_key for f in document_fields))
+            lookup_docs = dict(zip(doc_keys, self.stored_values.read_value_mult(doc_keys)))
+            for field in document_fields:
+                context = plan.parsed.contexts[field]
+                doc = lookup_docs[context.document_key]
+                if doc is None:
+                    log.debug('Reference Document for %s not found', context.document_key)
+                    continue
+                if context.lookup_value in doc:
+                    lookups.append((field, doc[context.lookup_value], True))
+
+        for field in lookup_fields:
+            if plan.parsed.contexts[field].document_key:
+                continue
+            stored_value = self._get_lookup_value(plan.parsed.contexts[field].lookup_value)
+            if stored_value is not None:
+                lookups.append((field, stored_value, False))
+        return lookups
 
     
     def recv_packet(self, msg, stream_route, stream_id):
@@ -98,13 +232,12 @@ class TransformPrime(TransformDataProcess):
 
    
     def _execute_actor(self, msg, actor, streams):
-        stream_in_id,stream_out_id = streams
-        stream_def_out = self.read_stream_def(stream_out_id)
+        plan = self.get_plan(streams, actor)
         params = self.CFG.get_safe('process.params', {})
         config = self.CFG.get_safe('process')
         #do the stuff with the actor
-        params['stream_def'] = stream_def_out._id
-        executor = self._load_actor(actor)
+        params['stream_def'] = plan.stream_def_out._id
+        executor = plan.executor
         try:
             rdt_out = executor(msg, None, config, params, None)
         except:
@@ -153,36 +286,31 @@ class TransformPrime(TransformDataProcess):
         return None
 
     def _execute_transform(self, msg, streams):
-        stream_in_id,stream_out_id = streams
-        stream_def_in = self.read_stream_def(stream_in_id)
-        stream_def_out = self.read_stream_def(stream_out_id)
+        plan = self.get_plan(streams)
+        if plan.lookups is None:
+            plan.lookups = self._resolve_lookups(plan)
 
-        rdt_temp = self._merge_rdt(stream_def_in, stream_def_out)
+        rdt_temp = RecordDictionaryTool(param_dictionary=plan.parsed)
         
         rdt_in = RecordDictionaryTool.load_from_granule(msg)
-        for field in rdt_temp.fields:
-            if not isinstance(rdt_temp._pdict.get_context(field).param_type, ParameterFunctionType):
-                try:
-                    rdt_temp[field] = rdt_in[field]
-                except KeyError:
-                    pass
-
-        rdt_temp.fetch_lookup_values()
-
-        for lookup_field in rdt_temp.lookup_values():
-            s = lookup_field
-            stored_value = self._get_lookup_value(rdt_temp.context(s).lookup_value)
-            if stored_value is not None:
-                rdt_temp[s] = stored_value
+        for field in plan.copy_fields:
+            try:
+                rdt_temp[field] = rdt_in[field]
+            except KeyError:
+                pass
+
+        for field, value, per_record in plan.lookups:
+            if per_record and rdt_temp._shp:
+                value = [value] * rdt_temp._shp[0]
+            rdt_temp[field] = value
         
-        for field in rdt_temp.fields:
-            if isinstance(rdt_temp._pdict.get_context(field).param_type, ParameterFunctionType):
-                rdt_temp[field] = rdt_temp[field]
+        for field in plan.functions:
+            rdt_temp[field] = rdt_temp[field]
 
         
-        rdt_out = RecordDictionaryTool(stream_definition_id=stream_def_out._id)
+        rdt_out = RecordDictionaryTool(stream_definition_id=plan.stream_def_out._id)
 
-        for field in rdt_out.fields:
+        for field in plan.out_fields:
             rdt_out[field] = rdt_temp[field]
         
         return rdt_out 
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/transforms/viz/downsampling.py
+@description Selection of the points of a series worth drawing at a given chart width
+'''
+
+import numpy as np
+
+
+def minmax_indices(x, y, buckets):
+    '''
+    Splits the x range in equal width buckets and keeps the minimum and the
+    maximum y of each bucket.  Returns the sorted indices of the kept points.
+    '''
+    n = x.shape[0]
+    if n <= 2 * buckets:
+        return np.arange(n)
+    x = np.asanyarray(x, dtype='float64')
+    x_min, x_max = x.min(), x.max()
+    if x_max == x_min:
+        bucket = np.zeros(n, dtype='int64')
+    else:
+        bucket = np.minimum(((x - x_min) / (x_max - x_min) * buckets).astype('int64'), buckets - 1)
+
+    order = np.arange(n) if (np.diff(bucket) >= 0).all() else np.argsort(bucket, kind='mergesort')
+    bucket = bucket[order]
+    y = np.asanyarray(y, dtype='float64')[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+    group = np.repeat(np.arange(starts.shape[0]), np.diff(np.concatenate([starts, [n]])))
+
+    kept = []
+    for extreme in (np.minimum, np.maximum):
+        # First position of every bucket holding the bucket's extreme
+        hits = np.flatnonzero(y == extreme.reduceat(y, starts)[group])
+        kept.append(hits[np.unique(group[hits], return_index=True)[1]])
+    return np.unique(order[np.concatenate(kept)])
+
+
+def lttb_indices(x, y, threshold):
+    '''
+    Largest-Triangle-Three-Buckets: keeps the first and last points and, out
+    of each of threshold - 2 buckets, the point forming the largest triangle
+    with the previously kept point and the average of the next bucket.
+    Returns the sorted indices of the kept points.
+    '''
+    n = x.shape[0]
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asanyarray(x, dtype='float64')
+    y = np.asanyarray(y, dtype='float64')
+
+    every = (n - 2) / float(threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype('int64') + 1
+    edges[-1] = n - 1
+    # Averages of every bucket, the last "bucket" is the last point
+    starts = np.concatenate([edges[:-1], [n - 1]])
+    counts = np.diff(np.concatenate([starts, [n]]))
+    avg_x = np.add.reduceat(x, starts) / counts
+    avg_y = np.add.reduceat(y, starts) / counts
+
+    selected = np.empty(threshold, dtype='int64')
+    selected[0] = a = 0
+    for i in xrange(threshold - 2):
+        lower, upper = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lower:upper] - y[a]) - (x[a] - x[lower:upper]) * (avg_y[i + 1] - y[a]))
+        a = lower + area.argmax()
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+
+METHODS = {'minmax' : minmax_indices,
+           'lttb'   : lttb_indices}
+
+
+def downsample_indices(method, x, y, pixel_width):
+    '''
+    Indices of the points to keep with the named method for a chart pixel_width
+    pixels wide: up to two points per pixel with minmax, one with lttb.
+    '''
+    try:
+        return METHODS[method](x, y, int(pixel_width))
+    except KeyError:
+        raise ValueError('Unknown downsampling method %s' % method)
@@ -19,6 +19,7 @@ import ntplib
 import time
 from pyon.util.containers import get_ion_ts
 from ion.util.time_utils import TimeUtils
+from ion.processes.data.transforms.viz import downsampling
 
 from ion.core.process.transform import TransformDataProcess
 
@@ -79,7 +80,6 @@ class VizTransformHighChartsAlgorithm(SimpleGranuleTransformFunction):
         #init stuff
         rdt_for_nones = {}
         hc_data = []
-        normalized_ts = []
         hc_allowed_numerical_types = ['int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32',
                                        'uint64', 'float32', 'float64','str']
         # TODO : Move this in to container parameter
@@ -121,14 +121,10 @@ class VizTransformHighChartsAlgorithm(SimpleGranuleTransformFunction):
         total_num_of_records = len(rdt[time_field])
 
         # convert timestamps from ntp to system
-        count = 0
-        normalized_ts = [None] * total_num_of_records
-        for ts in rdt[time_field]:
-            if ts == time_fill_value:
-                normalized_ts[count] = time_fill_value
-            else:
-                normalized_ts[count] = float(ntplib.ntp_to_system_time(ts))
-            count += 1
+        times = np.asanyarray(rdt[time_field], dtype='float64')
+        normalized_ts = ntplib.ntp_to_system_time(times)
+        normalized_ts[VizTransformHighChartsAlgorithm._equals(times, time_fill_value)] = time_fill_value
+        downsample = VizTransformHighChartsAlgorithm.downsample_config(config)
 
         ###### DEBUG ##########
         #for field in fields:
@@ -188,7 +184,7 @@ class VizTransformHighChartsAlgorithm(SimpleGranuleTransformFunction):
                         series["name"] = field + "[" + str(i) + "]"
                         series["visible"] = True
                         series["tooltip"] = {"valueDecimals":field_precision}
-                        series["data"] = VizTransformHighChartsAlgorithm.form_series_data_num(normalized_ts, rdt_field, i, time_fill_value, fill_values[field], field_precision)
+                        series["data"] = VizTransformHighChartsAlgorithm.form_series_data_num(normalized_ts, rdt_field, i, time_fill_value, fill_values[field], field_precision, downsample)
                         hc_data.append(series)
             else:
                 if (rdt_field.dtype == 'string' or rdt_field.dtype not in hc_allowed_numerical_types):
@@ -202,7 +198,7 @@ class VizTransformHighChartsAlgorithm(SimpleGranuleTransformFunction):
                     series["name"] = field
                     series["tooltip"] = {"valueDecimals":field_precision}
                     series["visible"] = True
-                    series["data"] = VizTransformHighChartsAlgorithm.form_series_data_num(normalized_ts, rdt_field, None, time_fill_value, fill_values[field], field_precision)
+                    series["data"] = VizTransformHighChartsAlgorithm.form_series_data_num(normalized_ts, rdt_field, None, time_fill_value, fill_values[field], field_precision, downsample)
 
                 # Append series to the hc data
                 hc_data.append(series)
@@ -223,51 +219,91 @@ class VizTransformHighChartsAlgorithm(SimpleGranuleTransformFunction):
 
 
     @staticmethod
-    def form_series_data_num(timestamps, val, idx, ts_fill_value, val_fill_value,  precision):
-        num_of_recs = len(timestamps)
-        _data = np.array([None] * num_of_recs)
+    def form_series_data_num(timestamps, val, idx, ts_fill_value, val_fill_value, precision, downsample=None):
+        '''
+        Builds the [[time in ms, value], ...] data of a numeric series as an object array.  Records with a fill
+        timestamp are left out, fill and NaN values are None.  downsample is an optional (method, pixel_width)
+        pair, see VizTransformHighChartsAlgorithm.downsample_config.
+        '''
+        timestamps = np.asanyarray(timestamps, dtype='float64')
+        values = np.asanyarray(val[:, idx] if idx is not None else val)
+        numbers = values.astype('float64')
+        missing = VizTransformHighChartsAlgorithm._equals(values, val_fill_value) | np.isnan(numbers)
+        rows = VizTransformHighChartsAlgorithm._series_rows(timestamps, ts_fill_value, numbers, missing, downsample)
+
+        _data = np.empty((rows.shape[0], 2), dtype=object)
+        _data[:, 0] = timestamps[rows] * 1000
+        _data[:, 1] = np.round(numbers[rows], precision)
+        _data[missing[rows], 1] = None
+        return _data
 
-        if idx != None:
-            for i in xrange(num_of_recs):
-                if timestamps[i] == ts_fill_value:
-                    continue
-                if val[i][idx] == None or val[i][idx] == val_fill_value:
-                    _data[i] = [timestamps[i] * 1000, None]
-                else:
-                    _data[i] = [timestamps[i] * 1000, round(float(val[i][idx]), precision)]
-        else:
-            for i in xrange(num_of_recs):
-                if timestamps[i] == ts_fill_value:
-                    continue
-                if val[i] == None or val[i] == val_fill_value:
-                    _data[i] = [timestamps[i] * 1000, None]
-                else:
-                    _data[i] = [timestamps[i] * 1000, round(float(val[i]), precision)]
 
+    @staticmethod
+    def form_series_data_str(timestamps, val, idx, ts_fill_value, val_fill_value):
+        '''
+        Builds the [[time in ms, string], ...] data of a non numeric series as an object array.  Records with a
+        fill timestamp are left out, empty and fill values are None.
+        '''
+        timestamps = np.asanyarray(timestamps, dtype='float64')
+        values = np.asanyarray(val[:, idx] if idx is not None else val)
+        if values.dtype.kind in 'SU':
+            empty = values == values.dtype.type()
+            strings = values.astype(str)
+        elif values.dtype.kind == 'b':
+            empty = ~values
+            strings = values.astype(str)
+        else:
+            empty = np.frompyfunc(lambda v: not v, 1, 1)(values).astype(bool)
+            strings = np.frompyfunc(str, 1, 1)(values)
+        missing = empty | VizTransformHighChartsAlgorithm._equals(values, val_fill_value)
+        rows = VizTransformHighChartsAlgorithm._series_rows(timestamps, ts_fill_value, None, missing, None)
+
+        _data = np.empty((rows.shape[0], 2), dtype=object)
+        _data[:, 0] = timestamps[rows] * 1000
+        _data[:, 1] = strings[rows]
+        _data[missing[rows], 1] = None
         return _data
 
 
     @staticmethod
-    def form_series_data_str(timestamps, val, idx, ts_fill_value, val_fill_value):
+    def downsample_config(config):
+        '''
+        The (method, pixel_width) downsampling requested by the visualization parameters, or None.
+
+        Series are reduced to what a chart pixel_width pixels wide can show with either 'minmax' (the lowest and
+        highest value of each pixel wide time bucket, the default) or 'lttb' (Largest-Triangle-Three-Buckets,
+        one point per pixel).  Missing values are dropped from downsampled series.
+        '''
+        if not config or not config.get('pixel_width'):
+            return None
+        try:
+            pixel_width = int(config['pixel_width'])
+        except (TypeError, ValueError):
+            raise BadRequest('HighCharts transform: Invalid pixel_width %r' % config['pixel_width'])
+        method = config.get('downsample') or 'minmax'
+        if method not in downsampling.METHODS:
+            raise BadRequest('HighCharts transform: Unknown downsampling method %r' % method)
+        if pixel_width <= 0:
+            return None
+        return method, pixel_width
 
-        num_of_recs = len(timestamps)
-        _data = np.array([None] * num_of_recs)
 
-        if idx != None:
-            for i in xrange(num_of_recs):
-                if timestamps[i] == ts_fill_value:
-                    continue
-                if not val[i][idx] or val[i][idx] == val_fill_value:
-                    _data[i] = [timestamps[i] * 1000, None]
-                else:
-                    _data[i] = [timestamps[i] * 1000, str(val[i][idx])]
-        else:
-            for i in xrange(num_of_recs):
-                if timestamps[i] == ts_fill_value:
-                    continue
-                if not val[i] or val[i] == val_fill_value:
-                    _data[i] = [timestamps[i] * 1000, None]
-                else:
-                    _data[i] = [timestamps[i] * 1000, str(val[i])]
+    @staticmethod
+    def _series_rows(timestamps, ts_fill_value, numbers, missing, downsample):
+        # Indices of the records that make it in to a series
+        present = ~VizTransformHighChartsAlgorithm._equals(timestamps, ts_fill_value)
+        if not downsample:
+            return np.flatnonzero(present)
+        rows = np.flatnonzero(present & ~missing)
+        method, pixel_width = downsample
+        return rows[downsampling.downsample_indices(method, timestamps[rows], numbers[rows], pixel_width)]
 
-        return _data
\ No newline at end of file
+
+    @staticmethod
+    def _equals(values, fill_value):
+        # Element wise comparison with a fill value, values that can't be compared to it never match
+        if fill_value is not None:
+            matches = values == fill_value
+            if isinstance(matches, np.ndarray):
+                return matches
+        return np.zeros(values.shape, dtype=bool)
@@ -19,6 +19,8 @@ RECOGNIZED_EVENTS = {OT.ResourceAgentStateEvent,
 
 
 class DeviceStateManager(object):
+    # States are read, updated and written back, concurrent batches would overwrite each other's updates
+    max_concurrency = 1
 
     def __init__(self, container=None):
         self.container = container or bootstrap.container_instance
@@ -54,24 +56,44 @@ class DeviceStateManager(object):
         log.debug("Found %s persisted device states", len(existing_states))
 
         # Update state using event
+        applied = 0
         for dev_id, dev_evts in events_by_dev.iteritems():
             dev_state = states_by_dev.get(dev_id, None)
             if dev_state is None:
                 dev_state = self.create_device_state(STATE_PREFIX+dev_id, dev_id)
                 states_by_dev[dev_id] = dev_state
+            dev_evts = self.coalesce_events(dev_evts)
+            applied += len(dev_evts)
             for evt in dev_evts:
                 self.update_device_state(dev_state, dev_id, evt)
 
-        # Persist events
+        # Persist the latest state of each device, one bulk call for the existing states
         upd_dev_states = [ds for did, ds in states_by_dev.iteritems() if did in existing_states]
-        self.store.update_doc_mult(upd_dev_states)
+        if upd_dev_states:
+            self.store.update_doc_mult(upd_dev_states)
 
         new_dev_states = [ds for did, ds in states_by_dev.iteritems() if did not in existing_states]
-        new_dev_state_ids = [STATE_PREFIX+ds["device_id"] for ds in new_dev_states]
-        self.store.create_doc_mult(new_dev_states, object_ids=new_dev_state_ids)
-
-        log.info("Processed and persisted %s status events for %s devices (%s upd/%s new)",
-                 len(event_list), len(dev_ids), len(upd_dev_states), len(new_dev_states))
+        if new_dev_states:
+            new_dev_state_ids = [STATE_PREFIX+ds["device_id"] for ds in new_dev_states]
+            self.store.create_doc_mult(new_dev_states, object_ids=new_dev_state_ids)
+
+        log.info("Processed and persisted %s status events (%s applied) for %s devices (%s upd/%s new)",
+                 len(event_list), applied, len(dev_ids), len(upd_dev_states), len(new_dev_states))
+
+    def coalesce_events(self, dev_events):
+        """
+        Returns the events of a device that determine its final state, in order: the last event
+        of each kind, and for agent state changes also the one before, which becomes the prior state.
+        """
+        positions = {}
+        for i, evt in enumerate(dev_events):
+            kind = (evt.type_, evt.status_name) if evt.type_ == OT.DeviceAggregateStatusEvent else evt.type_
+            positions.setdefault(kind, []).append(i)
+        keep = []
+        for kind, kind_positions in positions.iteritems():
+            count = 2 if kind in (OT.ResourceAgentStateEvent, OT.ResourceAgentResourceStateEvent) else 1
+            keep.extend(kind_positions[-count:])
+        return [dev_events[i] for i in sorted(keep)]
 
     def update_device_state(self, device_state, device_id, event):
         if event.type_ == OT.ResourceAgentStateEvent:
@@ -2,44 +2,79 @@
 
 """Process that subscribes to ALL events and persists them efficiently in bulk into the events datastore"""
 
+import json
+import os
 import pprint
-from gevent.queue import Queue
+import time
+import gevent
+from gevent.pool import Pool
+from gevent.queue import Queue, Empty, Full
 from gevent.event import Event
 
 from pyon.event.event import EventSubscriber
+from pyon.core.bootstrap import get_obj_registry
+from pyon.core.object import ion_serializer, IonObjectDeserializer
 from pyon.ion.process import StandaloneProcess
 from pyon.util.async import spawn
 from pyon.util.containers import named_any
 from pyon.public import log
 
+from ion.processes.event.event_rules import EventRules
+
 PROCESS_PLUGINS = [("DeviceStateManager", "ion.processes.event.device_state.DeviceStateManager", {})]
 
 
+OVERFLOW_POLICIES = ('block', 'journal', 'drop')
+
+
 class EventPersister(StandaloneProcess):
+    """
+    Events are written in batches of at most max_batch_size events, a batch is written at the latest
+    persist_interval seconds after its first event was received.  Up to max_in_flight batches are written
+    concurrently.  When the datastore falls behind and the queue holds queue_size events, new events are
+    handled according to overflow_policy:
+      block:   the subscriber waits for room in the queue (backpressure onto the broker)
+      journal: events are appended to journal_path and persisted once the queue has drained
+      drop:    events are discarded, except those of priority_event_types which block
+    """
 
     def on_init(self):
-        # Time in between event persists
+        # Maximum time an event waits before its batch is persisted
         self.persist_interval = float(self.CFG.get_safe("process.event_persister.persist_interval", 1.0))
-
-        self.persist_blacklist = self.CFG.get_safe("process.event_persister.persist_blacklist", {})
-
-        self._event_type_blacklist = [entry['event_type'] for entry in self.persist_blacklist if entry.get('event_type', None) and len(entry) == 1]
-        self._complex_blacklist = [entry for entry in self.persist_blacklist if not (entry.get('event_type', None) and len(entry) == 1)]
-        if self._complex_blacklist:
-            log.warn("EventPersister does not yet support complex blacklist expressions: %s", self._complex_blacklist)
+        self.max_batch_size = int(self.CFG.get_safe("process.event_persister.max_batch_size", 1000))
+        self.max_in_flight = int(self.CFG.get_safe("process.event_persister.max_in_flight", 2))
+        # Full batch attempts before a failing batch is bisected to find the bad events
+        self.max_retries = int(self.CFG.get_safe("process.event_persister.max_retries", 3))
+
+        self.queue_size = int(self.CFG.get_safe("process.event_persister.queue_size", 100000))
+        self.overflow_policy = self.CFG.get_safe("process.event_persister.overflow_policy", "block")
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            log.warn("Unknown EventPersister overflow policy %s, blocking instead", self.overflow_policy)
+            self.overflow_policy = "block"
+        self.queue_name = self.CFG.get_safe("process.event_persister.queue_name", "event_persister")
+        # Keyed on what survives a restart, so the restarted persister replays what was journaled before a crash
+        self.journal_path = self.CFG.get_safe("process.event_persister.journal_path",
+                                              "/tmp/event_persister_journal_%s_%s" % (self._proc_name, self.queue_name))
+        self.priority_event_types = set(self.CFG.get_safe("process.event_persister.priority_event_types", []))
+
+        # Rules over event_type, type_, base_types, origin, origin_type and sub_type, see EventRules
+        self.persist_blacklist = self.CFG.get_safe("process.event_persister.persist_blacklist", [])
+        self.persist_whitelist = self.CFG.get_safe("process.event_persister.persist_whitelist", [])
+        self.persist_sampling = self.CFG.get_safe("process.event_persister.persist_sampling", [])
+        self.event_rules = EventRules(self.persist_blacklist, self.persist_whitelist, self.persist_sampling)
 
         # Time in between view refreshs
         self.refresh_interval = float(self.CFG.get_safe("process.event_persister.refresh_interval", 60.0))
 
         # Holds received events FIFO in syncronized queue
-        self.event_queue = Queue()
+        self.event_queue = Queue(maxsize=self.queue_size or None)
 
-        # Temporarily holds list of events to persist while datastore operation are not yet completed
-        # This is where events to persist will remain if datastore operation fails occasionally.
-        self.events_to_persist = None
+        # Bulk writes in progress
+        self._write_pool = Pool(size=self.max_in_flight)
 
-        # Number of unsuccessful attempts to persist in a row
-        self.failure_count = 0
+        self.metrics = dict(events_received=0, events_persisted=0, events_failed=0, events_dropped=0,
+                            events_journaled=0, batches=0, last_batch_size=0, max_batch_size=0,
+                            last_write_latency=0.0, max_write_latency=0.0, total_write_latency=0.0)
 
         # bookkeeping for greenlet
         self._persist_greenlet = None
@@ -50,18 +85,26 @@ class EventPersister(StandaloneProcess):
         # The event subscriber
         self.event_sub = None
 
-        # Registered event process plugins
+        # Registered event process plugins, each fed through its own work queue
         self.process_plugins = {}
+        self.plugin_workers = {}
         for plugin_name, plugin_cls, plugin_args in PROCESS_PLUGINS:
             try:
                 plugin = named_any(plugin_cls)(**plugin_args)
                 self.process_plugins[plugin_name]= plugin
+                self.plugin_workers[plugin_name] = PluginWorker(plugin_name, plugin,
+                    queue_size=int(self.CFG.get_safe("process.event_persister.plugins.%s.queue_size" % plugin_name, 100)),
+                    concurrency=int(self.CFG.get_safe("process.event_persister.plugins.%s.concurrency" % plugin_name, 1)),
+                    max_events=int(self.CFG.get_safe("process.event_persister.plugins.%s.max_events" % plugin_name, 10000)))
                 log.info("Loaded event processing plugin %s (%s)", plugin_name, plugin_cls)
             except Exception as ex:
                 log.error("Cannot instantiate event processing plugin %s (%s): %s", plugin_name, plugin_cls, ex)
 
 
     def on_start(self):
+        for worker in self.plugin_workers.itervalues():
+            worker.start()
+
         # Persister thread
         self._persist_greenlet = spawn(self._persister_loop, self.persist_interval)
         log.debug('EventPersister persist greenlet started in "%s" (interval %s)', self.__class__.__name__, self.persist_interval)
@@ -73,7 +116,7 @@ class EventPersister(StandaloneProcess):
         # Event subscription
         self.event_sub = EventSubscriber(pattern=EventSubscriber.ALL_EVENTS,
                                          callback=self._on_event,
-                                         queue_name="event_persister")
+                                         queue_name=self.queue_name)
 
         self.event_sub.start()
 
@@ -88,77 +131,189 @@ class EventPersister(StandaloneProcess):
         # wait on the greenlets to finish cleanly
         self._persist_greenlet.join(timeout=5)
         self._refresh_greenlet.join(timeout=5)
+        self._write_pool.join(timeout=5)
+        for worker in self.plugin_workers.itervalues():
+            worker.stop(timeout=5)
+
+    def get_metrics(self):
+        """Returns the queue depth, batch size and write latency counters"""
+        metrics = dict(self.metrics)
+        metrics['queue_depth'] = self.event_queue.qsize()
+        metrics['in_flight'] = len(self._write_pool)
+        metrics['mean_write_latency'] = metrics['total_write_latency'] / metrics['batches'] if metrics['batches'] else 0.0
+        metrics['rule_hits'] = self.event_rules.hit_counts()
+        metrics['plugins'] = dict((name, worker.get_metrics()) for name, worker in self.plugin_workers.iteritems())
+        return metrics
 
     def _on_event(self, event, *args, **kwargs):
         if not self._in_blacklist(event):
+            self.metrics['events_received'] += 1
+            self._enqueue(event)
+
+    def _enqueue(self, event):
+        if self.overflow_policy == "block":
             self.event_queue.put(event)
+            return
+        try:
+            self.event_queue.put_nowait(event)
+        except Full:
+            if self.overflow_policy == "journal":
+                self._journal_events([event])
+            elif self._is_priority(event):
+                self.event_queue.put(event)
+            else:
+                self.metrics['events_dropped'] += 1
+                if self.metrics['events_dropped'] % 1000 == 1:
+                    log.warn("EventPersister queue full, %s events dropped so far", self.metrics['events_dropped'])
+
+    def _is_priority(self, event):
+        if event.type_ in self.priority_event_types:
+            return True
+        return any(base_type in self.priority_event_types for base_type in event.base_types or [])
 
     def _in_blacklist(self, event):
-        if event.type_ in self._event_type_blacklist:
-            return True
-        if event.base_types:
-            for base_type in event.base_types:
-                if base_type in self._event_type_blacklist:
-                    return True
-            # TODO: Complex event blacklist
-        return False
+        return not self.event_rules.persist(event)
 
     def _persister_loop(self, persist_interval):
         log.debug('Starting event persister thread with persist_interval=%s', persist_interval)
 
-        # Event.wait returns False on timeout (and True when set in on_quit), so we use this to both exit cleanly and do our timeout in a loop
-        while not self._terminate_persist.wait(timeout=persist_interval):
+        while not self._terminate_persist.is_set():
             try:
-                if self.events_to_persist and self.failure_count > 2:
-                    bad_events = []
-                    log.warn("Attempting to persist %s events individually" % (len(self.events_to_persist)))
-                    for event in self.events_to_persist:
-                        try:
-                            self.container.event_repository.put_event(event)
-                        except Exception:
-                            bad_events.append(event)
-
-                    if len(self.events_to_persist) != len(bad_events):
-                        log.warn("Succeeded to persist some of the events - rest must be bad")
-                        self._log_events(bad_events)
-                    elif bad_events:
-                        log.error("Discarding %s events after %s attempts!!" % (len(bad_events), self.failure_count))
-                        self._log_events(bad_events)
-
-                    self.events_to_persist = None
-                    self.failure_count = 0
-
-                elif self.events_to_persist:
-                    # There was an error last time and we need to retry
-                    log.info("Retry persisting %s events" % len(self.events_to_persist))
-                    self._persist_events(self.events_to_persist)
-                    self.events_to_persist = None
-
-                self.events_to_persist = [self.event_queue.get() for x in xrange(self.event_queue.qsize())]
-
-                try:
-                    self._persist_events(self.events_to_persist)
-                finally:
-                    self._process_events(self.events_to_persist)
-                self.events_to_persist = None
-                self.failure_count = 0
-            except Exception as ex:
+                batch = self._next_batch(persist_interval)
+                if batch:
+                    # Plugins see the batches in the order received, the writes may complete in any order
+                    self._process_events(batch)
+                    # Blocks while max_in_flight writes are in progress, the queue fills up behind it
+                    self._write_pool.spawn(self._write_batch, batch)
+                if self.overflow_policy == "journal" and self.event_queue.qsize() * 2 < self.queue_size:
+                    self._replay_journal()
+            except Exception:
+                log.exception("Error in event persister loop")
+
+        # Persist what is left
+        batch = self._next_batch(0)
+        while batch:
+            self._process_events(batch)
+            self._write_pool.spawn(self._write_batch, batch)
+            batch = self._next_batch(0)
+
+    def _next_batch(self, max_latency):
+        """
+        Returns up to max_batch_size events, waiting at most max_latency seconds for the first one
+        and from then on until max_latency seconds after the first one was taken
+        """
+        batch = []
+        deadline = time.time() + max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    event = self.event_queue.get(timeout=timeout)
+                else:
+                    event = self.event_queue.get_nowait()
+            except Empty:
+                break
+            if not batch:
+                deadline = time.time() + max_latency
+            batch.append(event)
+        return batch
+
+    def _write_batch(self, batch):
+        start = time.time()
+        for attempt in xrange(self.max_retries):
+            try:
+                self._persist_events(batch)
+                bad_events = []
+                break
+            except Exception:
                 # Note: Persisting events may fail occasionally during test runs (when the "events" datastore is force
-                # deleted and recreated). We'll log and keep retrying forever.
-                log.exception("Failed to persist %s received events. Will retry next cycle" % len(self.events_to_persist))
-                self.failure_count += 1
-                self._log_events(self.events_to_persist)
+                # deleted and recreated). Retry before looking for bad events.
+                log.exception("Failed to persist %s received events (attempt %s)", len(batch), attempt + 1)
+                if attempt + 1 < self.max_retries:
+                    gevent.sleep(self.persist_interval)
+        else:
+            log.warn("Bisecting %s events to find the ones that cannot be persisted", len(batch))
+            bad_events = self._persist_bisect(batch)
+            if bad_events:
+                log.error("Discarding %s events after %s attempts!!", len(bad_events), self.max_retries)
+                self._log_events(bad_events)
+
+        latency = time.time() - start
+        metrics = self.metrics
+        metrics['events_persisted'] += len(batch) - len(bad_events)
+        metrics['events_failed'] += len(bad_events)
+        metrics['batches'] += 1
+        metrics['last_batch_size'] = len(batch)
+        metrics['max_batch_size'] = max(metrics['max_batch_size'], len(batch))
+        metrics['last_write_latency'] = latency
+        metrics['max_write_latency'] = max(metrics['max_write_latency'], latency)
+        metrics['total_write_latency'] += latency
+
+    def _persist_bisect(self, events):
+        """Persists what it can of events, returns the events that cannot be persisted"""
+        try:
+            self._persist_events(events)
+            return []
+        except Exception:
+            if len(events) == 1:
+                return events
+            half = len(events) / 2
+            return self._persist_bisect(events[:half]) + self._persist_bisect(events[half:])
+
+    def _journal_events(self, events):
+        with open(self.journal_path, "a") as f:
+            for event in events:
+                f.write(json.dumps(ion_serializer.serialize(event)))
+                f.write("\n")
+        self.metrics['events_journaled'] += len(events)
+
+    def _replay_journal(self):
+        """
+        Persists the journaled events in batches of max_batch_size once the queue has drained.
+        The journal is removed only after all its batches were written, a replay interrupted
+        by a crash is resumed before the current journal.
+        """
+        replay_path = self.journal_path + ".replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.journal_path):
+                return
+            os.rename(self.journal_path, replay_path)
+        deserializer = IonObjectDeserializer(obj_registry=get_obj_registry())
+        writes, batch, num_events, bad_lines = [], [], 0, 0
+        with open(replay_path) as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append(deserializer.deserialize(json.loads(line)))
+                except Exception:
+                    log.exception("Skipping unreadable line %s of event journal %s", line_no, replay_path)
+                    bad_lines += 1
+                    continue
+                if len(batch) == self.max_batch_size:
+                    writes.append(self._replay_batch(batch))
+                    num_events += len(batch)
+                    batch = []
+        if batch:
+            writes.append(self._replay_batch(batch))
+            num_events += len(batch)
+        gevent.joinall(writes)
+        os.remove(replay_path)
+        log.info("Persisted %s journaled events, skipped %s unreadable lines", num_events, bad_lines)
+
+    def _replay_batch(self, batch):
+        self._process_events(batch)
+        # Blocks while max_in_flight writes are in progress, so the journal is read as fast as it is written
+        return self._write_pool.spawn(self._write_batch, batch)
 
     def _persist_events(self, event_list):
         if event_list:
             self.container.event_repository.put_events(event_list)
 
     def _process_events(self, event_list):
-        for plugin_name, plugin in self.process_plugins.iteritems():
-            try:
-                plugin.process_events(event_list)
-            except Exception as ex:
-                log.exception("Error processing events in plugin %s", plugin_name)
+        # Blocks only when a plugin's work queue is full
+        for worker in self.plugin_workers.itervalues():
+            worker.put(event_list)
 
     def _log_events(self, events):
         events_str = pprint.pformat([event.__dict__ for event in events]) if events else ""
@@ -173,10 +328,101 @@ class EventPersister(StandaloneProcess):
                 self.container.event_repository.find_events(limit=1)
             except Exception as ex:
                 log.exception("Failed to refresh events views")
+            log.info("EventPersister metrics: %s", self.get_metrics())
 
 
 class EventProcessor(object):
-    """Callback interface for event processors"""
+    """
+    Callback interface for event processors.  max_concurrency limits the number of batches a plugin
+    processes at once, None if process_events may run concurrently without limit.
+    """
+    max_concurrency = None
 
     def process_events(self, event_list):
         raise NotImplemented("Must override")
+
+
+class PluginWorker(object):
+    """
+    Runs an event processing plugin on its own bounded queue of event batches, with up to concurrency
+    greenlets.  Batches that queued up while the plugin was busy are handed to it together, up to
+    max_events events, so the plugin can coalesce them.  The concurrency is capped at the plugin's
+    max_concurrency.
+    """
+
+    def __init__(self, name, plugin, queue_size=100, concurrency=1, max_events=10000):
+        self.name = name
+        self.plugin = plugin
+        self.queue = Queue(maxsize=queue_size or None)
+        max_concurrency = getattr(plugin, "max_concurrency", None)
+        if max_concurrency and concurrency > max_concurrency:
+            log.warn("Plugin %s supports a concurrency of at most %s, not %s", name, max_concurrency, concurrency)
+            concurrency = max_concurrency
+        self.concurrency = concurrency
+        self.max_events = max_events
+        self._greenlets = []
+        self._stopping = False
+        self.metrics = dict(batches=0, events=0, failures=0, busy_time=0.0, last_lag=0.0, max_lag=0.0)
+
+    def start(self):
+        self._stopping = False
+        self._greenlets = [spawn(self._run) for i in xrange(self.concurrency)]
+
+    def stop(self, timeout=None):
+        """Processes the queued batches, then stops.  Never blocks on a full queue"""
+        self._stopping = True
+        # A full queue has no greenlet waiting on it, they stop once they have drained it
+        for greenlet in self._greenlets:
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                break
+        gevent.joinall(self._greenlets, timeout=timeout)
+
+    def put(self, event_list):
+        self.queue.put((time.time(), event_list))
+
+    def get_metrics(self):
+        """Queue depth, lag (seconds a batch waited before processing) and throughput (events/s while busy)"""
+        metrics = dict(self.metrics)
+        metrics['queue_depth'] = self.queue.qsize()
+        metrics['throughput'] = metrics['events'] / metrics['busy_time'] if metrics['busy_time'] else 0.0
+        return metrics
+
+    def _take(self):
+        """The oldest queued batch joined with the ones queued behind it, None to stop"""
+        if self._stopping and self.queue.empty():
+            return None, None
+        item = self.queue.get()
+        if item is None:
+            return None, None
+        queued, events = item
+        events = list(events)
+        while len(events) < self.max_events:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                self.queue.put(None) # Stop after this batch
+                break
+            events.extend(item[1])
+        return queued, events
+
+    def _run(self):
+        while True:
+            queued, events = self._take()
+            if events is None:
+                return
+            start = time.time()
+            lag = start - queued
+            self.metrics['last_lag'] = lag
+            self.metrics['max_lag'] = max(self.metrics['max_lag'], lag)
+            try:
+                self.plugin.process_events(events)
+            except Exception:
+                self.metrics['failures'] += 1
+                log.exception("Error processing events in plugin %s", self.name)
+            self.metrics['batches'] += 1
+            self.metrics['events'] += len(events)
+            self.metrics['busy_time'] += time.time() - start
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""Compiled blacklist, whitelist and sampling rules deciding which events the event persister keeps"""
+
+from pyon.public import log
+
+
+class EventRuleSet(object):
+    """
+    An ordered list of rules, each a dict of conditions that all have to hold for an event to match:
+      event_type:  the event's type or one of its base types
+      type_:       the event's type
+      base_types:  one of the event's base types
+      origin, origin_type, sub_type: the event's attribute
+    A condition is a value or a list of values.  Rules are compiled into bitsets, one bit per rule, held
+    under each value of each field, so matching an event is a lookup per field and an intersection.
+    The part of the match depending on the event type is cached per type.
+    """
+    FIELDS = ('event_type', 'type_', 'base_types', 'origin', 'origin_type', 'sub_type')
+    TYPE_FIELDS = ('event_type', 'type_', 'base_types')
+    OPTIONS = ('sample',)
+
+    def __init__(self, rules=None):
+        self.rules = []
+        for rule in rules or []:
+            unknown = [key for key in rule if key not in self.FIELDS + self.OPTIONS]
+            if unknown:
+                log.warn("Ignoring event rule %s with unknown conditions %s", rule, unknown)
+                continue
+            self.rules.append(dict(rule))
+        self.hits = [0] * len(self.rules)
+
+        self._wildcards = dict((field, 0) for field in self.FIELDS)
+        self._bitsets = dict((field, {}) for field in self.FIELDS)
+        for i, rule in enumerate(self.rules):
+            bit = 1 << i
+            for field in self.FIELDS:
+                if field not in rule:
+                    self._wildcards[field] |= bit
+                    continue
+                values = rule[field] if isinstance(rule[field], (list, tuple, set)) else [rule[field]]
+                for value in values:
+                    self._bitsets[field][value] = self._bitsets[field].get(value, 0) | bit
+        self._type_masks = {}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _field_mask(self, field, values):
+        mask = self._wildcards[field]
+        bitsets = self._bitsets[field]
+        for value in values:
+            mask |= bitsets.get(value, 0)
+        return mask
+
+    def _type_mask(self, event):
+        mask = self._type_masks.get(event.type_)
+        if mask is None:
+            base_types = list(event.base_types or [])
+            mask = (self._field_mask('event_type', [event.type_] + base_types) &
+                    self._field_mask('type_', [event.type_]) &
+                    self._field_mask('base_types', base_types))
+            self._type_masks[event.type_] = mask
+        return mask
+
+    def match(self, event):
+        """Returns the index of the first rule matching an event and counts the hit, None if no rule matches"""
+        if not self.rules:
+            return None
+        mask = self._type_mask(event)
+        for field in ('origin', 'origin_type', 'sub_type'):
+            if not mask:
+                return None
+            mask &= self._wildcards[field] | self._bitsets[field].get(getattr(event, field, None), 0)
+        if not mask:
+            return None
+        i = (mask & -mask).bit_length() - 1
+        self.hits[i] += 1
+        return i
+
+    def hit_counts(self):
+        return [(rule, hits) for rule, hits in zip(self.rules, self.hits)]
+
+
+class EventRules(object):
+    """
+    Decides whether an event is persisted.  Events matching a blacklist rule are dropped unless they
+    also match a whitelist rule.  Events matching a sampling rule are persisted 1 in every `sample`
+    per origin, e.g. {'event_type': 'DeviceStatusEvent', 'origin': 'dev1', 'sample': 10}
+    """
+
+    def __init__(self, blacklist=None, whitelist=None, sampling=None):
+        self.blacklist = EventRuleSet(blacklist)
+        self.whitelist = EventRuleSet(whitelist)
+        self.sampling = EventRuleSet([rule for rule in sampling or [] if int(rule.get('sample', 1)) > 1])
+        self._sampled = {} # (sampling rule, origin) -> events seen
+
+    def persist(self, event):
+        if self.blacklist.match(event) is not None and self.whitelist.match(event) is None:
+            return False
+        i = self.sampling.match(event)
+        if i is None:
+            return True
+        key = (i, event.origin)
+        seen = self._sampled.get(key, 0)
+        self._sampled[key] = seen + 1
+        return seen % int(self.sampling.rules[i]['sample']) == 0
+
+    def hit_counts(self):
+        return dict(blacklist=self.blacklist.hit_counts(),
+                    whitelist=self.whitelist.hit_counts(),
+                    sampling=self.sampling.hit_counts())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/event/test/test_device_state.py
+@brief Tests for the device state event plugin
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from pyon.public import OT
+from ion.processes.event.device_state import DeviceStateManager, STATE_PREFIX
+from nose.plugins.attrib import attr
+from mock import Mock
+
+
+@attr('UNIT')
+class TestDeviceStateManager(PyonTestCase):
+    def event(self, type_, state='', origin='dev1'):
+        return DotDict(type_=type_, origin=origin, ts_created='1', state=state, status=1, status_name=None, sub_type='',
+                       time_stamps=[], valid_values=[], values=[], prev_status=0, roll_up_status=False)
+
+    def test_coalesce(self):
+        manager = DeviceStateManager(container=Mock())
+        events = [self.event(OT.ResourceAgentStateEvent, state='A'),
+                  self.event(OT.DeviceStatusEvent),
+                  self.event(OT.ResourceAgentStateEvent, state='B'),
+                  self.event(OT.DeviceStatusEvent),
+                  self.event(OT.ResourceAgentStateEvent, state='C')]
+        self.assertEquals(manager.coalesce_events(events), [events[2], events[3], events[4]])
+
+    def test_persist(self):
+        container = Mock()
+        manager = DeviceStateManager(container=container)
+        existing = manager.create_device_state(STATE_PREFIX + 'dev1', 'dev1')
+        container.object_store.read_doc_mult.return_value = [existing]
+
+        manager.process_events([self.event(OT.ResourceAgentStateEvent, state=state) for state in 'ABC'])
+        self.assertEquals((existing['state']['prior'], existing['state']['current']), ('B', 'C'))
+        container.object_store.update_doc_mult.assert_called_once_with([existing])
+        self.assertFalse(container.object_store.create_doc_mult.called)
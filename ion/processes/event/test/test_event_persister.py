@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/event/test/test_event_persister.py
+@brief Tests for the batching of the event persister
+'''
+
+import json
+import os
+import tempfile
+import shutil
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from ion.processes.event.event_persister import EventPersister, PluginWorker
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+
+@attr('UNIT')
+class TestEventPersister(PyonTestCase):
+    def setUp(self):
+        self.persister = self.new_persister('persister_1')
+
+    def new_persister(self, process_id):
+        persister = EventPersister()
+        persister.id = process_id
+        persister._proc_name = 'event_persister'
+        persister.CFG = DotDict()
+        persister.CFG.process.event_persister.max_batch_size = 3
+        persister.CFG.process.event_persister.queue_size = 4
+        persister.CFG.process.event_persister.overflow_policy = 'drop'
+        persister.CFG.process.event_persister.priority_event_types = ['ResourceAgentStateEvent']
+        persister.on_init()
+        persister.process_plugins = {}
+        persister.container = Mock()
+        return persister
+
+    def event(self, type_='DeviceStatusEvent', bad=False):
+        return DotDict(type_=type_, base_types=['ResourceEvent'], bad=bad)
+
+    def test_batches(self):
+        for i in xrange(4):
+            self.persister._on_event(self.event())
+        self.assertEquals(self.persister.get_metrics()['queue_depth'], 4)
+
+        # The queue is full, only priority events wait for room
+        self.persister._on_event(self.event())
+        self.assertEquals(self.persister.metrics['events_dropped'], 1)
+
+        self.assertEquals(len(self.persister._next_batch(0)), 3)
+        self.assertEquals(len(self.persister._next_batch(0)), 1)
+        self.assertEquals(self.persister._next_batch(0.01), [])
+
+    def test_bisect(self):
+        def put_events(events):
+            if any(event.bad for event in events):
+                raise Exception('bad event')
+            persisted.extend(events)
+        persisted = []
+        self.persister.container.event_repository.put_events.side_effect = put_events
+        self.persister.max_retries = 1
+
+        events = [self.event(bad=i in (2, 5)) for i in xrange(8)]
+        self.persister._write_batch(events)
+        self.assertEquals(persisted, [e for e in events if not e.bad])
+
+        metrics = self.persister.get_metrics()
+        self.assertEquals((metrics['events_persisted'], metrics['events_failed'], metrics['batches']), (6, 2, 1))
+        self.assertEquals(metrics['last_batch_size'], 8)
+
+    @patch('ion.processes.event.event_persister.ion_serializer')
+    @patch('ion.processes.event.event_persister.IonObjectDeserializer')
+    @patch('ion.processes.event.event_persister.get_obj_registry')
+    def test_journal_restart(self, get_obj_registry, deserializer_cls, serializer):
+        # The process id changes when the container restarts, the journal path doesn't
+        restarted = self.new_persister('persister_2')
+        self.assertEquals(self.persister.journal_path, '/tmp/event_persister_journal_event_persister_event_persister')
+        self.assertEquals(restarted.journal_path, self.persister.journal_path)
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.persister.journal_path = restarted.journal_path = os.path.join(tmpdir, 'journal')
+        serializer.serialize.side_effect = lambda event: dict(event)
+        deserializer_cls.return_value.deserialize.side_effect = lambda obj: obj
+        self.persister._journal_events([dict(n=i) for i in xrange(2)])
+
+        persisted = []
+        restarted.container.event_repository.put_events.side_effect = lambda events: persisted.extend(events)
+        restarted._replay_journal()
+        self.assertEquals(persisted, [dict(n=0), dict(n=1)])
+
+    @patch('ion.processes.event.event_persister.IonObjectDeserializer')
+    @patch('ion.processes.event.event_persister.get_obj_registry')
+    def test_replay_journal(self, get_obj_registry, deserializer_cls):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.persister.journal_path = os.path.join(tmpdir, 'journal')
+        deserializer_cls.return_value.deserialize.side_effect = lambda obj: obj
+        with open(self.persister.journal_path, 'w') as f:
+            for i in xrange(5):
+                f.write(json.dumps(dict(n=i)) + '\n')
+            f.write('{"n": \n') # Truncated by a crash while journaling
+            f.write(json.dumps(dict(n=5)) + '\n')
+
+        persisted = []
+        self.persister.container.event_repository.put_events.side_effect = lambda events: persisted.append(list(events))
+        self.persister._replay_journal()
+
+        # Batches of max_batch_size, the unreadable line is skipped
+        self.assertEquals([[e['n'] for e in batch] for batch in persisted], [[0, 1, 2], [3, 4, 5]])
+        self.assertFalse(os.path.exists(self.persister.journal_path))
+        self.assertFalse(os.path.exists(self.persister.journal_path + '.replay'))
+
+    def test_plugin_worker(self):
+        plugin = Mock()
+        worker = PluginWorker('test', plugin, queue_size=10)
+        # Batches queued while the plugin is busy are processed together
+        worker.put([1, 2])
+        worker.put([3])
+        worker.start()
+        worker.stop(timeout=5)
+        plugin.process_events.assert_called_once_with([1, 2, 3])
+
+        metrics = worker.get_metrics()
+        self.assertEquals((metrics['batches'], metrics['events'], metrics['queue_depth']), (1, 3, 0))
+        self.assertTrue(metrics['max_lag'] >= 0)
+
+    def test_plugin_worker_concurrency(self):
+        plugin = Mock()
+        plugin.max_concurrency = 1
+        self.assertEquals(PluginWorker('test', plugin, concurrency=4).concurrency, 1)
+        plugin.max_concurrency = None
+        self.assertEquals(PluginWorker('test', plugin, concurrency=4).concurrency, 4)
+
+    def test_plugin_worker_stop_full_queue(self):
+        plugin = Mock()
+        worker = PluginWorker('test', plugin, queue_size=2, concurrency=2, max_events=1)
+        worker.put([1])
+        worker.put([2])
+        worker.start()
+        # No room for the stop markers, the queued batches are still processed
+        worker.stop(timeout=5)
+        self.assertTrue(all(greenlet.ready() for greenlet in worker._greenlets))
+        self.assertEquals(sorted(call[0][0] for call in plugin.process_events.call_args_list), [[1], [2]])
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/event/test/test_event_rules.py
+@brief Tests for the event persister's blacklist, whitelist and sampling rules
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from ion.processes.event.event_rules import EventRules, EventRuleSet
+from nose.plugins.attrib import attr
+
+
+@attr('UNIT')
+class TestEventRules(PyonTestCase):
+    def event(self, type_='DeviceStatusEvent', origin='dev1', origin_type='InstrumentDevice', base_types=('DeviceEvent', 'ResourceEvent')):
+        return DotDict(type_=type_, base_types=list(base_types), origin=origin, origin_type=origin_type, sub_type='')
+
+    def test_match(self):
+        rules = EventRuleSet([{'event_type' : 'ResourceEvent', 'origin' : ['dev2', 'dev3']},
+                              {'type_' : 'DeviceStatusEvent', 'origin_type' : 'PlatformDevice'},
+                              {'base_types' : 'DeviceEvent'},
+                              {'event_type' : 'DeviceStatusEvent', 'colour' : 'red'}])
+        self.assertEquals(len(rules), 3) # The rule with an unknown condition is left out
+
+        self.assertEquals(rules.match(self.event(origin='dev3')), 0)
+        self.assertEquals(rules.match(self.event(origin_type='PlatformDevice')), 1)
+        self.assertEquals(rules.match(self.event()), 2)
+        self.assertIsNone(rules.match(self.event(type_='ResourceAgentEvent', origin='dev4', base_types=['ResourceEvent'])))
+        self.assertEquals(rules.hits, [1, 1, 1])
+
+    def test_persist(self):
+        rules = EventRules(blacklist=[{'event_type' : 'DeviceStatusEvent'}],
+                           whitelist=[{'event_type' : 'DeviceStatusEvent', 'origin' : 'dev1'}],
+                           sampling=[{'event_type' : 'DeviceEvent', 'sample' : 3}])
+        self.assertFalse(rules.persist(self.event(origin='dev2')))
+        # Whitelisted, then sampled per origin
+        self.assertEquals([rules.persist(self.event()) for i in xrange(6)], [True, False, False, True, False, False])
+        self.assertTrue(rules.persist(self.event(type_='DeviceCommsEvent', origin='dev9')))
+        self.assertTrue(rules.persist(self.event(type_='ResourceAgentEvent', base_types=['ResourceEvent'])))
+
+        hits = rules.hit_counts()
+        self.assertEquals(hits['blacklist'][0][1], 7)
+        self.assertEquals(hits['whitelist'][0][1], 6)
+        self.assertEquals(hits['sampling'][0][1], 7)
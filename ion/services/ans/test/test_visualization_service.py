@@ -7,7 +7,7 @@ import unittest, os
 import gevent
 import simplejson
 import ast
-from mock import patch
+from mock import patch, Mock
 import logging
 from pyon.net.endpoint import Subscriber
 from interface.services.cei.iprocess_dispatcher_service import ProcessDispatcherServiceProcessClient
@@ -22,7 +22,7 @@ from interface.services.sa.idata_acquisition_management_service import DataAcqui
 from interface.services.ans.iworkflow_management_service import WorkflowManagementServiceProcessClient
 from interface.services.dm.idata_retriever_service import DataRetrieverServiceProcessClient
 from interface.services.ans.ivisualization_service import VisualizationServiceProcessClient
-from ion.services.ans.visualization_service import USER_VISUALIZATION_QUEUE
+from ion.services.ans.visualization_service import USER_VISUALIZATION_QUEUE, VisualizationService
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition
 
 from pyon.public import log, IonObject, RT, PRED, CFG
@@ -31,7 +31,8 @@ from ion.services.ans.test.test_helper import VisualizationIntegrationTestHelper
 from nose.plugins.attrib import attr
 
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
-from pyon.util.containers import get_safe
+from pyon.util.containers import get_safe, DotDict
+from pyon.util.unit_test import PyonTestCase
 
 from pyon.util.context import LocalContextMixin
 
@@ -506,3 +507,60 @@ class TestVisualizationServiceIntegration(VisualizationIntegrationTestHelper):
 
         return
 
+
+
+class VisualizationServiceMockTestCase(PyonTestCase):
+    def setUp(self):
+        self.clients = self._create_service_mock('visualization')
+        self.viz = VisualizationService()
+        self.viz.clients = self.clients
+        self.clients.resource_registry.find_objects.return_value = (['resource_id'], [])
+        self.clients.data_retriever.retrieve.return_value = Mock()
+        self.clients.dataset_management.read_parameter_dictionary_by_name.return_value = 'pdict_id'
+        self.clients.pubsub_management.create_stream_definition.return_value = 'stream_def_id'
+        patcher = patch('ion.services.ans.visualization_service.VizTransformHighChartsAlgorithm')
+        self.transform = patcher.start()
+        self.transform.execute.return_value = None
+        self.addCleanup(patcher.stop)
+
+    def rpc_count(self):
+        return sum(len(getattr(self.clients, name).method_calls) for name in ('resource_registry', 'dataset_management', 'pubsub_management', 'data_retriever'))
+
+
+@attr('UNIT', group='as')
+class TestVisualizationServiceUnit(VisualizationServiceMockTestCase):
+    def test_output_stream_definition_reuse(self):
+        for i in xrange(5):
+            self.assertEquals(self.viz._get_highcharts_data('data_product_id'), '[]')
+        self.assertEquals(self.clients.pubsub_management.create_stream_definition.call_count, 1)
+        self.assertEquals(self.clients.dataset_management.read_parameter_dictionary_by_name.call_count, 1)
+        self.assertEquals(self.transform.execute.call_args[1]['params'], 'stream_def_id')
+
+        # Unrelated modifications are ignored, modifying the output definition's parameter dictionary is not
+        self.viz._output_definition_modified(DotDict(origin='other_id'))
+        self.viz._get_highcharts_data('data_product_id')
+        self.assertEquals(self.clients.pubsub_management.create_stream_definition.call_count, 1)
+        self.viz._output_definition_modified(DotDict(origin='pdict_id'))
+        self.viz._get_highcharts_data('data_product_id')
+        self.assertEquals(self.clients.pubsub_management.create_stream_definition.call_count, 2)
+
+    def test_warm_up(self):
+        self.viz.warm_up()
+        self.assertEquals(self.clients.pubsub_management.create_stream_definition.call_count, 2)
+        calls = self.rpc_count()
+        self.viz._get_highcharts_data('data_product_id')
+        self.assertEquals(self.rpc_count() - calls, 3)
+
+
+@attr('BENCHMARK', group='as')
+class TestVisualizationServiceBenchmark(VisualizationServiceMockTestCase):
+    def test_rpcs_per_chart_request(self):
+        calls = self.rpc_count()
+        self.viz._get_highcharts_data('data_product_id')
+        cold = self.rpc_count() - calls
+        calls = self.rpc_count()
+        for i in xrange(100):
+            self.viz._get_highcharts_data('data_product_id')
+        warm = (self.rpc_count() - calls) / 100.
+        log.info('RPCs per chart request: %d resolving the output stream definition (every request before), %.1f reusing it', cold, warm)
+        self.assertEquals((cold, warm), (5, 3))
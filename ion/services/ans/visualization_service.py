@@ -12,7 +12,8 @@ Note:
 
 # Pyon imports
 # Note pyon imports need to be first for monkey patching to occur
-from pyon.public import IonObject, RT, log, PRED
+from pyon.public import IonObject, RT, OT, log, PRED
+from pyon.ion.event import EventSubscriber
 from pyon.util.containers import create_unique_identifier, get_safe
 from pyon.core.exception import Inconsistent, BadRequest, NotFound
 from datetime import datetime
@@ -46,6 +47,16 @@ USER_VISUALIZATION_QUEUE = 'UserVisQueue'
 PERSIST_REALTIME_DATA_PRODUCTS = False
 
 class VisualizationService(BaseVisualizationService):
+    '''
+    Configuration (service.visualization):
+      warm_up: True   # Resolve the output stream definitions when the service starts
+    '''
+
+    # Output stream definitions of the visualization transforms: kind -> (stream definition name, parameter dictionary name)
+    OUTPUT_STREAM_DEFINITIONS = {'highcharts' : ('HighCharts_out', 'highcharts'),
+                                 'mpl'        : ('mpl', 'graph_image_param_dict')}
+
+    _output_stream_defs = None
 
     def on_init(self):
         self.create_workflow_timeout = get_safe(self.CFG, 'create_workflow_timeout', 60)
@@ -63,10 +74,52 @@ class VisualizationService(BaseVisualizationService):
         return
 
 
+    def on_start(self):
+        super(VisualizationService, self).on_start()
+        self._output_stream_defs = {}
+        for origin_type in (RT.StreamDefinition, RT.ParameterDictionary):
+            subscriber = EventSubscriber(event_type=OT.ResourceModifiedEvent, origin_type=origin_type, callback=self._output_definition_modified, auto_delete=True)
+            self.add_endpoint(subscriber)
+        if self.CFG.get_safe('service.visualization.warm_up', True):
+            # Off the start path, the parameter dictionaries may not be loaded yet
+            self._process.thread_manager.spawn(self.warm_up)
+
     def on_quit(self):
 #        self.monitor_event.set()
         return
 
+    def warm_up(self):
+        '''
+        Resolves the output stream definitions of every visualization transform ahead of the first request
+        '''
+        for kind in self.OUTPUT_STREAM_DEFINITIONS:
+            try:
+                self._output_stream_definition(kind)
+            except NotFound:
+                log.debug('Parameter dictionary for the %s output is not loaded yet', kind)
+
+    def _output_stream_definition(self, kind):
+        '''
+        Id of the stream definition the visualization transform of the given kind publishes, resolved (and created if
+        needed) once and then kept until the stream definition or its parameter dictionary is modified
+        '''
+        if self._output_stream_defs is None:
+            self._output_stream_defs = {}
+        if kind not in self._output_stream_defs:
+            name, pdict_name = self.OUTPUT_STREAM_DEFINITIONS[kind]
+            pdict_id = self.clients.dataset_management.read_parameter_dictionary_by_name(pdict_name, id_only=True)
+            stream_def_id = self.clients.pubsub_management.create_stream_definition(name, parameter_dictionary_id=pdict_id)
+            self._output_stream_defs[kind] = (stream_def_id, pdict_id)
+        return self._output_stream_defs[kind][0]
+
+    def _output_definition_modified(self, event, *args, **kwargs):
+        if not self._output_stream_defs:
+            return
+        for kind, ids in self._output_stream_defs.items():
+            if event.origin in ids:
+                log.debug('Output stream definition for %s visualizations modified, resolving it again on next use', kind)
+                del self._output_stream_defs[kind]
+
 
 
     def initiate_realtime_visualization_data(self, data_product_id='', visualization_parameters=None):
@@ -406,6 +459,11 @@ class VisualizationService(BaseVisualizationService):
             else:
                 query['stride_time'] = 1
 
+            # Coarse resolutions are served from the dataset's summary pyramid instead of the raw samples
+            if visualization_parameters.get('resolution'):
+                query['resolution'] = visualization_parameters['resolution']
+                query['aggregate'] = visualization_parameters.get('aggregate', 'mean')
+
             # direct access parameter
             if 'use_direct_access' in visualization_parameters:
                 if (int(visualization_parameters['use_direct_access']) == 1):
@@ -439,8 +497,7 @@ class VisualizationService(BaseVisualizationService):
             return simplejson.dumps(empty_hc)
 
         # send the granule through the transform to get the google datatable
-        hc_pdict_id = self.clients.dataset_management.read_parameter_dictionary_by_name('highcharts',id_only=True)
-        hc_stream_def = self.clients.pubsub_management.create_stream_definition('HighCharts_out', parameter_dictionary_id=hc_pdict_id)
+        hc_stream_def = self._output_stream_definition('highcharts')
 
         hc_data_granule = VizTransformHighChartsAlgorithm.execute(retrieved_granule, params=hc_stream_def, config=visualization_parameters)
 
@@ -491,6 +548,9 @@ class VisualizationService(BaseVisualizationService):
                 query['start_time'] = visualization_parameters['start_time']
             if 'end_time' in visualization_parameters:
                 query['end_time'] = visualization_parameters['end_time']
+            if visualization_parameters.get('resolution'):
+                query['resolution'] = visualization_parameters['resolution']
+                query['aggregate'] = visualization_parameters.get('aggregate', 'mean')
 
             # If an image_name was given, it means the image is already in the storage. Just need the latest granule.
             # ignore other paramters passed
@@ -518,8 +578,7 @@ class VisualizationService(BaseVisualizationService):
             mpl_data_granule = retrieved_granule
         else:
             # send the granule through the transform to get the matplotlib graphs
-            mpl_pdict_id = self.clients.dataset_management.read_parameter_dictionary_by_name('graph_image_param_dict',id_only=True)
-            mpl_stream_def = self.clients.pubsub_management.create_stream_definition('mpl', parameter_dictionary_id=mpl_pdict_id)
+            mpl_stream_def = self._output_stream_definition('mpl')
             mpl_data_granule = VizTransformMatplotlibGraphsAlgorithm.execute(retrieved_granule, config=visualization_parameters, params=mpl_stream_def)
 
         if mpl_data_granule == None:
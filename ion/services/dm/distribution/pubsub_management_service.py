@@ -14,6 +14,7 @@ from pyon.util.log import log
 
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule_utils import ParameterDictionary
+from ion.services.dm.utility.granule import RecordDictionaryTool
 
 from interface.objects import StreamDefinition, Stream, Subscription, Topic
 from interface.services.dm.ipubsub_management_service import BasePubsubManagementService
@@ -77,6 +78,7 @@ class PubsubManagementService(BasePubsubManagementService):
         validate_is_instance(obj,StreamDefinition)
         self._deassociate_definition(stream_definition_id)
         self.clients.resource_registry.delete(stream_definition_id)
+        RecordDictionaryTool.invalidate_stream_def(stream_definition_id)
         return True
 
     @classmethod
@@ -8,6 +8,7 @@ from ion.core.function.transform_function import TransformFunction
 from ion.processes.data.replay.replay_process import ReplayProcess
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
+from ion.services.dm.utility.coverage_pool import CoveragePool
 
 from pyon.core.exception import BadRequest 
 from pyon.container.cc import Container
@@ -20,29 +21,20 @@ from pyon.event.event import EventSubscriber
 from interface.objects import Replay 
 from interface.services.dm.idata_retriever_service import BaseDataRetrieverService
 
-import collections
-import time
-import gevent
 
 class DataRetrieverService(BaseDataRetrieverService):
     REPLAY_PROCESS = 'replay_process'
 
-    _refresh_interval = 10
-    _cache_limit      = 5
-    _retrieve_cache   = collections.OrderedDict()
-    _cache_lock       = gevent.coros.RLock()
-
     def on_start(self):
         self.event_subscriber = EventSubscriber(event_type='DatasetModified', callback=lambda event,m : self._eject_cache(event.origin), auto_delete=True)
         self.add_endpoint(self.event_subscriber)
 
     @classmethod
     def _eject_cache(cls, dataset_id):
-        with cls._cache_lock:
-            try:
-                cls._retrieve_cache.pop(dataset_id)
-            except KeyError:
-                pass
+        '''
+        The dataset changed, readers reopen the coverage on their next retrieve
+        '''
+        CoveragePool.instance().invalidate(dataset_id, mode='r')
     
     def define_replay(self, dataset_id='', query=None, delivery_format='', stream_id=''):
         ''' Define the stream that will contain the data from data store by streaming to an exchange name.
@@ -122,23 +114,14 @@ class DataRetrieverService(BaseDataRetrieverService):
     @classmethod
     def _get_coverage(cls,dataset_id):
         '''
-        Memoized coverage instantiation and management
+        Acquires a read-only coverage from the container's coverage pool, the
+        caller must hand it back with _release_coverage
         '''
-        # Cached get
-        retval = None
-        with cls._cache_lock:
-            try:
-                retval, age = cls._retrieve_cache.pop(dataset_id)
-                if (time.time() - age) > cls._refresh_interval:
-                    raise KeyError(dataset_id)
-            except KeyError: # Cache miss
-                #@TODO: Add in LRU logic (maybe some mem checking too!)
-                if len(cls._retrieve_cache) > cls._cache_limit:
-                    cls._retrieve_cache.popitem(0)
-                retval = DatasetManagementService._get_nonview_coverage(dataset_id, mode='r') 
-            age = time.time()
-            cls._retrieve_cache[dataset_id] = (retval, age)
-        return retval
+        return CoveragePool.instance().acquire(dataset_id, 'r', DatasetManagementService._get_nonview_coverage)
+
+    @classmethod
+    def _release_coverage(cls, dataset_id, coverage):
+        CoveragePool.instance().release(dataset_id, 'r', coverage)
 
     @classmethod
     def retrieve_oob(cls, dataset_id='', query=None, delivery_format=''):
@@ -152,13 +135,20 @@ class DataRetrieverService(BaseDataRetrieverService):
                 log.info('Reading from an empty coverage')
                 rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
             else:
-                rdt = ReplayProcess._cov2granule(coverage=coverage, start_time=query.get('start_time', None), end_time=query.get('end_time',None), stride_time=query.get('stride_time',None), parameters=query.get('parameters',None), stream_def_id=delivery_format, tdoa=query.get('tdoa',None))
+                rdt = None
+                if query.get('resolution'):
+                    rdt = ReplayProcess._summary_to_granule(coverage=coverage, resolution=query['resolution'], start_time=query.get('start_time', None), end_time=query.get('end_time',None), aggregate=query.get('aggregate', 'mean'), parameters=query.get('parameters',None), stream_def_id=delivery_format)
+                if rdt is None:
+                    rdt = ReplayProcess._cov2granule(coverage=coverage, start_time=query.get('start_time', None), end_time=query.get('end_time',None), stride_time=query.get('stride_time',None), parameters=query.get('parameters',None), stream_def_id=delivery_format, tdoa=query.get('tdoa',None))
         except:
             cls._eject_cache(dataset_id)
             data_products, _ = Container.instance.resource_registry.find_subjects(object=dataset_id, predicate=PRED.hasDataset, subject_type=RT.DataProduct)
             for data_product in data_products:
                 log.exception("Data Product %s (%s) had issues reading from the coverage model\nretrieve_oob(dataset_id='%s', query=%s, delivery_format=%s)", data_product.name, data_product._id, dataset_id, query, delivery_format)
             raise BadRequest('Problems reading from the coverage')
+        finally:
+            if coverage is not None:
+                cls._release_coverage(dataset_id, coverage)
         return rdt.to_granule()
 
   
@@ -166,7 +156,10 @@ class DataRetrieverService(BaseDataRetrieverService):
         '''
         Retrieves a dataset.
         @param dataset_id      Dataset identifier
-        @param query           Query parameters (start_time, end_time, stride_time, parameters, tdoa)
+        @param query           Query parameters (start_time, end_time, stride_time, parameters, tdoa, resolution, aggregate)
+                               resolution: seconds between records, coarse enough resolutions are served from the
+                                           dataset's summary pyramid, one record per bucket
+                               aggregate:  mean, min or max, the bucket statistic returned for summarized records
         @param delivery_format The stream definition identifier for the outgoing granule (stream_defintinition_id)
         @param module          Module to chain a transform into
         @param cls             Class of the transform
@@ -10,15 +10,15 @@ from interface.objects import View, Catalog, ElasticSearchIndex
 from interface.services.dm.idiscovery_service import BaseDiscoveryService
 from pyon.util.containers import DotDict, get_safe
 from pyon.util.arg_check import validate_true, validate_is_instance
-from pyon.public import PRED, CFG, RT, log
+from pyon.public import PRED, CFG, RT, OT, log
 from pyon.core.exception import BadRequest
-from pyon.event.event import EventPublisher
+from pyon.event.event import EventPublisher, EventSubscriber
 from pyon.core.bootstrap import get_obj_registry, get_sys_name
 from pyon.core.object import IonObjectDeserializer
 from ion.services.dm.inventory.index_management_service import IndexManagementService
 from ion.processes.bootstrap.index_bootstrap import STD_INDEXES
-from collections import deque
 from ion.services.dm.utility.query_language import QueryLanguage
+from ion.services.dm.utility.association_graph import AssociationGraph
 
 import dateutil.parser
 import calendar
@@ -29,6 +29,7 @@ import heapq
 
 class DiscoveryService(BaseDiscoveryService):
     SEARCH_BUFFER_SIZE=CFG.get_safe('service.discovery.search_buffer_size', 1048576)
+    _association_graph = None
 
     """
     class docstring
@@ -45,6 +46,9 @@ class DiscoveryService(BaseDiscoveryService):
         self.ep = EventPublisher(event_type = 'SearchBufferExceededEvent')
         self.heuristic_cutoff = 4
 
+        self.association_monitor = EventSubscriber(event_type=OT.ResourceModifiedEvent, callback=self._resource_modified, auto_delete=True)
+        self.add_endpoint(self.association_monitor)
+
     
    
     @staticmethod
@@ -190,34 +194,26 @@ class DiscoveryService(BaseDiscoveryService):
 #
 #        return db.query_view(view_name,opts=opts)
 
+    @property
+    def association_graph(self):
+        if self._association_graph is None:
+            self._association_graph = AssociationGraph(self.clients.resource_registry)
+        return self._association_graph
+
+    def _resource_modified(self, event, *args, **kwargs):
+        '''
+        The resource or its associations changed, its edges are reread before the next traversal
+        '''
+        if self._association_graph is not None:
+            self._association_graph.invalidate(event.origin)
+
     def traverse(self, resource_id=''):
         """Breadth-first traversal of the association graph for a specified resource.
 
         @param resource_id    str
         @retval resources    list
         """
-        
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_objects_mult(subjects=resource_ids,id_only=True)[0]
-            
-        visited_resources = deque(edges([resource_id]))
-        traversal_queue = deque()
-        done = False
-        t = None
-        while not done:
-            t = traversal_queue or deque(visited_resources)
-            traversal_queue = deque()
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    traversal_queue.append(e)
-            if not len(traversal_queue): done = True
-
-
-
-        return list(visited_resources)
+        return self.association_graph.traverse(resource_id)
 
     def reverse_traverse(self, resource_id=''):
         """Breadth-first traversal of the association graph for a specified resource.
@@ -225,85 +221,21 @@ class DiscoveryService(BaseDiscoveryService):
         @param resource_id    str
         @retval resources    list
         """
-        
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids,list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_subjects_mult(objects=resource_ids,id_only=True)[0]
-            
-        visited_resources = deque(edges([resource_id]))
-        traversal_queue = deque()
-        done = False
-        t = None
-        while not done:
-            t = traversal_queue or deque(visited_resources)
-            traversal_queue = deque()
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    traversal_queue.append(e)
-            if not len(traversal_queue): done = True
-
-
-
-        return list(visited_resources)
-    
+        return self.association_graph.traverse(resource_id, reverse=True)
 
     def iterative_traverse(self, resource_id='', limit=-1):
         '''
-        Iterative breadth first traversal of the resource associations
+        Iterative breadth first traversal of the resource associations, follows
+        the first level of associations and up to limit levels beyond it
         '''
-        #--------------------------------------------------------------------------------
-        # Retrieve edges for this resource
-        #--------------------------------------------------------------------------------
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_objects_mult(subjects=resource_ids,id_only=True)[0]
-            
-        gathered = deque()
-        visited_resources = deque(edges([resource_id]))
-        while limit>0:
-            t = gathered or deque(visited_resources)
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    gathered.append(e)
-            if not len(gathered): break
-
-            t = deque(gathered)
-            gathered = deque()
-            limit -= 1
-
-        return list(visited_resources)
+        return self.association_graph.traverse(resource_id, depth=max(limit, 0) + 1)
 
     def iterative_reverse_traverse(self, resource_id='', limit=-1):
         '''
-        Iterative breadth first traversal of the resource associations
+        Iterative breadth first traversal of the resource associations, follows
+        the first level of associations and up to limit levels beyond it
         '''
-        #--------------------------------------------------------------------------------
-        # Retrieve edges for this resource
-        #--------------------------------------------------------------------------------
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_subjects_mult(objects=resource_ids,id_only=True)[0]
-            
-        gathered = deque()
-        visited_resources = deque(edges([resource_id]))
-        while limit>0:
-            t = gathered or deque(visited_resources)
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    gathered.append(e)
-            if not len(gathered): break
-
-            t = deque(gathered)
-            gathered = deque()
-            limit -= 1
-
-        return list(visited_resources)
+        return self.association_graph.traverse(resource_id, depth=max(limit, 0) + 1, reverse=True)
 
 
             
@@ -147,21 +147,16 @@ class DiscoveryUnitTest(PyonTestCase):
         pass
         
 
-    @skip('Needs to be adjusted for new traversal')
     def test_traverse(self):
-        edge_list = ['B','C','D']
-        callers = []
-        def pop_edge(*args, **kwargs):
-            callers.append(args[0])
-            if len(edge_list):
-                val = edge_list.pop(0)
-                return [val], 'blah'
-            return [], 'blah'
-        self.rr_find_obj.side_effect = pop_edge
+        assocs = [DotDict(s='A', p=PRED.hasTransform, o='B'), DotDict(s='B', p=PRED.hasTransform, o='C'), DotDict(s='C', p=PRED.hasTransform, o='D')]
+        self.rr_find_assoc.side_effect = lambda predicate=None, id_only=False: [a for a in assocs if a.p == predicate]
 
         retval = self.discovery.traverse('A')
         retval.sort()
         self.assertTrue(retval == ['B','C','D'], '%s' % retval)
+        self.assertEquals(self.discovery.iterative_traverse('A'), ['B'])
+        self.assertEquals(self.discovery.iterative_traverse('A', 1), ['B', 'C'])
+        self.assertEquals(self.discovery.reverse_traverse('D'), ['C', 'B', 'A'])
 
     def test_intersect(self):
         test_vals = [0,1,2,3]
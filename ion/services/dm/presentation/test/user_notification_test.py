@@ -1046,12 +1046,12 @@ class UserNotificationIntTest(IonIntegrationTestCase):
         # Make assertions....
         #--------------------------------------------------------------------------------------
 
-        self.assertFalse(proc1.smtp_client.sent_mail.empty())
+        self.assertFalse(proc1.email_delivery.sent_mail.empty())
 
         email_list = []
 
-        while not proc1.smtp_client.sent_mail.empty():
-            email_tuple = proc1.smtp_client.sent_mail.get(timeout=10)
+        while not proc1.email_delivery.sent_mail.empty():
+            email_tuple = proc1.email_delivery.sent_mail.get(timeout=10)
             email_list.append(email_tuple)
 
         self.assertEquals(len(email_list), 1)
@@ -13,8 +13,9 @@ from pyon.public import RT, PRED, get_sys_name, OT, IonObject
 from pyon.event.event import EventPublisher, EventSubscriber
 from pyon.core.governance import ORG_MEMBER_ROLE, GovernanceHeaderValues, has_org_role
 
-from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, convert_events_to_email_message, get_event_computed_attributes
+from ion.services.dm.utility.uns_utility_methods import convert_events_to_email_message, get_event_computed_attributes
 from ion.services.dm.utility.uns_utility_methods import calculate_reverse_user_info
+from ion.services.dm.utility.email_delivery import EmailDelivery
 
 from interface.services.dm.idiscovery_service import DiscoveryServiceClient
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
@@ -89,6 +90,10 @@ class UserNotificationService(BaseUserNotificationService):
         self.event_publisher = EventPublisher()
         self.datastore = self.container.datastore_manager.get_datastore('events')
 
+        # Digest emails go out through a pool of SMTP connections
+        self.email_delivery = EmailDelivery(self.clients.resource_registry)
+        self.email_delivery.start(self._process.thread_manager)
+
         self.start_time = get_ion_ts()
 
         #------------------------------------------------------------------------------------
@@ -133,6 +138,8 @@ class UserNotificationService(BaseUserNotificationService):
             except IonException as ex:
                 log.info("Ignoring exception while cancelling schedule id (%s): %s: %s", sid, ex.__class__.__name__, ex)
 
+        self.email_delivery.stop()
+
         super(UserNotificationService, self).on_quit()
 
     def set_process_batch_key(self, process_batch_key = ''):
@@ -599,8 +606,6 @@ class UserNotificationService(BaseUserNotificationService):
         @param start_time int milliseconds
         @param end_time int milliseconds
         """
-        self.smtp_client = setting_up_smtp_client()
-
         if end_time <= start_time:
             return
 
@@ -665,10 +670,11 @@ class UserNotificationService(BaseUserNotificationService):
             # send a notification email to each user using a _send_email() method
             if events_for_message:
                 self.format_and_send_email(events_for_message = events_for_message,
-                                            user_id = user_id,
-                                            smtp_client=self.smtp_client)
+                                            user_id = user_id)
 
-        self.smtp_client.quit()
+        # The digests are queued, wait for them to go out
+        if not self.email_delivery.flush(timeout=CFG.get_safe('server.smtp.flush_timeout', 60)):
+            log.warning("Timed out sending the batch notification emails: %s", self.email_delivery.stats())
 
 
     def format_and_send_email(self, events_for_message=None, user_id=None, smtp_client=None):
@@ -692,7 +698,7 @@ class UserNotificationService(BaseUserNotificationService):
         Send the email
 
         @param msg MIMEText object of email message
-        @param smtp_client object
+        @param smtp_client object, the email is queued for delivery if no client is given
         """
 
         if msg is None: msg = {}
@@ -709,7 +715,10 @@ class UserNotificationService(BaseUserNotificationService):
 
         smtp_sender = CFG.get_safe('server.smtp.sender')
 
-        smtp_client.sendmail(smtp_sender, [msg_recipient], msg.as_string())
+        if smtp_client is None:
+            self.email_delivery.send(msg, msg_recipient, sender=smtp_sender)
+        else:
+            smtp_client.sendmail(smtp_sender, [msg_recipient], msg.as_string())
 
     def update_user_info_object(self, user_id, new_notification):
         """
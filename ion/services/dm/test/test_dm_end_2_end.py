@@ -18,6 +18,7 @@ from ion.processes.data.replay.replay_client import ReplayClient
 from ion.services.dm.ingestion.test.ingestion_management_test import IngestionManagementIntTest
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.inventory.data_retriever_service import DataRetrieverService
+from ion.services.dm.utility.coverage_pool import CoveragePool
 from ion.services.dm.utility.granule_utils import RecordDictionaryTool, CoverageCraft, time_series_domain
 from ion.services.dm.utility.test.parameter_helper import ParameterHelper
 from ion.util.stored_values import StoredValueManager
@@ -615,48 +616,43 @@ class TestDMEnd2End(IonIntegrationTestCase):
     @attr('LOCOINT')
     @unittest.skipIf(os.getenv('CEI_LAUNCH_TEST', False), 'Host requires file-system access to coverage files, CEI mode does not support.')
     def test_retrieve_cache(self):
-        DataRetrieverService._refresh_interval = 1
-        datasets = [self.make_simple_dataset() for i in xrange(10)]
+        pool = CoveragePool.instance()
+        datasets = [self.make_simple_dataset() for i in xrange(pool.max_handles + 1)]
         for stream_id, route, stream_def_id, dataset_id in datasets:
             coverage = DatasetManagementService._get_simplex_coverage(dataset_id, mode='a')
             coverage.insert_timesteps(10)
             coverage.set_parameter_values('time', np.arange(10))
             coverage.set_parameter_values('temp', np.arange(10))
 
-        # Verify cache hit and refresh
+        # Verify cache hit
         dataset_ids = [i[3] for i in datasets]
-        self.assertTrue(dataset_ids[0] not in DataRetrieverService._retrieve_cache)
-        DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the chache
-        cov, age = DataRetrieverService._retrieve_cache[dataset_ids[0]]
-        # Verify that it was hit and it's now in there
-        self.assertTrue(dataset_ids[0] in DataRetrieverService._retrieve_cache)
-
-        gevent.sleep(DataRetrieverService._refresh_interval + 0.2)
-
-        DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the chache
-        cov, age2 = DataRetrieverService._retrieve_cache[dataset_ids[0]]
-        self.assertTrue(age2 != age)
-
-        for dataset_id in dataset_ids:
-            DataRetrieverService._get_coverage(dataset_id)
+        self.assertFalse(pool.contains(dataset_ids[0], 'r'))
+        hits = pool.hits
+        cov = DataRetrieverService._get_coverage(dataset_ids[0])
+        DataRetrieverService._release_coverage(dataset_ids[0], cov)
+        self.assertTrue(pool.contains(dataset_ids[0], 'r'))
+        cov2 = DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the cache
+        DataRetrieverService._release_coverage(dataset_ids[0], cov2)
+        self.assertIs(cov, cov2)
+        self.assertEquals(pool.hits, hits + 1)
+
+        # Least recently used coverage gets evicted
+        for dataset_id in dataset_ids[1:]:
+            DataRetrieverService._release_coverage(dataset_id, DataRetrieverService._get_coverage(dataset_id))
         
-        self.assertTrue(dataset_ids[0] not in DataRetrieverService._retrieve_cache)
+        self.assertFalse(pool.contains(dataset_ids[0], 'r'))
 
-        stream_id, route, stream_def, dataset_id = datasets[0]
+        # New data refreshes the coverage
+        stream_id, route, stream_def, dataset_id = datasets[-1]
+        self.assertTrue(pool.contains(dataset_id, 'r'))
         self.start_ingestion(stream_id, dataset_id)
-        DataRetrieverService._get_coverage(dataset_id)
-        
-        self.assertTrue(dataset_id in DataRetrieverService._retrieve_cache)
-
-        DataRetrieverService._refresh_interval = 100
         self.publish_hifi(stream_id,route,1)
         self.wait_until_we_have_enough_granules(dataset_id, data_size=20)
-            
  
         event = gevent.event.Event()
         with gevent.Timeout(20):
             while not event.wait(0.1):
-                if dataset_id not in DataRetrieverService._retrieve_cache:
+                if not pool.contains(dataset_id, 'r'):
                     event.set()
 
 
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/association_graph.py
+@description In-memory adjacency index of the resource registry associations used for traversals
+'''
+
+from pyon.public import CFG, PRED
+from pyon.util.log import log
+
+from collections import Counter
+from gevent.coros import RLock
+
+import numpy as np
+import time
+
+
+class AssociationGraph(object):
+    '''
+    Adjacency index over the associations in the resource registry.
+
+    Resources are mapped to compact integer ids and the edges are held in two
+    CSR (compressed sparse row) structures, one for subject -> object and one
+    for object -> subject, each a tuple of (indptr, neighbors, predicates).
+
+    Changed resources are marked dirty with invalidate() and their associations
+    are reread before the next traversal.  Refreshed rows override the CSR rows
+    until enough of them pile up to be compacted back into new CSR arrays.  Too
+    many dirty resources, or a graph older than max_age, triggers a full rebuild.
+
+    Configuration (service.discovery.association_graph):
+      max_age: 3600            # Seconds before the graph is rebuilt from scratch, 0 disables it
+      compact_threshold: 1024  # Overridden rows kept before the CSR arrays are rebuilt
+      dirty_limit: 256         # Dirty resources refreshed individually, beyond this the graph is rebuilt
+    '''
+
+    def __init__(self, resource_registry, max_age=None, compact_threshold=None, dirty_limit=None):
+        self.resource_registry = resource_registry
+        self.max_age           = max_age if max_age is not None else CFG.get_safe('service.discovery.association_graph.max_age', 3600)
+        self.compact_threshold = compact_threshold or CFG.get_safe('service.discovery.association_graph.compact_threshold', 1024)
+        self.dirty_limit       = dirty_limit or CFG.get_safe('service.discovery.association_graph.dirty_limit', 256)
+        self._lock = RLock()
+        self._reset()
+
+    def _reset(self):
+        self._ids        = {}  # resource_id -> int
+        self._keys       = []  # int -> resource_id
+        self._pred_ids   = {}  # predicate -> int
+        self._pred_names = []  # int -> predicate
+        self._forward    = self._csr(0, [], [], [])
+        self._reverse    = self._csr(0, [], [], [])
+        self._out_rows   = {}  # Overridden forward rows, int -> (neighbors, predicates)
+        self._in_rows    = {}  # Overridden reverse rows
+        self._dirty      = set()
+        self.built       = None
+
+    #--------------------------------------------------------------------------------
+    # Maintenance
+    #--------------------------------------------------------------------------------
+
+    @classmethod
+    def predicates(cls):
+        return [p for p in PRED.values() if isinstance(p, basestring)]
+
+    def build(self):
+        '''
+        Loads every association from the resource registry
+        '''
+        with self._lock:
+            self._reset()
+            subjects, objects, preds = [], [], []
+            for predicate in self.predicates():
+                for assoc in self.resource_registry.find_associations(predicate=predicate, id_only=False):
+                    subjects.append(self._id(assoc.s))
+                    objects.append(self._id(assoc.o))
+                    preds.append(self._pred_id(assoc.p))
+            n = len(self._keys)
+            self._forward = self._csr(n, subjects, objects, preds)
+            self._reverse = self._csr(n, objects, subjects, preds)
+            self.built = time.time()
+            log.debug('Association graph built: %s resources, %s associations', n, len(subjects))
+
+    def invalidate(self, resource_id):
+        '''
+        Marks a resource whose associations may have changed
+        '''
+        with self._lock:
+            if self.built is not None:
+                self._dirty.add(resource_id)
+
+    def refresh(self, resource_id):
+        '''
+        Rereads the associations of a single resource
+        '''
+        with self._lock:
+            n = self._id(resource_id)
+            out_assocs = self.resource_registry.find_associations(subject=resource_id, id_only=False)
+            in_assocs  = self.resource_registry.find_associations(object=resource_id, id_only=False)
+            self._set_row(n, [(self._id(a.o), self._pred_id(a.p)) for a in out_assocs], reverse=False)
+            self._set_row(n, [(self._id(a.s), self._pred_id(a.p)) for a in in_assocs], reverse=True)
+            if len(self._out_rows) + len(self._in_rows) > self.compact_threshold:
+                self.compact()
+
+    def compact(self):
+        '''
+        Folds the overridden rows back into the CSR arrays
+        '''
+        with self._lock:
+            n = len(self._keys)
+            subjects, objects, preds = self._edges(self._forward, self._out_rows)
+            self._forward = self._csr(n, subjects, objects, preds)
+            self._reverse = self._csr(n, objects, subjects, preds)
+            self._out_rows = {}
+            self._in_rows  = {}
+
+    def ensure_current(self):
+        with self._lock:
+            if self.built is None or (self.max_age and time.time() - self.built > self.max_age) or len(self._dirty) > self.dirty_limit:
+                self.build()
+                return
+            while self._dirty:
+                self.refresh(self._dirty.pop())
+
+    #--------------------------------------------------------------------------------
+    # Traversal
+    #--------------------------------------------------------------------------------
+
+    def traverse(self, resource_id, depth=None, predicates=None, reverse=False):
+        '''
+        Breadth-first traversal from a resource, returns the ids of the resources
+        reached in the order they were visited.  depth limits the number of levels
+        followed, predicates restricts the associations followed and reverse walks
+        from objects to subjects.  The starting resource is only part of the
+        result if it can be reached from itself.
+        '''
+        with self._lock:
+            self.ensure_current()
+            start = self._ids.get(resource_id)
+            if start is None:
+                return []
+            allowed = None
+            if predicates is not None:
+                allowed = np.array([self._pred_ids[p] for p in predicates if p in self._pred_ids], dtype='int32')
+
+            visited  = set()
+            order    = []
+            frontier = [start]
+            level    = 0
+            while frontier and (depth is None or level < depth):
+                next_frontier = []
+                for node in frontier:
+                    neighbors, preds = self._row(node, reverse)
+                    if allowed is not None:
+                        neighbors = neighbors[np.in1d(preds, allowed)]
+                    for neighbor in neighbors.tolist():
+                        if neighbor not in visited:
+                            visited.add(neighbor)
+                            order.append(neighbor)
+                            next_frontier.append(neighbor)
+                frontier = next_frontier
+                level += 1
+            return [self._keys[i] for i in order]
+
+    #--------------------------------------------------------------------------------
+    # Internals
+    #--------------------------------------------------------------------------------
+
+    def _id(self, resource_id):
+        try:
+            return self._ids[resource_id]
+        except KeyError:
+            i = self._ids[resource_id] = len(self._keys)
+            self._keys.append(resource_id)
+            return i
+
+    def _pred_id(self, predicate):
+        try:
+            return self._pred_ids[predicate]
+        except KeyError:
+            i = self._pred_ids[predicate] = len(self._pred_names)
+            self._pred_names.append(predicate)
+            return i
+
+    @staticmethod
+    def _csr(n, sources, targets, preds):
+        sources = np.asarray(sources, dtype='int64')
+        order   = np.argsort(sources, kind='mergesort')
+        indptr  = np.zeros(n + 1, dtype='int64')
+        if sources.shape[0]:
+            np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+        return (indptr,
+                np.asarray(targets, dtype='int32')[order],
+                np.asarray(preds, dtype='int32')[order])
+
+    @staticmethod
+    def _edges(csr, rows):
+        '''
+        Returns the (sources, targets, predicates) arrays of a CSR structure with its overridden rows applied
+        '''
+        indptr, targets, preds = csr
+        sources = np.repeat(np.arange(indptr.shape[0] - 1), np.diff(indptr))
+        keep = ~np.in1d(sources, np.fromiter(rows.iterkeys(), dtype='int64', count=len(rows)))
+        sources, targets, preds = [sources[keep]], [targets[keep]], [preds[keep]]
+        for node, (row_targets, row_preds) in rows.iteritems():
+            sources.append(np.repeat(node, row_targets.shape[0]))
+            targets.append(row_targets)
+            preds.append(row_preds)
+        return np.concatenate(sources), np.concatenate(targets), np.concatenate(preds)
+
+    def _row(self, node, reverse):
+        rows = self._in_rows if reverse else self._out_rows
+        if node in rows:
+            return rows[node]
+        indptr, targets, preds = self._reverse if reverse else self._forward
+        if node + 1 >= indptr.shape[0]:
+            return targets[:0], preds[:0]
+        lower, upper = indptr[node], indptr[node + 1]
+        return targets[lower:upper], preds[lower:upper]
+
+    @staticmethod
+    def _make_row(edges):
+        return (np.array([e[0] for e in edges], dtype='int32'),
+                np.array([e[1] for e in edges], dtype='int32'))
+
+    def _set_row(self, node, edges, reverse):
+        '''
+        Replaces a row and mirrors the difference into the rows of its neighbors
+        '''
+        rows, mirror = (self._in_rows, self._out_rows) if reverse else (self._out_rows, self._in_rows)
+        old = Counter(zip(*[a.tolist() for a in self._row(node, reverse)]))
+        new = Counter(edges)
+        for (neighbor, pred), count in (old - new).iteritems():
+            mirrored = Counter(zip(*[a.tolist() for a in self._row(neighbor, not reverse)]))
+            mirrored[(node, pred)] -= count
+            mirror[neighbor] = self._make_row(list(mirrored.elements()))
+        for (neighbor, pred), count in (new - old).iteritems():
+            mirrored = zip(*[a.tolist() for a in self._row(neighbor, not reverse)])
+            mirror[neighbor] = self._make_row(mirrored + [(node, pred)] * count)
+        rows[node] = self._make_row(list(new.elements()))
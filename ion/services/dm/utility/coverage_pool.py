@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/coverage_pool.py
+@description Container-level pool of open coverage handles shared by retrieval and ingestion
+'''
+
+from pyon.public import CFG
+from pyon.util.log import log
+
+from collections import OrderedDict
+from gevent.coros import RLock
+
+
+class PooledCoverage(object):
+    '''
+    Bookkeeping for one open coverage in the pool
+    '''
+    __slots__ = ('coverage', 'refs', 'stale', 'size')
+
+    def __init__(self, coverage, size):
+        self.coverage = coverage
+        self.refs     = 0
+        self.stale    = False
+        self.size     = size
+
+
+class CoveragePool(object):
+    '''
+    LRU pool of open coverages keyed by (dataset_id, mode).
+
+    Handles are reference counted: acquire() hands out a coverage and release()
+    returns it.  A coverage is only closed once nothing holds it, either when it
+    is evicted to stay under the handle and memory limits or when it has been
+    invalidated (the dataset was modified, or the holder saw it fail).  In-use
+    coverages can temporarily push the pool over its limits.
+
+    Configuration (container.coverage_pool):
+      max_handles: 10                # Open coverages kept by the pool
+      max_memory:  268435456         # Estimated bytes held by the open coverages
+      parameter_overhead: 65536      # Estimated bytes held per parameter of an open coverage
+    '''
+    _instance = None
+
+    def __init__(self, max_handles=None, max_memory=None, parameter_overhead=None):
+        self.max_handles = max_handles or CFG.get_safe('container.coverage_pool.max_handles', 10)
+        self.max_memory  = max_memory or CFG.get_safe('container.coverage_pool.max_memory', 256 * 1024 * 1024)
+        self.parameter_overhead = parameter_overhead or CFG.get_safe('container.coverage_pool.parameter_overhead', 64 * 1024)
+        self._entries = OrderedDict()
+        self._orphans = {} # Stale coverages replaced while in use, keyed by id(coverage)
+        self._lock    = RLock()
+        self.memory   = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    @classmethod
+    def instance(cls):
+        '''
+        The container-wide pool
+        '''
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def estimate_size(self, coverage):
+        try:
+            return len(coverage.list_parameters()) * self.parameter_overhead
+        except Exception:
+            return self.parameter_overhead
+
+    def acquire(self, dataset_id, mode, loader):
+        '''
+        Returns an open coverage for the dataset, loader(dataset_id, mode) opens
+        one on a miss.  Every acquire must be paired with a release.
+        '''
+        key = (dataset_id, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.stale:
+                self.hits += 1
+                del self._entries[key]
+            else:
+                self.misses += 1
+                coverage = loader(dataset_id, mode=mode)
+                if coverage is None:
+                    return None
+                if entry is not None:
+                    del self._entries[key]
+                    if entry.refs:
+                        # A stale handle that's still in use, it gets closed on its last release
+                        self._orphan(entry)
+                    else:
+                        self._close(entry)
+                entry = PooledCoverage(coverage, self.estimate_size(coverage))
+                self.memory += entry.size
+            entry.refs += 1
+            self._entries[key] = entry
+            self._evict()
+            return entry.coverage
+
+    def release(self, dataset_id, mode, coverage):
+        with self._lock:
+            key = (dataset_id, mode)
+            entry = self._entries.get(key)
+            if entry is None or entry.coverage is not coverage:
+                entry = self._orphans.get(id(coverage))
+                if entry is None:
+                    return
+            entry.refs = max(entry.refs - 1, 0)
+            if entry.refs:
+                return
+            if id(coverage) in self._orphans:
+                del self._orphans[id(coverage)]
+                self._close(entry)
+            elif entry.stale:
+                del self._entries[key]
+                self._close(entry)
+            else:
+                self._evict()
+
+    def put(self, dataset_id, mode, coverage):
+        '''
+        Replaces the pooled coverage for a dataset with an already open one
+        '''
+        key = (dataset_id, mode)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                entry.stale = True
+                if entry.refs:
+                    self._orphan(entry)
+                else:
+                    self._close(entry)
+            entry = PooledCoverage(coverage, self.estimate_size(coverage))
+            self.memory += entry.size
+            self._entries[key] = entry
+            self._evict()
+
+    def contains(self, dataset_id, mode):
+        entry = self._entries.get((dataset_id, mode))
+        return entry is not None and not entry.stale
+
+    def invalidate(self, dataset_id, mode=None):
+        '''
+        Marks the dataset's coverages stale, the next acquire reopens them.
+        Idle coverages are closed immediately, in-use ones on their last release.
+        '''
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == dataset_id and (mode is None or k[1] == mode)]:
+                entry = self._entries[key]
+                entry.stale = True
+                if not entry.refs:
+                    del self._entries[key]
+                    self._close(entry)
+
+    def clear(self):
+        '''
+        Closes every idle coverage
+        '''
+        with self._lock:
+            for key in [k for k,e in self._entries.iteritems() if not e.refs]:
+                self._close(self._entries.pop(key))
+
+    def stats(self):
+        return {'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'open'      : len(self._entries) + len(self._orphans),
+                'in_use'    : len([e for e in self._entries.itervalues() if e.refs]) + len(self._orphans),
+                'memory'    : self.memory}
+
+    #--------------------------------------------------------------------------------
+    # Internals
+    #--------------------------------------------------------------------------------
+
+    def _orphan(self, entry):
+        entry.stale = True
+        self._orphans[id(entry.coverage)] = entry
+
+    def _evict(self):
+        for key in self._entries.keys():
+            if len(self._entries) <= self.max_handles and self.memory <= self.max_memory:
+                return
+            entry = self._entries[key]
+            if entry.refs:
+                continue
+            del self._entries[key]
+            self.evictions += 1
+            self._close(entry)
+
+    def _close(self, entry):
+        self.memory -= entry.size
+        try:
+            entry.coverage.close(timeout=5)
+        except Exception:
+            log.exception('Problems closing the coverage')
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/email_delivery.py
+@description Asynchronous delivery of notification emails over pooled SMTP connections
+'''
+
+from pyon.public import CFG
+from pyon.util.log import log
+from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, convert_events_to_email_message
+
+from collections import deque
+from gevent.coros import BoundedSemaphore
+from gevent.event import Event
+
+import gevent
+import gevent.queue
+import time
+
+ION_NOTIFICATION_EMAIL_ADDRESS = 'data_alerts@oceanobservatories.org'
+
+
+class SMTPConnectionPool(object):
+    '''
+    Bounded pool of persistent SMTP connections.  get() blocks while every
+    connection is checked out, idle connections are reused until they have
+    been idle for longer than max_idle.
+
+    When the fake SMTP library is in use (system.smtp is False) the
+    connections deliver to the pool's sent_mail queue.
+
+    Configuration (server.smtp):
+      pool_size: 4     # Open SMTP connections
+      max_idle:  60    # Seconds an idle connection is kept open
+    '''
+
+    def __init__(self, size=None, max_idle=None, connect=None):
+        self.size      = size or CFG.get_safe('server.smtp.pool_size', 4)
+        self.max_idle  = max_idle or CFG.get_safe('server.smtp.max_idle', 60)
+        self.sent_mail = gevent.queue.Queue()
+        self._connect  = connect or (lambda: setting_up_smtp_client(sent_mail=self.sent_mail))
+        self._slots    = BoundedSemaphore(self.size)
+        self._idle     = [] # (connection, last used)
+        self.opened    = 0
+
+    def get(self):
+        self._slots.acquire()
+        try:
+            now = time.time()
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if now - last_used <= self.max_idle:
+                    return connection
+                self._quit(connection)
+            connection = self._connect()
+            self.opened += 1
+            return connection
+        except:
+            self._slots.release()
+            raise
+
+    def put(self, connection, broken=False):
+        '''
+        Returns a connection to the pool, broken connections are closed
+        '''
+        if broken:
+            self._quit(connection)
+        else:
+            self._idle.append((connection, time.time()))
+        self._slots.release()
+
+    def close(self):
+        while self._idle:
+            self._quit(self._idle.pop()[0])
+
+    def _quit(self, connection):
+        try:
+            connection.quit()
+        except Exception:
+            log.debug('Problems closing an SMTP connection', exc_info=True)
+
+
+class EmailDelivery(object):
+    '''
+    Queue of outgoing notification emails sent by a fixed number of sender
+    greenlets over an SMTPConnectionPool, so callers don't wait on SMTP.
+
+    With a coalesce_window, events notified for the same recipient within
+    coalesce_window seconds go out together as one email, a recipient's email
+    holding max_events events goes out right away and the following events
+    start a new one.  Prepared messages passed to send() aren't coalesced.
+    When the senders fall behind, at most queue_size messages wait for a
+    connection and the dispatcher blocks, the time it spent blocked is
+    reported by stats().  Behind it at most max_held events are held, then
+    notify() blocks too.
+
+    Configuration (server.smtp):
+      coalesce_window: 0     # Seconds events for a recipient are held back, 0 sends every event on its own
+      max_events: 50         # Events in one coalesced email
+      queue_size: 1000       # Messages waiting for a connection
+      max_held: 10000        # Events held back or waiting for the dispatcher
+    '''
+
+    def __init__(self, rr_client, pool=None, coalesce_window=None, max_events=None, queue_size=None, max_held=None):
+        self.rr_client       = rr_client
+        self.pool            = pool or SMTPConnectionPool()
+        self.coalesce_window = coalesce_window if coalesce_window is not None else CFG.get_safe('server.smtp.coalesce_window', 0)
+        self.max_events      = max_events or CFG.get_safe('server.smtp.max_events', 50)
+        self.queue_size      = queue_size or CFG.get_safe('server.smtp.queue_size', 1000)
+        self.max_held        = max_held or CFG.get_safe('server.smtp.max_held', 10000)
+        self.sender          = CFG.get_safe('server.smtp.sender', ION_NOTIFICATION_EMAIL_ADDRESS)
+
+        self._pending     = {}      # recipient -> events waiting out the coalesce window
+        self._due         = deque() # (deadline, recipient, events)
+        self._ready       = deque() # (recipient, events) to dispatch right away
+        self._held        = 0       # events in _pending and _ready
+        self._room        = Event() # set when events were dispatched
+        self._queue       = gevent.queue.Queue(maxsize=self.queue_size)
+        self._wakeup      = Event()
+        self._drained     = Event()
+        self._drained.set()
+        self._outstanding = 0
+        self._greenlets   = []
+
+        self.sent      = 0
+        self.failed    = 0
+        self.coalesced = 0
+        self.reconnects = 0
+        self.blocked   = 0.
+        self.max_queued = 0
+
+    @property
+    def sent_mail(self):
+        return self.pool.sent_mail
+
+    def start(self, thread_manager=None):
+        '''
+        Starts the dispatcher and sender greenlets, in the process' thread_manager if given
+        '''
+        if self._greenlets:
+            return
+        spawn = thread_manager.spawn if thread_manager is not None else gevent.spawn
+        self._greenlets = [spawn(self._dispatch)] + [spawn(self._send_loop) for i in xrange(self.pool.size)]
+
+    def stop(self, timeout=10):
+        self.flush(timeout)
+        for thread in self._greenlets:
+            # The greenlet of a thread_manager thread
+            getattr(thread, 'proc', thread).kill()
+        self._greenlets = []
+        self.pool.close()
+
+    def notify(self, event, recipient):
+        '''
+        Queues a notification email about an event, blocks only while max_held events are held
+        '''
+        while self._held >= self.max_held:
+            self._room.clear()
+            self._room.wait()
+        self._held += 1
+        events = self._pending.get(recipient)
+        if events is None:
+            events = self._pending[recipient] = [event]
+            self._begin()
+            if self.coalesce_window:
+                self._due.append((time.time() + self.coalesce_window, recipient, events))
+        else:
+            events.append(event)
+            self.coalesced += 1
+        if not self.coalesce_window or len(events) >= self.max_events:
+            self._close(recipient)
+        self._wakeup.set()
+
+    def send(self, msg, recipient, sender=None):
+        '''
+        Queues a prepared message, blocks while the queue is full
+        '''
+        self._begin()
+        self._put((sender or self.sender, recipient, msg))
+
+    def flush(self, timeout=None):
+        '''
+        Dispatches the held events and waits for the queue to drain, returns False on timeout
+        '''
+        for recipient in self._pending.keys():
+            self._close(recipient)
+        self._wakeup.set()
+        return self._drained.wait(timeout)
+
+    def stats(self):
+        return {'queued'      : self._queue.qsize(),
+                'max_queued'  : self.max_queued,
+                'pending'     : len(self._pending),
+                'held'        : self._held,
+                'outstanding' : self._outstanding,
+                'sent'        : self.sent,
+                'failed'      : self.failed,
+                'coalesced'   : self.coalesced,
+                'reconnects'  : self.reconnects,
+                'blocked'     : self.blocked,
+                'connections' : self.pool.opened}
+
+    #--------------------------------------------------------------------------------
+    # Internals
+    #--------------------------------------------------------------------------------
+
+    def _begin(self):
+        self._outstanding += 1
+        self._drained.clear()
+
+    def _done(self):
+        self._outstanding -= 1
+        if not self._outstanding:
+            self._drained.set()
+
+    def _put(self, item):
+        if self._queue.full():
+            then = time.time()
+            self._queue.put(item)
+            self.blocked += time.time() - then
+            log.debug('Email delivery queue is full, waited %.3fs (total %.3fs)', time.time() - then, self.blocked)
+        else:
+            self._queue.put(item)
+        self.max_queued = max(self.max_queued, self._queue.qsize())
+
+    def _close(self, recipient):
+        # Readies the recipient's email, the next event starts a new one
+        self._ready.append((recipient, self._pending.pop(recipient)))
+
+    def _release(self, recipient, events):
+        self._put((self.sender, recipient, events))
+        self._held -= len(events)
+        self._room.set()
+
+    def _dispatch(self):
+        while True:
+            while self._ready:
+                self._release(*self._ready.popleft())
+            now = time.time()
+            while self._due and self._due[0][0] <= now:
+                _, recipient, events = self._due.popleft()
+                if self._pending.get(recipient) is events:
+                    self._close(recipient)
+            if self._ready:
+                continue
+            self._wakeup.clear()
+            self._wakeup.wait(self._due[0][0] - now if self._due else None)
+
+    def _send_loop(self):
+        while True:
+            sender, recipient, payload = self._queue.get()
+            try:
+                if isinstance(payload, list):
+                    payload = self._message(sender, recipient, payload)
+                self._deliver(sender, recipient, payload)
+                self.sent += 1
+            except Exception:
+                self.failed += 1
+                log.exception('Failed to send a notification email to %s', recipient)
+            finally:
+                self._done()
+
+    def _message(self, sender, recipient, events):
+        msg = convert_events_to_email_message(events, self.rr_client)
+        msg['From'] = sender
+        msg['To'] = recipient
+        return msg
+
+    def _deliver(self, sender, recipient, msg):
+        msg = msg.as_string()
+        for attempt in xrange(2):
+            connection = self.pool.get()
+            try:
+                connection.sendmail(sender, [recipient], msg)
+            except Exception:
+                # Most likely a dropped connection, retry once over a new one
+                self.pool.put(connection, broken=True)
+                if attempt:
+                    raise
+                self.reconnects += 1
+            else:
+                self.pool.put(connection)
+                return
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+@package ion.services.dm.utility.granule.pdict_cache
+@file ion/services/dm/utility/granule/pdict_cache.py
+@brief Process-wide cache of loaded parameter dictionaries for record dictionaries
+'''
+
+from pyon.core.interceptor.encode import encode_ion
+from pyon.public import CFG
+
+from coverage_model import ParameterDictionary
+
+from collections import OrderedDict
+import hashlib
+import msgpack
+
+
+class ParsedParameterDictionary(object):
+    '''
+    A loaded ParameterDictionary along with the lookups a RecordDictionaryTool
+    needs for every granule. Instances are shared between record dictionaries
+    and must be treated as read-only.
+    '''
+    __slots__ = ('pdict', 'fields', 'field_set', 'contexts', 'param_types', 'key_to_ord', 'ord_to_key', 'temporal_parameter')
+
+    def __init__(self, pdict):
+        self.pdict              = pdict
+        self.fields             = tuple(pdict.keys())
+        self.field_set          = frozenset(self.fields)
+        self.contexts           = dict((k, pdict.get_context(k)) for k in self.fields)
+        self.param_types        = dict((k, c.param_type) for k,c in self.contexts.iteritems())
+        self.key_to_ord         = dict((k, pdict.ord_from_key(k)) for k in self.fields)
+        self.ord_to_key         = dict((o, k) for k,o in self.key_to_ord.iteritems())
+        self.temporal_parameter = pdict.temporal_parameter_name
+
+    def key_from_ord(self, ordinal):
+        try:
+            return self.ord_to_key[ordinal]
+        except KeyError:
+            return self.pdict.key_from_ord(ordinal)
+
+    def ord_from_key(self, key):
+        try:
+            return self.key_to_ord[key]
+        except KeyError:
+            return self.pdict.ord_from_key(key)
+
+
+class ParameterDictionaryCache(object):
+    '''
+    Size-bounded LRU cache of ParsedParameterDictionary instances keyed by
+    stream definition id and a digest of the serialized parameter dictionary,
+    a stream definition that changes its parameter dictionary gets a new entry.
+    '''
+    _entries = OrderedDict()
+    _digests = {}
+    hits     = 0
+    misses   = 0
+
+    @classmethod
+    def limit(cls):
+        return CFG.get_safe('container.pdict_cache_size', 100)
+
+    @classmethod
+    def digest(cls, pdict_dump):
+        return hashlib.sha1(msgpack.packb(pdict_dump, default=encode_ion)).hexdigest()
+
+    @classmethod
+    def _digest_for(cls, stream_definition_id, pdict_dump):
+        # Stream definitions are memoized so the same dump object usually comes back, skip rehashing it
+        if stream_definition_id in cls._digests:
+            dump, digest = cls._digests[stream_definition_id]
+            if dump is pdict_dump:
+                return digest
+        digest = cls.digest(pdict_dump)
+        if stream_definition_id:
+            cls._digests[stream_definition_id] = (pdict_dump, digest)
+        return digest
+
+    @classmethod
+    def get(cls, pdict_dump, stream_definition_id=''):
+        '''
+        Returns the ParsedParameterDictionary for a serialized parameter dictionary, loading it on a miss
+        '''
+        key = (stream_definition_id, cls._digest_for(stream_definition_id, pdict_dump))
+        try:
+            entry = cls._entries.pop(key)
+            cls.hits += 1
+        except KeyError:
+            entry = ParsedParameterDictionary(ParameterDictionary.load(pdict_dump))
+            cls.misses += 1
+            while cls._entries and len(cls._entries) >= cls.limit():
+                (evicted_id, evicted_digest), _ = cls._entries.popitem(last=False)
+                if cls._digests.get(evicted_id, (None, None))[1] == evicted_digest:
+                    del cls._digests[evicted_id]
+        cls._entries[key] = entry
+        return entry
+
+    @classmethod
+    def invalidate(cls, stream_definition_id=None):
+        '''
+        Drops the entries for a stream definition, or every entry if no id is given
+        '''
+        if stream_definition_id is None:
+            cls._entries.clear()
+            cls._digests.clear()
+            return
+        cls._digests.pop(stream_definition_id, None)
+        for key in [k for k in cls._entries if k[0] == stream_definition_id]:
+            del cls._entries[key]
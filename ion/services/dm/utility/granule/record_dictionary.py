@@ -14,9 +14,9 @@ from pyon.core.object import IonObjectSerializer
 from pyon.core.interceptor.encode import encode_ion
 from pyon.util.arg_check import validate_equal
 from pyon.util.log import log
-from pyon.util.memoize import memoize_lru
 
 from ion.util.stored_values import StoredValueManager
+from ion.services.dm.utility.granule.pdict_cache import ParameterDictionaryCache, ParsedParameterDictionary
 
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
 from interface.objects import Granule, StreamDefinition
@@ -26,6 +26,7 @@ from coverage_model.parameter_functions import ParameterFunctionException
 from coverage_model.parameter_values import AbstractParameterValue, ConstantValue
 from coverage_model.parameter_types import ParameterFunctionType
 
+from collections import OrderedDict
 import numpy as np
 import msgpack
 import time
@@ -50,6 +51,7 @@ class RecordDictionaryTool(object):
 
     _rd                 = None
     _pdict              = None
+    _parsed             = None
     _shp                = None
     _locator            = None
     _stream_def         = None
@@ -66,10 +68,13 @@ class RecordDictionaryTool(object):
         """
         """
         if type(param_dictionary) == dict:
-            self._pdict = ParameterDictionary.load(param_dictionary)
+            self._parsed = ParameterDictionaryCache.get(param_dictionary)
         
         elif isinstance(param_dictionary,ParameterDictionary):
-            self._pdict = param_dictionary
+            self._parsed = ParsedParameterDictionary(param_dictionary)
+
+        elif isinstance(param_dictionary,ParsedParameterDictionary):
+            self._parsed = param_dictionary
         
         elif stream_definition_id or stream_definition:
             if stream_definition:
@@ -81,11 +86,12 @@ class RecordDictionaryTool(object):
             pdict = stream_def_obj.parameter_dictionary
             self._available_fields = stream_def_obj.available_fields or None
             self._stream_config = stream_def_obj.stream_configuration
-            self._pdict = ParameterDictionary.load(pdict)
+            self._parsed = ParameterDictionaryCache.get(pdict, stream_definition_id or getattr(stream_def_obj, '_id', ''))
             self._stream_def = stream_definition_id
 
         else:
             raise BadRequest('Unable to create record dictionary with improper ParameterDictionary')
+        self._pdict = self._parsed.pdict
         
         if stream_definition_id:
             self._stream_def=stream_definition_id
@@ -126,6 +132,30 @@ class RecordDictionaryTool(object):
     
     @classmethod
     def spanify(cls,arr):
+        '''
+        Run-length encodes the values into a list of Spans, a new span starts
+        wherever a value (or any element of an array value) differs from the
+        previous one.
+        '''
+        arr = np.asanyarray(arr)
+        if arr.dtype.char == 'O':
+            # Elements may be arbitrary objects, compare them one at a time
+            return cls._spanify_iterative(arr)
+        if not arr.shape[0]:
+            return []
+        changed = arr[1:] != arr[:-1]
+        if changed.ndim > 1:
+            changed = changed.any(axis=tuple(range(1, changed.ndim)))
+        starts = np.flatnonzero(changed) + 1
+
+        spans = [Span(None, None, 0, arr[0])]
+        for i in starts.tolist():
+            spans[-1].upper_bound = i
+            spans.append(Span(i, None, -i, arr[i]))
+        return spans
+
+    @classmethod
+    def _spanify_iterative(cls,arr):
         spans = []
         lastval = None
         for i,val in enumerate(arr):
@@ -189,9 +219,9 @@ class RecordDictionaryTool(object):
             instance._creation_timestamp = g.creation_timestamp
 
         for k,v in g.record_dictionary.iteritems():
-            key = instance._pdict.key_from_ord(k)
+            key = instance._parsed.key_from_ord(k)
             if v is not None:
-                ptype = instance._pdict.get_context(key).param_type
+                ptype = instance._parsed.param_types[key]
                 paramval = cls.get_paramval(ptype, instance.domain, v)
                 instance._rd[key] = paramval
         
@@ -200,15 +230,75 @@ class RecordDictionaryTool(object):
 
         return instance
 
+    @classmethod
+    def concatenate(cls, rdts):
+        '''
+        Appends a list of record dictionaries that share the same parameter dictionary into a single
+        record dictionary. Fields missing from some of the records are padded with fill values,
+        constant fields take the value of the last record dictionary.
+        '''
+        if not rdts:
+            raise BadRequest('No record dictionaries to concatenate')
+        if len(rdts) == 1:
+            return rdts[0]
+
+        head = rdts[0]
+        instance = cls(param_dictionary=head._pdict, locator=head._locator)
+        instance._parsed             = head._parsed
+        instance._stream_def         = head._stream_def
+        instance._definition         = head._definition
+        instance._available_fields   = head._available_fields
+        instance._stream_config      = head._stream_config
+        instance._creation_timestamp = head._creation_timestamp
+        instance.connection_id       = head.connection_id
+        instance.connection_index    = head.connection_index
+        instance._shp = (sum(len(rdt) for rdt in rdts),)
+
+        keys = set()
+        for rdt in rdts:
+            keys.update(rdt.iterkeys())
+
+        for key in keys:
+            ptype = instance._parsed.param_types[key]
+            if isinstance(ptype, (ConstantType, ConstantRangeType)):
+                for rdt in reversed(rdts):
+                    if rdt._rd[key] is not None:
+                        instance._rd[key] = rdt._rd[key]
+                        instance._rd[key].domain_set = instance.domain
+                        break
+                continue
+
+            values = []
+            for rdt in rdts:
+                if rdt._rd[key] is not None:
+                    values.append(np.atleast_1d(rdt[key]))
+                elif isinstance(ptype, ParameterFunctionType):
+                    # Can't pad a parameter function, let the coverage evaluate it
+                    values = None
+                    break
+                else:
+                    values.append(None)
+            if values is None:
+                continue
+
+            template = next(v for v in values if v is not None)
+            for i, rdt in enumerate(rdts):
+                if values[i] is None:
+                    values[i] = np.empty((len(rdt),) + template.shape[1:], dtype=template.dtype)
+                    values[i].fill(instance.fill_value(key))
+            instance._rd[key] = cls.get_paramval(ptype, instance.domain, np.concatenate(values))
+
+        return instance
+
     def to_granule(self, data_producer_id='',provider_metadata_update={}, connection_id='', connection_index=''):
         granule = Granule()
         granule.record_dictionary = {}
         
         for key,val in self._rd.iteritems():
             if val is not None:
-                granule.record_dictionary[self._pdict.ord_from_key(key)] = self[key]
+                granule.record_dictionary[self._parsed.ord_from_key(key)] = self[key]
             else:
-                granule.record_dictionary[self._pdict.ord_from_key(key)] = None
+                granule.record_dictionary[self._parsed.ord_from_key(key)] = None
         
         granule.param_dictionary = {} if self._stream_def else self._pdict.dump()
         if self._definition:
@@ -227,14 +317,19 @@ class RecordDictionaryTool(object):
 
 
     def _setup_params(self):
-        for param in self._pdict.keys():
+        for param in self._parsed.fields:
             self._rd[param] = None
 
     @property
     def fields(self):
         if self._available_fields is not None:
-            return list(set(self._available_fields).intersection(self._pdict.keys()))
-        return self._pdict.keys()
+            return list(self._parsed.field_set.intersection(self._available_fields))
+        return list(self._parsed.fields)
+
+    def _has_field(self, name):
+        if self._available_fields is not None:
+            return name in self._parsed.field_set and name in self._available_fields
+        return name in self._parsed.field_set
 
     @property
     def domain(self):
@@ -243,15 +338,15 @@ class RecordDictionaryTool(object):
 
     @property
     def temporal_parameter(self):
-        return self._pdict.temporal_parameter_name
+        return self._parsed.temporal_parameter
 
     def fill_value(self,name):
-        return self._pdict.get_context(name).fill_value
+        return self._parsed.contexts[name].fill_value
 
     def _replace_hook(self, name,vals):
         if vals is None:
             return None
-        if not isinstance(self._pdict.get_context(name).param_type, QuantityType):
+        if not isinstance(self._parsed.param_types[name], QuantityType):
             return vals
         if isinstance(vals, (list,tuple)):
             vals = [i if i is not None else self.fill_value(name) for i in vals]
@@ -265,7 +360,7 @@ class RecordDictionaryTool(object):
                     return None
             except AttributeError:
                 pass
-            return np.asanyarray(vals, dtype=self._pdict.get_context(name).param_type.value_encoding)
+            return np.asanyarray(vals, dtype=self._parsed.param_types[name].value_encoding)
         return np.atleast_1d(vals)
 
     def __setitem__(self, name, vals):
@@ -275,13 +370,13 @@ class RecordDictionaryTool(object):
         """
         Set a parameter
         """
-        if name not in self.fields:
+        if not self._has_field(name):
             raise KeyError(name)
 
         if vals is None:
             self._rd[name] = None
             return
-        context = self._pdict.get_context(name)
+        context = self._parsed.contexts[name]
 
         if self._shp is None and isinstance(context.param_type, (SparseConstantType, ConstantType, ConstantRangeType)):
             self._shp = (1,)
@@ -313,13 +408,13 @@ class RecordDictionaryTool(object):
         self._rd[name] = paramval
 
     def param_type(self, name):
-        if name in self.fields:
-            return self._pdict.get_context(name).param_type
+        if self._has_field(name):
+            return self._parsed.param_types[name]
         raise KeyError(name)
 
     def context(self, name):
-        if name in self.fields:
-            return self._pdict.get_context(name)
+        if self._has_field(name):
+            return self._parsed.contexts[name]
         raise KeyError(name)
 
     def _reshape_const(self):
@@ -335,7 +430,7 @@ class RecordDictionaryTool(object):
             return None
         if self._available_fields and name not in self._available_fields:
             raise KeyError(name)
-        ptype = self._pdict.get_context(name).param_type
+        ptype = self._parsed.param_types[name]
         if isinstance(ptype, ParameterFunctionType):
             if self._rd[name] is not None and getattr(self._rd[name],'memoized_values',None) is not None:
                 return self._rd[name].memoized_values[:]
@@ -438,11 +533,34 @@ class RecordDictionaryTool(object):
         return len(byte_stream)
 
     
+    _stream_defs = OrderedDict()
+
     @staticmethod
-    @memoize_lru(maxsize=100)
     def read_stream_def(stream_def_id):
-        pubsub_cli = PubsubManagementServiceClient()
-        stream_def_obj = pubsub_cli.read_stream_definition(stream_def_id)
+        '''
+        Memoization (LRU) of read_stream_definition
+        '''
+        cache = RecordDictionaryTool._stream_defs
+        try:
+            stream_def_obj = cache.pop(stream_def_id)
+        except KeyError:
+            pubsub_cli = PubsubManagementServiceClient()
+            stream_def_obj = pubsub_cli.read_stream_definition(stream_def_id)
+            if len(cache) >= 100:
+                cache.popitem(last=False)
+        cache[stream_def_id] = stream_def_obj
         return stream_def_obj
 
+    @staticmethod
+    def invalidate_stream_def(stream_def_id=None):
+        '''
+        Drops the cached stream definition and its loaded parameter dictionary
+        so the next record dictionary built for it rereads the definition.
+        '''
+        if stream_def_id is None:
+            RecordDictionaryTool._stream_defs.clear()
+        else:
+            RecordDictionaryTool._stream_defs.pop(stream_def_id, None)
+        ParameterDictionaryCache.invalidate(stream_def_id)
+
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/subscription_index.py
+@description Compiled index of the users' notification subscriptions used to match events to users
+'''
+
+from interface.objects import NotificationRequest
+
+
+class SubscriptionIndex(object):
+    '''
+    Maps the values of each subscription field (event type, origin, sub type
+    and origin type) to the set of users subscribed to them.  User sets are
+    bitsets held in python integers, one bit per user, so matching an event is
+    a lookup per field and an intersection of the bitsets.
+
+    An empty value in a notification request is a wildcard, the user's bit is
+    kept under the '' key of the field and is part of every match on it.
+
+    The index is maintained incrementally: update() compares each user's
+    subscriptions against the ones previously indexed and only flips the bits
+    that changed.
+    '''
+    # (index field, NotificationRequest attribute, Event attribute)
+    FIELDS = (('event_type',        'event_type',    'type_'),
+              ('event_origin',      'origin',        'origin'),
+              ('event_subtype',     'event_subtype', 'sub_type'),
+              ('event_origin_type', 'origin_type',   'origin_type'))
+
+    def __init__(self):
+        self._bitsets        = dict((field, {}) for field, _, _ in self.FIELDS)
+        self._subscriptions  = {} # user_id -> frozenset of (field, value)
+        self._bits           = {} # user_id -> bit
+        self._users          = {} # bit -> user_id
+        self._free           = []
+
+    @classmethod
+    def subscriptions(cls, value):
+        '''
+        The (field, value) pairs a user_info entry subscribes to
+        '''
+        if value.get('notifications_disabled', False) or value.get('notifications_daily_digest', False):
+            # Only users with real time delivery are notified by the workers
+            return frozenset()
+        keys = set()
+        for notification in value.get('notifications') or []:
+            if not isinstance(notification, NotificationRequest):
+                continue
+            if notification.temporal_bounds.end_datetime:
+                continue # expired
+            for field, attr, _ in cls.FIELDS:
+                keys.add((field, getattr(notification, attr) or ''))
+        return frozenset(keys)
+
+    def update(self, user_info):
+        '''
+        Brings the index in line with a user_info dictionary, returns the ids of the users whose subscriptions changed
+        '''
+        changed = []
+        for user_id in [u for u in self._subscriptions if u not in user_info]:
+            self._set_user(user_id, frozenset())
+            changed.append(user_id)
+        for user_id, value in user_info.iteritems():
+            if self._set_user(user_id, self.subscriptions(value)):
+                changed.append(user_id)
+        return changed
+
+    def match(self, event):
+        '''
+        Returns the ids of the users interested in an event
+        '''
+        if not self._subscriptions:
+            return []
+        users = None
+        for field, _, event_attr in self.FIELDS:
+            value = getattr(event, event_attr, None)
+            if not value:
+                continue
+            bitsets = self._bitsets[field]
+            if field == 'event_subtype' and value not in bitsets:
+                continue # Sub types nobody subscribed to explicitly don't narrow the match
+            bits = bitsets.get(value, 0) | bitsets.get('', 0)
+            users = bits if users is None else users & bits
+            if not users:
+                return []
+        if not users:
+            return []
+        return self._decode(users)
+
+    def reverse_user_info(self):
+        '''
+        The index in the reverse_user_info form of calculate_reverse_user_info, wildcards are left out
+        '''
+        if not self._subscriptions:
+            return {}
+        return dict((field, dict((value, self._decode(bits)) for value, bits in bitsets.iteritems() if value != ''))
+                    for field, bitsets in self._bitsets.iteritems())
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    #--------------------------------------------------------------------------------
+    # Internals
+    #--------------------------------------------------------------------------------
+
+    def _set_user(self, user_id, keys):
+        old = self._subscriptions.get(user_id, frozenset())
+        if old == keys:
+            return False
+        if user_id in self._bits:
+            bit = self._bits[user_id]
+        else:
+            bit = self._free.pop() if self._free else len(self._bits)
+            self._bits[user_id] = bit
+            self._users[bit] = user_id
+        mask = 1 << bit
+        for field, value in old - keys:
+            bitsets = self._bitsets[field]
+            bitsets[value] &= ~mask
+            if not bitsets[value]:
+                del bitsets[value]
+        for field, value in keys - old:
+            bitsets = self._bitsets[field]
+            bitsets[value] = bitsets.get(value, 0) | mask
+        if keys:
+            self._subscriptions[user_id] = keys
+        else:
+            self._subscriptions.pop(user_id, None)
+            del self._bits[user_id]
+            del self._users[bit]
+            self._free.append(bit)
+        return True
+
+    def _decode(self, bits):
+        users = []
+        while bits:
+            low = bits & -bits
+            users.append(self._users[low.bit_length() - 1])
+            bits ^= low
+        return users
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_association_graph.py
+@brief Tests for the in-memory association graph
+'''
+
+from pyon.public import PRED
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from ion.services.dm.utility.association_graph import AssociationGraph
+from nose.plugins.attrib import attr
+from mock import Mock
+
+
+@attr('UNIT',group='dm')
+class AssociationGraphTest(PyonTestCase):
+    def setUp(self):
+        self.assocs = []
+        self.rr = Mock()
+        self.rr.find_associations.side_effect = self.find_associations
+        self.graph = AssociationGraph(self.rr, max_age=0, compact_threshold=4)
+
+    def associate(self, s, p, o):
+        self.assocs.append(DotDict(s=s, p=p, o=o))
+
+    def find_associations(self, subject=None, predicate=None, object=None, id_only=False):
+        return [a for a in self.assocs if (subject is None or a.s == subject) and (predicate is None or a.p == predicate) and (object is None or a.o == object)]
+
+    def chain(self):
+        self.associate('dp', PRED.hasTransform, 'transform')
+        self.associate('transform', PRED.hasProcessDefinition, 'pd')
+        self.associate('pd', PRED.hasStream, 'stream')
+        self.associate('dp', PRED.hasStream, 'stream')
+
+    def test_traverse(self):
+        self.chain()
+        self.assertEquals(self.graph.traverse('dp'), ['transform', 'stream', 'pd'])
+        self.assertEquals(self.graph.traverse('dp', depth=1), ['transform', 'stream'])
+        self.assertEquals(self.graph.traverse('dp', predicates=[PRED.hasTransform, PRED.hasProcessDefinition]), ['transform', 'pd'])
+        self.assertEquals(self.graph.traverse('stream', reverse=True), ['pd', 'dp', 'transform'])
+        self.assertEquals(self.graph.traverse('stream', reverse=True, depth=1), ['pd', 'dp'])
+        self.assertEquals(self.graph.traverse('unknown'), [])
+        # The registry is only read once
+        self.assertEquals(self.rr.find_associations.call_count, len(AssociationGraph.predicates()))
+
+    def test_cycles(self):
+        self.associate('a', PRED.hasTransform, 'b')
+        self.associate('b', PRED.hasTransform, 'a')
+        self.assertEquals(self.graph.traverse('a'), ['b', 'a'])
+
+    def test_invalidate(self):
+        self.chain()
+        self.graph.traverse('dp')
+
+        self.assocs = [a for a in self.assocs if a.s != 'pd']
+        self.associate('pd', PRED.hasDataset, 'dataset')
+        self.graph.invalidate('pd')
+        self.assertEquals(self.graph.traverse('dp'), ['transform', 'stream', 'pd', 'dataset'])
+        self.assertEquals(self.graph.traverse('stream', reverse=True), ['dp'])
+        self.assertEquals(self.graph.traverse('dataset', reverse=True), ['pd', 'transform', 'dp'])
+
+        # Enough refreshes get compacted back into the CSR arrays
+        for i in xrange(3):
+            self.associate('new_%s' % i, PRED.hasStream, 'stream')
+            self.graph.invalidate('new_%s' % i)
+        self.assertEquals(sorted(self.graph.traverse('stream', reverse=True)), ['dp', 'new_0', 'new_1', 'new_2'])
+        self.assertFalse(self.graph._out_rows)
+        self.assertEquals(self.graph.traverse('dp'), ['transform', 'stream', 'pd', 'dataset'])
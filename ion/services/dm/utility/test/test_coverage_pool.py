@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_coverage_pool.py
+@brief Tests for the container coverage pool
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.coverage_pool import CoveragePool
+from nose.plugins.attrib import attr
+from mock import Mock
+
+
+@attr('UNIT',group='dm')
+class CoveragePoolTest(PyonTestCase):
+    def setUp(self):
+        self.pool = CoveragePool(max_handles=2, max_memory=1000, parameter_overhead=100)
+        self.opened = []
+
+    def loader(self, dataset_id, mode='r'):
+        coverage = Mock()
+        coverage.list_parameters.return_value = ['time', 'temp']
+        self.opened.append(coverage)
+        return coverage
+
+    def test_lru_eviction(self):
+        for dataset_id in ('a', 'b'):
+            self.pool.release(dataset_id, 'r', self.pool.acquire(dataset_id, 'r', self.loader))
+
+        # Touch 'a' so 'b' is the least recently used
+        cov_a = self.pool.acquire('a', 'r', self.loader)
+        self.pool.release('a', 'r', cov_a)
+        self.pool.release('c', 'r', self.pool.acquire('c', 'r', self.loader))
+
+        self.assertTrue(self.pool.contains('a', 'r'))
+        self.assertFalse(self.pool.contains('b', 'r'))
+        self.assertTrue(self.opened[1].close.called)
+        self.assertEquals(self.pool.stats()['hits'], 1)
+        self.assertEquals(self.pool.stats()['misses'], 3)
+        self.assertEquals(self.pool.stats()['evictions'], 1)
+        self.assertEquals(self.pool.memory, 400)
+
+    def test_in_use_never_closed(self):
+        cov_a = self.pool.acquire('a', 'r', self.loader)
+        cov_b = self.pool.acquire('b', 'r', self.loader)
+        cov_c = self.pool.acquire('c', 'r', self.loader)
+        self.assertEquals(self.pool.stats()['open'], 3)
+        self.assertFalse(any(c.close.called for c in self.opened))
+
+        self.pool.release('a', 'r', cov_a)
+        self.assertTrue(cov_a.close.called)
+        self.pool.release('b', 'r', cov_b)
+        self.pool.release('c', 'r', cov_c)
+        self.assertEquals(self.pool.stats()['open'], 2)
+
+    def test_invalidate(self):
+        cov = self.pool.acquire('a', 'r', self.loader)
+        self.pool.invalidate('a')
+        self.assertFalse(cov.close.called)
+
+        # Readers after the invalidation get a fresh coverage
+        fresh = self.pool.acquire('a', 'r', self.loader)
+        self.assertIsNot(fresh, cov)
+
+        self.pool.release('a', 'r', cov)
+        self.assertTrue(cov.close.called)
+        self.pool.release('a', 'r', fresh)
+        self.assertFalse(fresh.close.called)
+
+        self.pool.invalidate('a')
+        self.assertTrue(fresh.close.called)
+        self.assertEquals(self.pool.memory, 0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_email_delivery.py
+@brief Tests for the pooled notification email delivery
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict, get_ion_ts
+from pyon.core.exception import NotFound
+from ion.services.dm.utility.email_delivery import EmailDelivery, SMTPConnectionPool
+from ion.services.dm.utility.uns_utility_methods import fake_smtplib
+from nose.plugins.attrib import attr
+from mock import Mock
+from email.mime.text import MIMEText
+import gevent
+
+
+@attr('UNIT',group='dm')
+class EmailDeliveryTest(PyonTestCase):
+    def setUp(self):
+        self.rr_client = Mock()
+        self.rr_client.read.side_effect = NotFound
+        self.delivery = EmailDelivery(self.rr_client, pool=SMTPConnectionPool(size=2), coalesce_window=0.1, max_events=3)
+        self.delivery.start()
+        self.addCleanup(self.delivery.stop)
+
+    def event(self, origin):
+        return DotDict(type_='DeviceEvent', base_types=[], origin=origin, origin_type='InstrumentDevice',
+                       ts_created=get_ion_ts(), description='', sub_type='')
+
+    def sent(self, delivery=None):
+        delivery = delivery or self.delivery
+        emails = []
+        while not delivery.sent_mail.empty():
+            emails.append(delivery.sent_mail.get())
+        return emails
+
+    def test_coalescing(self):
+        for i in xrange(2):
+            self.delivery.notify(self.event('instrument_%s' % i), 'user_1@example.com')
+        self.delivery.notify(self.event('instrument_1'), 'user_2@example.com')
+        self.assertTrue(self.delivery.flush(timeout=5))
+
+        emails = dict((recipient, msg) for sender, recipient, msg in self.sent())
+        self.assertEquals(set(emails), set(['user_1@example.com', 'user_2@example.com']))
+        self.assertIn('summary of 2 ION events', emails['user_1@example.com'])
+        self.assertIn('instrument_1', emails['user_2@example.com'])
+        self.assertEquals(self.delivery.stats()['coalesced'], 1)
+        self.assertEquals(self.delivery.stats()['sent'], 2)
+
+    def test_max_events(self):
+        # A full email goes out without waiting for the window to close
+        self.delivery.coalesce_window = 60
+        for i in xrange(3):
+            self.delivery.notify(self.event('instrument_%s' % i), 'user_1@example.com')
+        email = self.delivery.sent_mail.get(timeout=5)
+        self.assertIn('summary of 3 ION events', email[2])
+
+    def test_max_events_batches(self):
+        # Events after a full email start a new one instead of piling up
+        self.delivery.coalesce_window = 60
+        for i in xrange(7):
+            self.delivery.notify(self.event('instrument_%s' % i), 'user_1@example.com')
+        self.assertTrue(self.delivery.flush(timeout=5))
+        subjects = sorted(msg.split('Subject: ')[1].split('\n')[0] for sender, recipient, msg in self.sent())
+        self.assertEquals(subjects[1:], ['summary of 3 ION events', 'summary of 3 ION events'])
+        self.assertIn('ION event DeviceEvent', subjects[0])
+        self.assertEquals(self.delivery.stats()['held'], 0)
+
+    def test_max_held(self):
+        delivery = EmailDelivery(self.rr_client, pool=SMTPConnectionPool(size=1), coalesce_window=60, max_held=2)
+        delivery.notify(self.event('instrument_1'), 'user_1@example.com')
+        delivery.notify(self.event('instrument_2'), 'user_2@example.com')
+        # Not dispatched yet, the next notify waits for room
+        blocked = gevent.spawn(delivery.notify, self.event('instrument_3'), 'user_3@example.com')
+        gevent.sleep(0.05)
+        self.assertFalse(blocked.ready())
+
+        delivery.start()
+        self.addCleanup(delivery.stop)
+        self.assertTrue(delivery.flush(timeout=5))
+        blocked.join(timeout=5)
+        self.assertTrue(blocked.successful())
+        self.assertTrue(delivery.flush(timeout=5))
+        self.assertEquals(delivery.stats()['sent'], 3)
+
+    def test_single_events(self):
+        # Without a coalesce window every event is sent on its own, in the single event format
+        delivery = EmailDelivery(self.rr_client, pool=SMTPConnectionPool(size=1))
+        delivery.start()
+        self.addCleanup(delivery.stop)
+        self.assertEquals(delivery.coalesce_window, 0)
+        for i in xrange(2):
+            delivery.notify(self.event('instrument_%s' % i), 'user_1@example.com')
+        self.assertTrue(delivery.flush(timeout=5))
+        emails = [msg for sender, recipient, msg in self.sent(delivery)]
+        self.assertEquals(len(emails), 2)
+        self.assertTrue(all('Subject: ION event DeviceEvent' in msg for msg in emails))
+
+    def test_pooled_connections(self):
+        for i in xrange(20):
+            msg = MIMEText('digest %s' % i)
+            self.delivery.send(msg, 'user_%s@example.com' % i, sender='sender@example.com')
+        self.assertTrue(self.delivery.flush(timeout=5))
+
+        self.assertEquals(len(self.sent()), 20)
+        self.assertTrue(self.delivery.pool.opened <= 2)
+
+    def test_reconnect(self):
+        broken = fake_smtplib('localhost', self.delivery.sent_mail)
+        broken.sendmail = Mock(side_effect=IOError('Connection lost'))
+        self.delivery.pool._idle.append((broken, 1e20))
+
+        self.delivery.send(MIMEText('digest'), 'user_1@example.com')
+        self.assertTrue(self.delivery.flush(timeout=5))
+        self.assertEquals(len(self.sent()), 1)
+        self.assertEquals(self.delivery.stats()['reconnects'], 1)
+        self.assertEquals(self.delivery.stats()['failed'], 0)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_pdict_cache.py
+@brief Tests for the loaded parameter dictionary cache
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.granule.pdict_cache import ParameterDictionaryCache
+from nose.plugins.attrib import attr
+from mock import patch, Mock
+
+
+@attr('UNIT',group='dm')
+class ParameterDictionaryCacheTest(PyonTestCase):
+    def setUp(self):
+        ParameterDictionaryCache.invalidate()
+        self.addCleanup(ParameterDictionaryCache.invalidate)
+        patcher = patch('ion.services.dm.utility.granule.pdict_cache.ParameterDictionary')
+        self.ParameterDictionary = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ParameterDictionary.load.side_effect = lambda dump: self.mock_pdict(dump)
+
+    def mock_pdict(self, dump):
+        pdict = Mock()
+        pdict.keys.return_value = dump.keys()
+        pdict.ord_from_key.side_effect = lambda k: dump[k]
+        pdict.temporal_parameter_name = 'time'
+        return pdict
+
+    def test_cache_hits(self):
+        dump = {'time':1, 'temp':2}
+        entry = ParameterDictionaryCache.get(dump, 'stream_def_id')
+        self.assertIs(ParameterDictionaryCache.get(dump, 'stream_def_id'), entry)
+        self.assertIs(ParameterDictionaryCache.get(dict(dump), 'stream_def_id'), entry)
+        self.assertEquals(self.ParameterDictionary.load.call_count, 1)
+
+        self.assertEquals(entry.key_from_ord(2), 'temp')
+        self.assertEquals(entry.ord_from_key('time'), 1)
+        self.assertEquals(entry.field_set, frozenset(['time', 'temp']))
+
+    def test_cache_invalidation(self):
+        dump = {'time':1, 'temp':2}
+        entry = ParameterDictionaryCache.get(dump, 'stream_def_id')
+
+        # A changed parameter dictionary for the same stream definition is a new entry
+        changed = ParameterDictionaryCache.get({'time':1, 'temp':2, 'cond':3}, 'stream_def_id')
+        self.assertIsNot(changed, entry)
+
+        ParameterDictionaryCache.invalidate('stream_def_id')
+        self.assertIsNot(ParameterDictionaryCache.get(dump, 'stream_def_id'), entry)
+        self.assertEquals(self.ParameterDictionary.load.call_count, 3)
+
+    def test_cache_limit(self):
+        with patch.object(ParameterDictionaryCache, 'limit', return_value=2):
+            for i in xrange(5):
+                ParameterDictionaryCache.get({'time':i}, 'stream_def_%s' % i)
+        self.assertEquals(len(ParameterDictionaryCache._entries), 2)
+        self.assertEquals(len(ParameterDictionaryCache._digests), 2)
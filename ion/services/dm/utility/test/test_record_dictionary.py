@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_record_dictionary.py
+@brief Unit tests and benchmarks for the record dictionary
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.services.dm.utility.granule import RecordDictionaryTool
+from nose.plugins.attrib import attr
+
+import numpy as np
+import time
+
+
+def span_tuples(spans):
+    return [(s.lower_bound, s.upper_bound, s.offset, np.asanyarray(s.value).tolist()) for s in spans]
+
+
+@attr('UNIT',group='dm')
+class RecordDictionaryUnitTest(PyonTestCase):
+    def assert_spans_match(self, arr):
+        self.assertEquals(span_tuples(RecordDictionaryTool.spanify(arr)),
+                          span_tuples(RecordDictionaryTool._spanify_iterative(arr)))
+
+    def test_spanify(self):
+        spans = RecordDictionaryTool.spanify(np.array([1., 1., 2., 2., 2., 1.]))
+        self.assertEquals(span_tuples(spans), [(None, 2, 0, 1.), (2, 5, -2, 2.), (5, None, -5, 1.)])
+
+        self.assert_spans_match(np.array([], dtype='float32'))
+        self.assert_spans_match(np.array([3]))
+        self.assert_spans_match(np.random.randint(0, 3, 500))
+        self.assert_spans_match(np.array(['a', 'a', 'b', 'b', 'a']))
+        self.assert_spans_match(np.array([0., np.nan, np.nan, 1.]))
+
+    def test_spanify_arrays(self):
+        arr = np.array([[1, 2], [1, 2], [1, 3], [1, 3], [1, 2]])
+        spans = RecordDictionaryTool.spanify(arr)
+        self.assertEquals(span_tuples(spans), [(None, 2, 0, [1, 2]), (2, 4, -2, [1, 3]), (4, None, -4, [1, 2])])
+        self.assert_spans_match(np.random.randint(0, 2, (200, 3, 2)))
+
+
+@attr('BENCHMARK',group='dm')
+class RecordDictionaryBenchmark(PyonTestCase):
+    def time_spanify(self, arr):
+        t0 = time.time()
+        vectorized = RecordDictionaryTool.spanify(arr)
+        t1 = time.time()
+        iterative = RecordDictionaryTool._spanify_iterative(arr)
+        t2 = time.time()
+        self.assertEquals(len(vectorized), len(iterative))
+        return t1 - t0, t2 - t1
+
+    def test_spanify_benchmark(self):
+        inputs = {
+            'constant'   : np.zeros(10**6),
+            'runs of 100': np.repeat(np.arange(10**4), 100).astype('float64'),
+            'changing'   : np.arange(10**6, dtype='float64'),
+            'array'      : np.repeat(np.arange(10**4), 100)[:,None] * np.ones((1,4)),
+        }
+        for name, arr in inputs.iteritems():
+            vectorized, iterative = self.time_spanify(arr)
+            log.info('spanify %s (10^6 elements): vectorized %.3fs iterative %.3fs (%.0fx)', name, vectorized, iterative, iterative / max(vectorized, 1e-6))
+            self.assertTrue(vectorized < iterative)
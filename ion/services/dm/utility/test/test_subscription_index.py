@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_subscription_index.py
+@brief Tests for the compiled notification subscription index
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from pyon.util.log import log
+from interface.objects import NotificationRequest, TemporalBounds
+from ion.services.dm.utility.subscription_index import SubscriptionIndex
+from nose.plugins.attrib import attr
+
+import random
+import time
+
+
+def notification(event_type='', origin='', origin_type='', event_subtype='', end_datetime=''):
+    return NotificationRequest(event_type=event_type, origin=origin, origin_type=origin_type, event_subtype=event_subtype,
+                               temporal_bounds=TemporalBounds(end_datetime=end_datetime))
+
+def event(type_='', origin='', origin_type='', sub_type=''):
+    return DotDict(type_=type_, origin=origin, origin_type=origin_type, sub_type=sub_type)
+
+
+@attr('UNIT',group='dm')
+class SubscriptionIndexTest(PyonTestCase):
+    def setUp(self):
+        self.index = SubscriptionIndex()
+        self.user_info = {
+            'user_1' : {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_1', 'InstrumentDevice')]},
+            'user_2' : {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_2', 'InstrumentDevice', 'subtype_1')]},
+            'user_3' : {'notifications' : [notification('DeviceEvent')]},
+            'user_4' : {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_1')], 'notifications_daily_digest' : True},
+            'user_5' : {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_1', end_datetime='1')]},
+        }
+        self.index.update(self.user_info)
+
+    def test_match(self):
+        self.assertEquals(self.index.match(event('ResourceLifecycleEvent', 'instrument_1', 'InstrumentDevice')), ['user_1'])
+        self.assertEquals(self.index.match(event('ResourceLifecycleEvent', 'instrument_2', 'InstrumentDevice', 'subtype_1')), ['user_2'])
+        # Wildcards match any origin, origin type and sub type
+        self.assertEquals(self.index.match(event('DeviceEvent', 'instrument_1', 'InstrumentDevice', 'subtype_1')), ['user_3'])
+        self.assertEquals(self.index.match(event('DeviceEvent')), ['user_3'])
+        self.assertEquals(self.index.match(event('ResourceLifecycleEvent', 'instrument_3', 'InstrumentDevice')), [])
+        self.assertEquals(self.index.match(event('DetectionEvent', 'instrument_1')), [])
+
+        # Matching doesn't change the index
+        self.index.match(event('DeviceEvent', 'instrument_1', 'InstrumentDevice'))
+        self.assertEquals(sorted(self.index.reverse_user_info()['event_type']['ResourceLifecycleEvent']), ['user_1', 'user_2'])
+
+    def test_incremental_update(self):
+        self.user_info['user_1'] = {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_2', 'InstrumentDevice')]}
+        del self.user_info['user_3']
+        self.user_info['user_6'] = {'notifications' : [notification('DeviceEvent', 'instrument_2')]}
+        self.assertEquals(sorted(self.index.update(self.user_info)), ['user_1', 'user_3', 'user_6'])
+        self.assertEquals(self.index.update(self.user_info), [])
+
+        self.assertEquals(self.index.match(event('ResourceLifecycleEvent', 'instrument_1', 'InstrumentDevice')), [])
+        self.assertEquals(sorted(self.index.match(event('ResourceLifecycleEvent', 'instrument_2', 'InstrumentDevice'))), ['user_1', 'user_2'])
+        self.assertEquals(self.index.match(event('DeviceEvent', 'instrument_2')), ['user_6'])
+
+        reverse_user_info = self.index.reverse_user_info()
+        self.assertNotIn('instrument_1', reverse_user_info['event_origin'])
+        self.assertEquals(reverse_user_info['event_type']['DeviceEvent'], ['user_6'])
+        self.assertEquals(len(self.index), 3)
+
+
+@attr('BENCHMARK',group='dm')
+class SubscriptionIndexBenchmark(PyonTestCase):
+    def test_matching_throughput(self):
+        random.seed(0)
+        event_types = ['ResourceLifecycleEvent', 'DeviceEvent', 'DeviceStatusEvent', 'ResourceAgentStateEvent', 'ParameterQCEvent']
+        origins = ['instrument_%s' % i for i in xrange(5000)]
+        origin_types = ['InstrumentDevice', 'PlatformDevice', 'DataProduct', '']
+
+        # 10,000 users with 5 subscriptions each
+        user_info = {}
+        for i in xrange(10000):
+            user_info['user_%s' % i] = {'notifications' : [notification(random.choice(event_types), random.choice(origins), random.choice(origin_types)) for j in xrange(5)]}
+        index = SubscriptionIndex()
+        then = time.time()
+        index.update(user_info)
+        log.info('Indexed 50,000 subscriptions in %.3fs', time.time() - then)
+
+        events = [event(random.choice(event_types), random.choice(origins), random.choice(origin_types[:-1])) for i in xrange(10000)]
+        then = time.time()
+        matched = 0
+        for e in events:
+            matched += len(index.match(e))
+        elapsed = time.time() - then
+        log.info('Matched 10,000 events in %.3fs (%d events/s), %d notifications', elapsed, len(events) / elapsed, matched)
+        self.assertTrue(matched)
+        self.assertLess(elapsed, 1.0)
+
+        # A reload that touches a single user only reindexes that user
+        user_info['user_0'] = {'notifications' : [notification('DeviceEvent')]}
+        then = time.time()
+        self.assertEquals(index.update(user_info), ['user_0'])
+        log.info('Incremental update in %.3fs', time.time() - then)
@@ -19,15 +19,24 @@ from gevent import Greenlet
 
 
 class fake_smtplib(object):
+    '''
+    Local SMTP sink used in place of a server, sent messages are put on sent_mail
+    '''
 
-    def __init__(self,host):
+    def __init__(self,host, sent_mail=None):
         self.host = host
-        self.sent_mail = gevent.queue.Queue()
+        self.sent_mail = sent_mail if sent_mail is not None else gevent.queue.Queue()
 
     @classmethod
-    def SMTP(cls,host):
+    def SMTP(cls,host, sent_mail=None):
         log.info("In fake_smtplib.SMTP method call. class: %s, host: %s", str(cls), str(host))
-        return cls(host)
+        return cls(host, sent_mail)
+
+    def ehlo(self):
+        return (250, self.host)
+
+    def noop(self):
+        return (250, 'OK')
 
     def sendmail(self, msg_sender= None, msg_recipients=None, msg=None):
         log.warning('Sending fake message from: %s, to: "%s"', msg_sender,  msg_recipients)
@@ -41,9 +50,11 @@ class fake_smtplib(object):
         """
         pass
 
-def setting_up_smtp_client():
+def setting_up_smtp_client(sent_mail=None):
     """
     Sets up the smtp client
+
+    @param sent_mail    queue the fake smtp client puts sent messages on
     """
 
     #------------------------------------------------------------------------------------
@@ -70,7 +81,7 @@ def setting_up_smtp_client():
     else:
         log.debug('Using a fake SMTP library to simulate email notifications!')
 
-        smtp_client = fake_smtplib.SMTP(smtp_host)
+        smtp_client = fake_smtplib.SMTP(smtp_host, sent_mail)
 
     return smtp_client
 
@@ -226,10 +237,10 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.type_: # for an incoming event with origin type specified
         if reverse_user_info['event_type'].has_key(event.type_):
-            user_list_1 = reverse_user_info['event_type'][event.type_]
+            user_list_1 = set(reverse_user_info['event_type'][event.type_])
             if reverse_user_info['event_type'].has_key(''): # for users who subscribe to any event types
-                user_list_1.extend(reverse_user_info['event_type'][''])
-            users = set(user_list_1)
+                user_list_1.update(reverse_user_info['event_type'][''])
+            users = user_list_1
 #            log.debug("For event_type = %s, UNS got interested users here  %s", event.type_, users)
         else:
 #            log.debug("After checking event_type = %s, UNS got no interested users here", event.type_)
@@ -239,7 +250,7 @@ def check_user_notification_interest(event, reverse_user_info):
         if reverse_user_info['event_origin'].has_key(event.origin):
             user_list_2 = set(reverse_user_info['event_origin'][event.origin])
             if reverse_user_info['event_origin'].has_key(''): # for users who subscribe to any event origins
-                user_list_2.extend(reverse_user_info['event_origin'][''])
+                user_list_2.update(reverse_user_info['event_origin'][''])
             users = set.intersection(users, user_list_2)
 #            log.debug("For event origin = %s too, UNS got interested users here  %s", event.origin, users)
         else:
@@ -248,9 +259,9 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.sub_type:  # for an incoming event with the sub type specified
         if reverse_user_info['event_subtype'].has_key(event.sub_type):
-            user_list_3 = reverse_user_info['event_subtype'][event.sub_type]
+            user_list_3 = set(reverse_user_info['event_subtype'][event.sub_type])
             if reverse_user_info['event_subtype'].has_key(''): # for users who subscribe to any event subtypes
-                user_list_3.extend(reverse_user_info['event_subtype'][''])
+                user_list_3.update(reverse_user_info['event_subtype'][''])
             users = set.intersection(users, user_list_3)
 #        else:
 #            log.debug("After checking event_subtype = %s, UNS got no interested users here", event.sub_type)
@@ -258,9 +269,9 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.origin_type:  # for an incoming event with origin type specified
         if reverse_user_info['event_origin_type'].has_key(event.origin_type):
-            user_list_4 = reverse_user_info['event_origin_type'][event.origin_type]
+            user_list_4 = set(reverse_user_info['event_origin_type'][event.origin_type])
             if reverse_user_info['event_origin_type'].has_key(''): # for users who subscribe to any event origin types
-                user_list_4.extend(reverse_user_info['event_origin_type'][''])
+                user_list_4.update(reverse_user_info['event_origin_type'][''])
             users = set.intersection(users, user_list_4)
         else:
 #            log.debug("After checking event_origin_type = %s, UNS got no interested users here", event.origin_type)
@@ -326,39 +337,28 @@ def calculate_reverse_user_info(user_info=None):
                 if not isinstance(notification, NotificationRequest):
                     continue
 
-                if dict_1.has_key(notification.event_type) and notification.event_type != '':
-                    dict_1[notification.event_type].append(user_id)
-                    # to remove duplicate user names
-                    dict_1[notification.event_type] = list(set(dict_1[notification.event_type]))
-                elif notification.event_type != '':
-                    dict_1[notification.event_type] = [user_id]
-
-                if dict_2.has_key(notification.event_subtype) and notification.event_subtype != '':
-                    dict_2[notification.event_subtype].append(user_id)
-                    # to remove duplicate user names
-                    dict_2[notification.event_subtype] = list(set(dict_2[notification.event_subtype]))
-                elif notification.event_subtype != '':
-                    dict_2[notification.event_subtype] = [user_id]
-
-                if dict_3.has_key(notification.origin) and notification.origin != '':
-                    dict_3[notification.origin].append(user_id)
-                    # to remove duplicate user names
-                    dict_3[notification.origin] = list(set(dict_3[notification.origin]))
-                elif notification.origin != '':
-                    dict_3[notification.origin] = [user_id]
-
-                if dict_4.has_key(notification.origin_type) and notification.origin_type != '':
-                    dict_4[notification.origin_type].append(user_id)
-                    # to remove duplicate user names
-                    dict_4[notification.origin_type] = list(set(dict_4[notification.origin_type]))
-                elif notification.origin_type != '':
-                    dict_4[notification.origin_type] = [user_id]
+                if notification.event_type != '':
+                    dict_1.setdefault(notification.event_type, set()).add(user_id)
+
+                if notification.event_subtype != '':
+                    dict_2.setdefault(notification.event_subtype, set()).add(user_id)
+
+                if notification.origin != '':
+                    dict_3.setdefault(notification.origin, set()).add(user_id)
+
+                if notification.origin_type != '':
+                    dict_4.setdefault(notification.origin_type, set()).add(user_id)
 
                 reverse_user_info['event_type'] = dict_1
                 reverse_user_info['event_subtype'] = dict_2
                 reverse_user_info['event_origin'] = dict_3
                 reverse_user_info['event_origin_type'] = dict_4
 
+    # The user sets are handed out as lists
+    for users_by_value in reverse_user_info.itervalues():
+        for value, users in users_by_value.iteritems():
+            users_by_value[value] = list(users)
+
     return reverse_user_info
 
 def get_event_computed_attributes(event):
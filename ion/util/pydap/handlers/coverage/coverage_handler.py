@@ -14,10 +14,12 @@ from coverage_model.parameter_functions import ParameterFunctionException
 from pydap.model import DatasetType,BaseType, GridType, SequenceType
 from pydap.handlers.lib import BaseHandler
 from pyon.public import CFG
+from ion.util.time_index import TimeIndex
 import time
 import simplejson as json
 import collections
 import functools
+import itertools
 
 numpy_boolean = '?'
 numpy_integer_types = 'bhilqp'
@@ -50,38 +52,96 @@ def request_profile(enabled=False):
     return profile
 
 
+class CoverageSequenceData(object):
+    '''
+    Rows of the 'data' sequence, read from the coverage chunk_size timesteps
+    at a time while the response is being written so the memory used doesn't
+    depend on the size of the request.  Indexing by a field name gives that
+    field's column, indexing by a tuple of names gives the rows of those
+    fields, any other index materializes the rows.
+    '''
+    def __init__(self, handler, fields, selectors, types, keys=None, column=False):
+        self.handler   = handler
+        self.fields    = fields
+        self.selectors = selectors
+        self.types     = types
+        self.keys      = list(keys or fields)
+        self.column    = column
+
+    @property
+    def dtype(self):
+        if self.column:
+            return np.dtype(self.types[self.keys[0]])
+        return np.dtype([(str(k), self.types[k]) for k in self.keys])
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def chunks(self):
+        return self.handler.iter_chunks(self.keys, self.selectors, self.types)
+
+    def __iter__(self):
+        for columns in self.chunks():
+            if self.column:
+                for value in columns[self.keys[0]].tolist():
+                    yield value
+            else:
+                for row in itertools.izip(*[columns[k].tolist() for k in self.keys]):
+                    yield row
+
+    def __len__(self):
+        return self.handler.count(self.selectors)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return CoverageSequenceData(self.handler, self.fields, self.selectors, self.types, [key], column=True)
+        if isinstance(key, (tuple, list)):
+            return CoverageSequenceData(self.handler, self.fields, self.selectors, self.types, key)
+        return np.array(list(self), dtype='O')[key]
+
+    def __copy__(self):
+        return CoverageSequenceData(self.handler, self.fields, self.selectors, self.types, self.keys, self.column)
+
+    def __deepcopy__(self, memo):
+        # The rows are read again from the coverage, there's nothing to copy
+        return self.__copy__()
+
+
 class Handler(BaseHandler):
     CACHE_LIMIT = CFG.get_safe('server.pydap.cache_limit', 5)
     CACHE_EXPIRATION = CFG.get_safe('server.pydap.cache_expiration', 5)
-    REQUEST_LIMIT = CFG.get_safe('server.pydap.request_limit', 200) # MB
+    CHUNK_SIZE = CFG.get_safe('server.pydap.chunk_size', 10000) # Timesteps read at a time
+    ENCODER_LIMIT = CFG.get_safe('server.pydap.encoder_limit', 1000)
     _coverages = collections.OrderedDict() # Cache has to be a class var because each handler is initialized per request
+    _encoders = collections.OrderedDict() # (dataset_id, parameter) -> ((dtype char, ndim), encoder)
 
     extensions = re.compile(r'^.*[0-9A-Za-z\-]{32}',re.IGNORECASE)
 
     def __init__(self, filepath):
         self.filepath = filepath
-
-    def calculate_bytes(self, bitmask, parameter_num):
-        timesteps = np.sum(bitmask)
-        # Assume 8 bytes per variable per timestep
-        count = 8 * parameter_num * timesteps
-        return count
-
-    def is_too_large(self, bitmask, parameter_num):
-        requested = self.calculate_bytes(bitmask, parameter_num)
-        return requested > (self.REQUEST_LIMIT * 1024**2)
+        self.num_timesteps = None
+        self.slab = None
+        self._counts = {} # selectors -> rows selected in the slab
+        self._bounded = set() # selectors the slab satisfies on its own
 
     def get_numpy_type(self, data):
         data = self.none_to_str(data)
         result = data.dtype.char
-        if self.is_basestring(data):
+        # One pass over the values, the checks only need their types
+        types = set(type(d) for d in data)
+        if all(issubclass(t, basestring) for t in types):
             result = 'S'
-        elif self.is_float(data):
+        elif all(issubclass(t, float) for t in types):
             result = 'd'
-        elif self.is_int(data):
+        elif all(issubclass(t, int) for t in types):
             result = 'i'
         elif result == 'O':
-            self.json_dump(data)
+            # A value of each type is enough to know the column can be serialized
+            samples = {}
+            for d in data:
+                samples.setdefault(type(d), d)
+            self.json_dump(samples.values())
             result = 'O'
         elif result == '?':
             result = '?'
@@ -132,20 +192,23 @@ class Handler(BaseHandler):
             attrs['long_name'] = pc.display_name
         return attrs
 
-    def get_data(self,cov, name, bitmask):
-        #pc = cov.get_parameter_context(name)
+    def get_data(self,cov, name, bitmask, slice_=None):
+        '''
+        Values of a parameter where bitmask is set, bitmask covers the timesteps in slice_ (all of them by default)
+        '''
+        slice_ = slice_ or slice(None)
         if isinstance(cov._range_dictionary[name].param_type, ArrayType):
             try:
-                vdict = cov.get_value_dictionary([name])
+                vdict = cov.get_value_dictionary([name], domain_slice=slice_)
                 idxs = np.where(bitmask)[0]
                 data = vdict[name][idxs]
             except ParameterFunctionException:
-                data = np.empty(cov.num_timesteps, dtype='object')
+                data = np.empty(np.count_nonzero(bitmask), dtype='object')
         else:
             try:
-                data = cov._range_value[name][:][bitmask]
+                data = cov._range_value[name][slice_][bitmask]
             except ParameterFunctionException:
-                data = np.empty(cov.num_timesteps, dtype='object')
+                data = np.empty(np.count_nonzero(bitmask), dtype='object')
         data = np.asanyarray(data) 
         if not data.shape:
             data.shape = (1,)
@@ -160,134 +223,255 @@ class Handler(BaseHandler):
         return base_type    
 
     def filter_data(self, data):
+        return self.data_encoder(data)(data)
+
+    def data_encoder(self, data):
+        '''
+        Returns the function converting values like data for DAP, it returns the values and their DAP type
+        '''
+        cls = self.__class__ # Encoders are cached across requests, they don't keep the handler
         if len(data.shape) > 1:
-            return self.ndim_stringify(data), 'S'
+            return lambda data: (cls.ndim_stringify(data), 'S')
         if data.dtype.char in numpy_integer_types + numpy_uinteger_types:
-            return data, data.dtype.char
+            return lambda data: (data, data.dtype.char)
         if data.dtype.char in numpy_floats:
-            return data, data.dtype.char
+            return lambda data: (data, data.dtype.char)
         if data.dtype.char in numpy_boolean:
-            return np.asanyarray(data, dtype='int32') ,'i'
+            return lambda data: (np.asanyarray(data, dtype='int32') ,'i')
         if data.dtype.char in numpy_complex:
-            return self.stringify(data), 'S'
+            return lambda data: (cls.stringify(data), 'S')
         if data.dtype.char in numpy_object:
-            return self.stringify_inplace(data), 'S'
+            return lambda data: (cls.stringify_inplace(data), 'S')
         if data.dtype.char in numpy_str:
-            return data, 'S'
-        return np.asanyarray(['Unsupported Type' for i in data]), 'S'
+            return lambda data: (data, 'S')
+        return lambda data: (np.asanyarray(['Unsupported Type'] * len(data)), 'S')
 
+    @classmethod
+    def as_objects(cls, values):
+        retval = np.empty(len(values), dtype='O')
+        retval[:] = values
+        return retval
 
-    def ndim_stringify(self, data):
+    @classmethod
+    def ndim_stringify(cls, data):
         retval = np.empty(data.shape[0], dtype='O')
         try:
             if len(data.shape)>1:
-                for i in xrange(data.shape[0]):
-                    retval[i] = ','.join(map(lambda x : str(x), data[i].tolist()))
-                return retval
+                # A single format over the rows of the bulk tolist, '%s' is str()
+                row = ','.join(['%s'] * data.shape[1])
+                return cls.as_objects([row % tuple(r) for r in data.tolist()])
         except:
-            retval = np.asanyarray(['None' for d in data])
+            retval = np.asanyarray(['None'] * data.shape[0])
         return retval
 
-
-    def stringify(self, data):
-        retval = np.empty(data.shape, dtype='O')
+    @classmethod
+    def stringify(cls, data):
         try:
-            for i,obj in enumerate(data):
-                retval[i] = str(obj)
+            return cls.as_objects(map(str, data.tolist()))
         except:
-            retval = np.asanyarray(['None' for d in data])
-        return retval
+            return np.asanyarray(['None'] * len(data))
 
-    def stringify_inplace(self, data):
+    @classmethod
+    def stringify_inplace(cls, data):
         try:
-            for i,obj in enumerate(data):
-                data[i] = str(obj)
+            data[:] = map(str, data.tolist())
         except:
-            data = np.asanyarray(['None' for d in data])
+            data = np.asanyarray(['None'] * len(data))
         return data
 
-    def get_bitmask(self, cov, fields, slices, selectors):
+    @classmethod
+    def range_stringify(cls, data):
+        try:
+            #scalar case
+            if data.shape == (2,):
+                return np.atleast_1d('%s_%s' % (data[0], data[1]))
+            return cls.as_objects(['%s_%s' % (d[0], d[1]) for d in data.tolist()])
+        except:
+            return np.asanyarray(['None'] * len(data))
+
+    def get_bitmask(self, cov, fields, slices, selectors, slice_=None):
         '''
-        returns a bitmask appropriate to the values
+        returns a bitmask appropriate to the values, over the timesteps in slice_ (all of them by default)
         '''
-        bitmask = np.ones(cov.num_timesteps, dtype=np.bool)
+        slice_ = slice_ or slice(0, cov.num_timesteps)
+        bitmask = np.ones(len(xrange(*slice_.indices(cov.num_timesteps))), dtype=np.bool)
         for selector in selectors:
             field, operator, value = self.parse_selectors(selector)
             if operator is None:
                 continue
-            values = cov._range_value[field][:]
+            values = cov._range_value[field][slice_]
             expression = ' '.join(['values', operator, value])
             bitmask = bitmask & ne.evaluate(expression)
 
         return bitmask
 
+    def coverage(self):
+        '''
+        The request's coverage, acquired again for every chunk since a long response can outlive the cache entry
+        '''
+        base = os.path.split(self.filepath)
+        return self.get_coverage(base[0], base[1])
+
+    def get_slab(self, cov, selectors):
+        '''
+        Returns (start, stop), the timesteps that can satisfy the selectors on
+        the temporal parameter.  When the temporal axis is sorted the bounds are
+        a binary search of the coverage's time index, otherwise every timestep
+        is a candidate.
+        '''
+        start, stop = 0, self.num_timesteps
+        bounds = []
+        self._bounded = set()
+        for selector in selectors:
+            field, operator, value = self.parse_selectors(selector)
+            if field != cov.temporal_parameter_name or operator not in ('<', '<=', '>', '>=', '=='):
+                continue
+            try:
+                bounds.append((selector, operator, float(value)))
+            except ValueError:
+                continue # Left to the bitmask
+        if not bounds:
+            return start, stop
+
+        index = TimeIndex.for_coverage(cov)
+        if not index.monotonic:
+            return start, stop
+        reader = TimeIndex.reader(cov)
+        for selector, operator, value in bounds:
+            self._bounded.add(selector)
+            if operator in ('>', '>=', '=='):
+                start = max(start, index.bound(reader, value, 'right' if operator == '>' else 'left'))
+            if operator in ('<', '<=', '=='):
+                stop = min(stop, index.bound(reader, value, 'left' if operator == '<' else 'right'))
+        return start, max(start, stop)
+
+    def iter_masks(self, selectors):
+        '''
+        Yields (slice, bitmask) for every chunk of timesteps with selected values
+        '''
+        start, stop = self.slab or (0, self.num_timesteps)
+        for lower in xrange(start, stop, self.CHUNK_SIZE):
+            cov = self.coverage()
+            slice_ = slice(lower, min(lower + self.CHUNK_SIZE, stop))
+            bitmask = self.get_bitmask(cov, None, None, selectors, slice_)
+            if bitmask.any():
+                yield slice_, bitmask
+
+    def count(self, selectors):
+        '''
+        The number of rows selected, the slab's length unless some selector
+        the slab doesn't satisfy filters the values, then a single pass over
+        the masks per request
+        '''
+        if all(selector in self._bounded or self.parse_selectors(selector)[1] is None for selector in selectors):
+            start, stop = self.slab or (0, self.num_timesteps)
+            return stop - start
+        key = tuple(selectors)
+        if key not in self._counts:
+            self._counts[key] = sum(np.count_nonzero(mask) for _, mask in self.iter_masks(selectors))
+        return self._counts[key]
+
+    def iter_chunks(self, fields, selectors, types):
+        '''
+        Yields a dict of the encoded values of the fields for every chunk of timesteps with selected values
+        '''
+        for slice_, bitmask in self.iter_masks(selectors):
+            cov = self.coverage()
+            columns = {}
+            for name in fields:
+                try:
+                    data, dtype = self.encode(name, cov.get_parameter_context(name), self.get_data(cov, name, bitmask, slice_))
+                except Exception:
+                    log.exception('Problem reading %s from cov %s at %s', name, cov.name, slice_)
+                    data = self.placeholder(types[name], np.count_nonzero(bitmask))
+                columns[name] = data
+            yield columns
+
+    def placeholder(self, dtype, count):
+        if dtype == 'S':
+            return np.asanyarray(['None'] * count, dtype='O')
+        return np.zeros(count, dtype=dtype)
+
+    def encode(self, name, pc, data):
+        '''
+        Returns the values of a parameter converted for DAP and their DAP type, None for parameters that aren't sent
+        '''
+        encoder = self.encoder(name, pc, data)
+        if encoder is None:
+            return None
+        return encoder(data)
+
+    def encoder(self, name, pc, data):
+        '''
+        The conversion of a parameter is picked once per dataset and parameter
+        and reused for every chunk, as long as the values keep their dtype and
+        dimensions
+        '''
+        key = (os.path.split(self.filepath)[1], name)
+        signature = (data.dtype.char, data.ndim)
+        try:
+            cached_signature, encoder = self._encoders.pop(key)
+            if cached_signature != signature:
+                raise KeyError(key)
+        except KeyError:
+            if isinstance(pc.param_type, SparseConstantType):
+                encoder = None
+            elif isinstance(pc.param_type, ConstantRangeType):
+                cls = self.__class__
+                encoder = lambda data: (cls.range_stringify(data), 'S')
+            else:
+                encoder = self.data_encoder(data)
+            if len(self._encoders) >= self.ENCODER_LIMIT:
+                self._encoders.popitem(0)
+        self._encoders[key] = signature, encoder
+        return encoder
+
+    def get_types(self, cov, names, selectors):
+        '''
+        The DAP type of every field that can be sent, established on the first chunk with selected values
+        '''
+        types = {}
+        for slice_, bitmask in self.iter_masks(selectors):
+            for name in names:
+                pc = cov.get_parameter_context(name)
+                try:
+                    encoded = self.encode(name, pc, self.get_data(cov, name, bitmask, slice_))
+                except Exception, e:
+                    log.exception('Problem reading cov %s %s', cov.name, e)
+                    continue
+                if encoded is not None:
+                    types[name] = encoded[1]
+            return types
+        # Nothing selected, the types come from the parameter contexts
+        for name in names:
+            pc = cov.get_parameter_context(name)
+            if not isinstance(pc.param_type, SparseConstantType):
+                types[name] = self.dap_type(pc)
+        return types
+
     def get_dataset(self, cov, fields, slices, selectors, dataset, response):
         seq = SequenceType('data')
-        bitmask = self.get_bitmask(cov, fields, slices, selectors)
-        if self.is_too_large(bitmask, len(fields)):
-            log.error('Client request too large. \nFields: %s\nSelectors: %s', fields, selectors)
-            return
+        self.num_timesteps = cov.num_timesteps
+        self.slab = self.get_slab(cov, selectors)
+        self._counts.clear()
+        names = []
         for name in fields:
             # Strip the data. from the field
             if name.startswith('data.'):
                 name = name[5:]
-            pc = cov.get_parameter_context(name)
             if re.match(r'.*_[a-z0-9]{32}', name):
                 continue # Let's not do this
-            try:
-                data = self.get_data(cov, name, bitmask)
-                attrs  = self.get_attrs(cov, name)
-                if isinstance(pc.param_type, QuantityType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-                elif isinstance(pc.param_type, ConstantType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-                elif isinstance(pc.param_type, ConstantRangeType):
-                    #start = time.time()
-                    #convert to string
-                    try:
-                        #scalar case
-                        if data.shape == (2,):
-                            data = np.atleast_1d('_'.join([str(data[0]), str(data[1])]))
-                        else:
-                            for i,d in enumerate(data):
-                                f = [str(d[0]),str(d[1])]
-                                data[i] = '_'.join(f)
-                    except Exception, e:
-                        data = np.asanyarray(['None' for d in data])
-                    seq[name] = self.make_series(response, name, data, attrs, 'S')
-                elif isinstance(pc.param_type,BooleanType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-                elif isinstance(pc.param_type,CategoryType):
-                    data, dtype = self.filter_data(data)
-                    #start = time.time()
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-                elif isinstance(pc.param_type,ArrayType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-
-                elif isinstance(pc.param_type,RecordType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-
-                elif isinstance(pc.param_type, ParameterFunctionType):
-                    data, dtype = self.filter_data(data)
-                    seq[name] = self.make_series(response, name, data, attrs, dtype)
-
-                elif isinstance(pc.param_type, SparseConstantType):
-                    data, dtype = self.filter_data(data)
-                #dataset[name] = self.make_series(response, name, data, attrs, dtype)
-#                elif param.is_coordinate and cov.temporal_parameter_name == name:
-#                        dataset[name] = BaseType(name=name, data=data, type=data.dtype.char, attributes=attrs, shape=data.shape)
-#                    else:
-#                        log.error("Unhandled parameter for parameter (%s) type: %s", name, pc.param_type.__class__.__name__)
-                    
-            except Exception, e:
-                log.exception('Problem reading cov %s %s', cov.name, e)
-                continue
-            dataset['data'] = seq
+            names.append(name)
+
+        types = self.get_types(cov, names, selectors)
+        names = [name for name in names if name in types]
+        data = CoverageSequenceData(self, names, selectors, types)
+        for name in names:
+            attrs  = self.get_attrs(cov, name)
+            seq[name] = self.make_series(response, name, data[name], attrs, types[name])
+        # The rows are only read as the response is written
+        seq.data = data
+        dataset['data'] = seq
         return dataset
 
     def value_encoding_to_dap_type(self, value_encoding):
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+'''
+@file ion/util/pydap/handlers/coverage/test/test_coverage_handler.py
+@brief Tests for the chunked reads of the pydap coverage handler
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.util.pydap.handlers.coverage.coverage_handler import Handler
+from ion.util.time_index import TimeIndex
+from coverage_model.parameter_types import QuantityType, ConstantType, ConstantRangeType, BooleanType, CategoryType
+from coverage_model.parameter_types import ArrayType, RecordType, ParameterFunctionType, SparseConstantType
+from pyon.util.log import log
+from pydap.model import DatasetType
+from pydap.responses.dods import DODSResponse
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import numpy as np
+import tempfile
+import shutil
+import struct
+import time
+import os
+
+
+class RangeValue(object):
+    '''
+    Records the slices read from a parameter
+    '''
+    def __init__(self, values):
+        self.values = values
+        self.reads = []
+
+    def __getitem__(self, slice_):
+        self.reads.append(slice_)
+        return self.values[slice_]
+
+
+@attr('UNIT')
+class TestCoverageHandler(PyonTestCase):
+    def setUp(self):
+        self.coverage = Mock()
+        self.coverage.name = 'test'
+        self.coverage.num_timesteps = 25
+        self.coverage._range_value = {'time' : RangeValue(np.arange(25, dtype='float64')),
+                                      'temp' : RangeValue(np.arange(25) * 2.)}
+        self.coverage._range_dictionary = dict((name, Mock(param_type=QuantityType())) for name in ('time', 'temp'))
+        self.coverage.get_parameter_context = lambda name: self.coverage._range_dictionary[name]
+        self.coverage.get_parameter_values = lambda name, tdoa: self.coverage._range_value[name].values[tdoa]
+        self.coverage.temporal_parameter_name = 'time'
+        self.coverage.persistence_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.coverage.persistence_dir)
+        self.addCleanup(TimeIndex._cache.clear)
+        Handler._encoders.clear()
+        self.addCleanup(Handler._encoders.clear)
+
+        self.handler = Handler('/tmp/test_dataset')
+        self.handler.CHUNK_SIZE = 7
+        self.handler.get_coverage = lambda root_path, dataset_id: self.coverage
+
+    def test_chunked_sequence(self):
+        dataset = self.handler.get_dataset(self.coverage, ['data.time', 'data.temp'], None, ['data.temp>7'], DatasetType('test'), None)
+        seq = dataset['data']
+        self.assertEquals(seq.keys(), ['time', 'temp'])
+
+        rows = list(seq.data)
+        self.assertEquals(len(rows), 21)
+        self.assertEquals(len(seq.data), 21)
+        self.assertEquals(rows[:2], [(4., 8.), (5., 10.)])
+        self.assertEquals(list(seq['temp'].data), range(8, 50, 2))
+
+        # No read covers more than a chunk
+        for slice_ in self.coverage._range_value['temp'].reads:
+            self.assertTrue(slice_.stop - slice_.start <= 7)
+
+    def test_time_range(self):
+        dataset = self.handler.get_dataset(self.coverage, ['data.time', 'data.temp'], None, ['data.time>=10', 'data.time<12.5', 'data.temp!=20'], DatasetType('test'), None)
+        self.assertEquals(self.handler.slab, (10, 13))
+        self.assertEquals(list(dataset['data'].data), [(11., 22.), (12., 24.)])
+        # Only the slab is read, the time index covers the rest
+        for slice_ in self.coverage._range_value['temp'].reads:
+            self.assertEquals(slice_, slice(10, 13))
+
+        self.handler.dap_type = Mock(return_value='d')
+        self.handler.get_dataset(self.coverage, ['data.time'], None, ['data.time>30'], DatasetType('test'), None)
+        self.assertEquals(self.handler.slab, (25, 25))
+
+    def test_empty_selection(self):
+        self.handler.dap_type = Mock(return_value='d')
+        dataset = self.handler.get_dataset(self.coverage, ['data.time'], None, ['data.time>100'], DatasetType('test'), None)
+        self.assertEquals(list(dataset['data'].data), [])
+        self.assertEquals(dataset['data']['time'].type, 'd')
+
+    def test_dods_response(self):
+        self.handler.filepath = os.path.join(self.coverage.persistence_dir, 'test_dataset')
+        open(self.handler.filepath, 'w').close()
+        self.coverage.list_parameters = lambda: ['time', 'temp']
+        passes = []
+        iter_masks = self.handler.iter_masks
+        def counted(selectors):
+            passes.append(selectors)
+            return iter_masks(selectors)
+        self.handler.iter_masks = counted
+
+        environ = {'pydap.response' : 'dods', 'pydap.headers' : [], 'QUERY_STRING' : 'data.time,data.temp&data.temp>7'}
+        dataset = self.handler.parse_constraints(environ)
+        output = ''.join(DODSResponse(dataset)(environ, lambda status, headers: None))
+
+        dds, data = output.split('Data:\n', 1)
+        self.assertIn('Sequence {', dds)
+        self.assertIn('Float64 time;', dds)
+        self.assertIn('Float64 temp;', dds)
+        rows = []
+        while data[:4] == '\x5a\x00\x00\x00': # START_OF_SEQUENCE
+            rows.append(struct.unpack('>dd', data[4:20]))
+            data = data[20:]
+        self.assertEquals(data, '\xa5\x00\x00\x00') # END_OF_SEQUENCE
+        self.assertEquals(rows, [(float(i), i * 2.) for i in xrange(4, 25)])
+
+        # The rows were read a chunk at a time, never all at once
+        for slice_ in self.coverage._range_value['temp'].reads:
+            self.assertTrue(slice_.stop - slice_.start <= 7)
+
+        # The length is counted at most once per request, or comes from the slab
+        passes[:] = []
+        self.assertEquals(len(dataset['data'].data), 21)
+        self.assertEquals(dataset['data'].data.shape, (21,))
+        self.assertEquals(len(dataset['data']['temp'].data), 21)
+        self.assertTrue(len(passes) <= 1)
+        dataset = self.handler.get_dataset(self.coverage, ['data.time'], None, ['data.time>=10'], DatasetType('test'), None)
+        passes[:] = []
+        self.assertEquals(len(dataset['data'].data), 15)
+        self.assertEquals(passes, [])
+
+    def test_encode(self):
+        encode = lambda param_type, data: self.handler.encode('p', Mock(param_type=Mock(spec=param_type)), data)
+
+        data, dtype = encode(ArrayType, np.array([[1., 2.5], [3., 4.]]))
+        self.assertEquals((data.tolist(), dtype), (['1.0,2.5', '3.0,4.0'], 'S'))
+        data, dtype = encode(ConstantRangeType, np.array([(1, 2), (3, 4)], dtype='O'))
+        self.assertEquals((data.tolist(), dtype), (['1_2', '3_4'], 'S'))
+        data, dtype = encode(ConstantRangeType, np.array([1, 2]))
+        self.assertEquals((data.tolist(), dtype), (['1_2'], 'S'))
+        data, dtype = encode(RecordType, np.array([{'a' : 1}, None], dtype='O'))
+        self.assertEquals((data.tolist(), dtype), (["{'a': 1}", 'None'], 'S'))
+        data, dtype = encode(BooleanType, np.array([True, False]))
+        self.assertEquals((data.tolist(), dtype), ([1, 0], 'i'))
+        data, dtype = encode(QuantityType, np.array([1 + 2j]))
+        self.assertEquals((data.tolist(), dtype), (['(1+2j)'], 'S'))
+        self.assertIsNone(encode(SparseConstantType, np.array([1.])))
+
+        # The encoder is kept for the parameter until its values change shape
+        self.assertEquals(Handler._encoders.keys(), [('test_dataset', 'p')])
+        data, dtype = encode(ArrayType, np.array([1, 2], dtype='int16'))
+        self.assertEquals((data.tolist(), dtype), ([1, 2], 'h'))
+
+
+@attr('BENCHMARK')
+class BenchmarkCoverageHandler(PyonTestCase):
+    def test_encode(self):
+        n = 100000
+        columns = [(QuantityType,          np.random.random(n)),
+                   (ParameterFunctionType, np.random.random(n)),
+                   (ConstantType,          np.arange(n, dtype='int32')),
+                   (BooleanType,           np.random.random(n) > 0.5),
+                   (CategoryType,          np.array(['category'] * n, dtype='O')),
+                   (RecordType,            np.array([{'value' : 1}] * n, dtype='O')),
+                   (ArrayType,             np.random.random((n, 4))),
+                   (ConstantRangeType,     np.array([(1., 2.)] * n + [None], dtype='O')[:-1])]
+        handler = Handler('/tmp/benchmark_dataset')
+        self.addCleanup(Handler._encoders.clear)
+        for param_type, data in columns:
+            pc = Mock(param_type=Mock(spec=param_type))
+            then = time.time()
+            values, dtype = handler.encode(param_type.__name__, pc, data)
+            log.info('Encoded %d %s values as %s in %.3fs', n, param_type.__name__, dtype, time.time() - then)
+            self.assertEquals(len(values), n)
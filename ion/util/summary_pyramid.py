@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+'''
+@file ion/util/summary_pyramid.py
+@description Multi-resolution aggregates of a coverage's numeric parameters over fixed time buckets
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+import os
+
+from ion.util.time_index import save_npz
+
+
+class SummaryPyramid(object):
+    '''
+    Per-parameter count, sum, minimum and maximum of a coverage's numeric
+    parameters over fixed time buckets, kept at several resolutions.  Level 0
+    buckets are base_width wide (in the units of the temporal axis), every
+    following level is factor times coarser.  Only buckets holding data are
+    kept, fill values and NaNs aren't counted.
+
+    Overview queries are answered from the coarsest level that still has the
+    requested resolution instead of reading every sample.  Like the TimeIndex,
+    the pyramid is persisted inside the coverage's persistence directory and
+    kept in sync by summarizing the timesteps it hasn't seen yet.
+    '''
+    BASE_WIDTH = 60.
+    FACTOR     = 10
+    LEVELS     = 5
+    FILENAME   = 'summary_pyramid.npz'
+    CACHE_SIZE = 100
+    STATS      = ('count', 'sum', 'min', 'max')
+
+    _cache = OrderedDict()
+
+    def __init__(self, parameters, base_width=None, factor=None, levels=None):
+        self.parameters = list(parameters)
+        self.base_width = float(base_width or self.BASE_WIDTH)
+        self.factor     = int(factor or self.FACTOR)
+        self.count      = 0
+        # Level arrays grow geometrically, only the first _sizes[level] buckets are in use
+        self._levels    = [self._empty_level(0) for i in xrange(levels or self.LEVELS)]
+        self._sizes     = [0] * len(self._levels)
+
+    def _empty_level(self, n):
+        p = len(self.parameters)
+        return {'buckets' : np.empty(n, dtype='int64'),
+                'count'   : np.zeros((p, n), dtype='int64'),
+                'sum'     : np.zeros((p, n), dtype='float64'),
+                'min'     : np.empty((p, n), dtype='float64'),
+                'max'     : np.empty((p, n), dtype='float64')}
+
+    def width(self, level):
+        return self.base_width * self.factor ** level
+
+    def level(self, level):
+        '''
+        The buckets of a level and their statistics
+        '''
+        n = self._sizes[level]
+        return dict((key, value[..., :n]) for key, value in self._levels[level].iteritems())
+
+    @property
+    def levels(self):
+        return [self.level(level) for level in xrange(len(self._levels))]
+
+    #--------------------------------------------------------------------------------
+    # Maintenance
+    #--------------------------------------------------------------------------------
+
+    def append(self, times, values, fill_values=None):
+        '''
+        Summarizes the next timesteps, values maps parameter names to their
+        values for the same timesteps as times
+        '''
+        times = np.asanyarray(times, dtype='float64').ravel()
+        n = times.shape[0]
+        if not n:
+            return
+        fill_values = fill_values or {}
+        data = np.empty((len(self.parameters), n), dtype='float64')
+        valid = np.zeros(data.shape, dtype=bool)
+        for i, name in enumerate(self.parameters):
+            if values.get(name) is None:
+                continue
+            data[i] = np.asanyarray(values[name], dtype='float64').ravel()
+            valid[i] = ~np.isnan(data[i])
+            if fill_values.get(name) is not None:
+                valid[i] &= data[i] != fill_values[name]
+        # Timesteps without a time can't be placed in a bucket
+        valid &= ~np.isnan(times)
+        times = np.where(np.isnan(times), 0., times)
+
+        for level in xrange(len(self._levels)):
+            buckets = np.floor(times / self.width(level)).astype('int64')
+            order = np.argsort(buckets, kind='mergesort')
+            buckets = buckets[order]
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            ordered = data[:, order]
+            mask = valid[:, order]
+            summary = {'buckets' : buckets[starts],
+                       'count'   : np.add.reduceat(mask.astype('int64'), starts, axis=1),
+                       'sum'     : np.add.reduceat(np.where(mask, ordered, 0.), starts, axis=1),
+                       'min'     : np.fmin.reduceat(np.where(mask, ordered, np.nan), starts, axis=1),
+                       'max'     : np.fmax.reduceat(np.where(mask, ordered, np.nan), starts, axis=1)}
+            self._merge(level, summary)
+        self.count += n
+
+    def _merge(self, level, new):
+        '''
+        Folds a summary of new data into a level, only the part of the level
+        from the first new bucket onwards is rewritten
+        '''
+        old = self.level(level)
+        n = self._sizes[level]
+        k = np.searchsorted(old['buckets'], new['buckets'][0])
+        if k == n:
+            tail = new
+        else:
+            buckets = np.union1d(old['buckets'][k:], new['buckets'])
+            tail = self._empty_level(buckets.shape[0])
+            tail['buckets'] = buckets
+            tail['min'].fill(np.nan)
+            tail['max'].fill(np.nan)
+            for part, offset in ((old, k), (new, 0)):
+                idx = np.searchsorted(buckets, part['buckets'][offset:])
+                tail['count'][:, idx] += part['count'][:, offset:]
+                tail['sum'][:, idx]   += part['sum'][:, offset:]
+                tail['min'][:, idx]    = np.fmin(tail['min'][:, idx], part['min'][:, offset:])
+                tail['max'][:, idx]    = np.fmax(tail['max'][:, idx], part['max'][:, offset:])
+
+        size = k + tail['buckets'].shape[0]
+        arrays = self._levels[level]
+        capacity = arrays['buckets'].shape[0]
+        if size > capacity:
+            grown = self._empty_level(max(size, 2 * capacity))
+            for key in arrays:
+                grown[key][..., :k] = arrays[key][..., :k]
+            arrays = self._levels[level] = grown
+        for key in arrays:
+            arrays[key][..., k:size] = tail[key]
+        self._sizes[level] = size
+
+    #--------------------------------------------------------------------------------
+    # Queries
+    #--------------------------------------------------------------------------------
+
+    def level_for(self, resolution):
+        '''
+        The coarsest level whose buckets are no wider than resolution, None if
+        even the finest level is too coarse
+        '''
+        for level in reversed(xrange(len(self._levels))):
+            if self.width(level) <= resolution:
+                return level
+        return None
+
+    def query(self, resolution, start_time=None, end_time=None, parameters=None):
+        '''
+        Returns (level, times, stats) for the buckets between start_time and
+        end_time of the coarsest level meeting resolution, or None if the raw
+        data is needed.  times are the bucket start times, stats maps each
+        parameter to a dict of count, mean, min and max arrays (NaN where the
+        parameter has no data in the bucket).
+        '''
+        level = self.level_for(resolution)
+        if level is None:
+            return None
+        summary = self.level(level)
+        width = self.width(level)
+        lower = 0 if start_time is None else np.searchsorted(summary['buckets'], np.floor(start_time / width))
+        upper = summary['buckets'].shape[0] if end_time is None else np.searchsorted(summary['buckets'], np.floor(end_time / width), side='right')
+
+        stats = {}
+        for i, name in enumerate(self.parameters):
+            if parameters is not None and name not in parameters:
+                continue
+            count = summary['count'][i, lower:upper]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = summary['sum'][i, lower:upper] / count
+            stats[name] = {'count' : count,
+                           'mean'  : np.where(count > 0, mean, np.nan),
+                           'min'   : summary['min'][i, lower:upper],
+                           'max'   : summary['max'][i, lower:upper]}
+        return level, summary['buckets'][lower:upper] * width, stats
+
+    #--------------------------------------------------------------------------------
+    # Persistence
+    #--------------------------------------------------------------------------------
+
+    @classmethod
+    def pyramid_path(cls, coverage):
+        return os.path.join(coverage.persistence_dir, cls.FILENAME)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        if path in cls._cache:
+            cached_mtime, pyramid = cls._cache.pop(path)
+            if cached_mtime == mtime:
+                cls._cache[path] = (mtime, pyramid)
+                return pyramid
+        npz = np.load(path)
+        try:
+            pyramid = cls(npz['parameters'].tolist(), float(npz['base_width']), int(npz['factor']), int(npz['levels']))
+            pyramid.count = int(npz['count'])
+            for level in xrange(len(pyramid._levels)):
+                pyramid._levels[level] = dict((key, npz['L%s_%s' % (level, key)]) for key in ('buckets',) + cls.STATS)
+                pyramid._sizes[level] = pyramid._levels[level]['buckets'].shape[0]
+        finally:
+            npz.close()
+        cls._remember(path, mtime, pyramid)
+        return pyramid
+
+    def save(self, path):
+        arrays = {}
+        for level, summary in enumerate(self.levels):
+            for key, value in summary.iteritems():
+                arrays['L%s_%s' % (level, key)] = value
+        save_npz(path, parameters=np.array(self.parameters, dtype=str), base_width=self.base_width,
+                 factor=self.factor, levels=len(self._levels), count=self.count, **arrays)
+        self._remember(path, os.path.getmtime(path), self)
+
+    @classmethod
+    def _remember(cls, path, mtime, pyramid):
+        cls._cache.pop(path, None)
+        while len(cls._cache) >= cls.CACHE_SIZE:
+            cls._cache.popitem(last=False)
+        cls._cache[path] = (mtime, pyramid)
+
+    @classmethod
+    def summarized_parameters(cls, coverage):
+        '''
+        The numeric, scalar and stored parameters of a coverage
+        '''
+        from coverage_model import QuantityType
+        parameters = []
+        for name in coverage.list_parameters():
+            if name == coverage.temporal_parameter_name:
+                continue
+            param_type = coverage.get_parameter_context(name).param_type
+            if not isinstance(param_type, QuantityType):
+                continue
+            try:
+                if np.dtype(param_type.value_encoding).kind in 'iuf':
+                    parameters.append(name)
+            except TypeError:
+                continue
+        return parameters
+
+    @classmethod
+    def for_coverage(cls, coverage, persist=False):
+        '''
+        Returns the pyramid for a coverage, summarizing only the timesteps that
+        were appended since the pyramid was last updated.  What is summarized is
+        kept in memory, only the ingestion worker saves the pyramid, periodically.
+        '''
+        path = cls.pyramid_path(coverage)
+        cached = cls._cache.get(path, (None, None))[1]
+        try:
+            pyramid = cls.load(path)
+        except Exception:
+            # Unreadable, e.g. truncated, the pyramid is rebuilt
+            pyramid = None
+        if cached is not None and (pyramid is None or cached.count > pyramid.count):
+            # Summarized further in memory than what was last saved
+            pyramid = cached
+        num_timesteps = coverage.num_timesteps
+        if pyramid is None or pyramid.count > num_timesteps:
+            pyramid = cls(cls.summarized_parameters(coverage))
+        if pyramid.count < num_timesteps:
+            slice_ = slice(pyramid.count, num_timesteps)
+            times = coverage.get_parameter_values(coverage.temporal_parameter_name, tdoa=slice_)
+            values = dict((name, coverage.get_parameter_values(name, tdoa=slice_)) for name in pyramid.parameters)
+            fill_values = dict((name, coverage.get_parameter_context(name).fill_value) for name in pyramid.parameters)
+            pyramid.append(times, values, fill_values)
+            if persist:
+                try:
+                    pyramid.save(path)
+                except (IOError, OSError):
+                    pass # Read-only persistence, the pyramid is still usable in memory
+        cls._remember(path, os.path.getmtime(path) if os.path.exists(path) else None, pyramid)
+        return pyramid
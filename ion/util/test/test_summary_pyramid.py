@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''
+@file ion/util/test/test_summary_pyramid.py
+@brief Tests for the coverage summary pyramid
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.util.summary_pyramid import SummaryPyramid
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+import numpy as np
+import tempfile
+import shutil
+import time
+import os
+
+
+@attr('UNIT')
+class TestSummaryPyramid(PyonTestCase):
+    def build(self, times, values, chunk):
+        pyramid = SummaryPyramid(['temp', 'pressure'], base_width=10, factor=10, levels=3)
+        for i in xrange(0, times.shape[0], chunk):
+            pyramid.append(times[i:i+chunk], dict((k, v[i:i+chunk]) for k, v in values.iteritems()), {'pressure' : -9999.})
+        return pyramid
+
+    def setUp(self):
+        self.times = np.arange(1000, dtype='float64')
+        self.values = {'temp' : np.sin(self.times), 'pressure' : self.times.copy()}
+        self.values['pressure'][5] = -9999.
+        self.values['pressure'][20:30] = np.nan
+
+    def test_levels(self):
+        pyramid = self.build(self.times, self.values, 1000)
+        self.assertEquals(pyramid.count, 1000)
+        self.assertEquals([level['buckets'].shape[0] for level in pyramid.levels], [100, 10, 1])
+
+        level, times, stats = pyramid.query(15)
+        self.assertEquals(level, 0)
+        np.testing.assert_array_equal(times, np.arange(0, 1000, 10))
+        # Fill values and NaNs aren't counted
+        self.assertEquals(list(stats['pressure']['count'][:3]), [9, 10, 0])
+        self.assertAlmostEqual(stats['pressure']['mean'][0], 40 / 9.)
+        self.assertTrue(np.isnan(stats['pressure']['mean'][2]))
+        self.assertEquals(stats['temp']['max'][0], self.values['temp'][:10].max())
+
+        level, times, stats = pyramid.query(150, start_time=100, end_time=399, parameters=['temp'])
+        self.assertEquals(level, 1)
+        np.testing.assert_array_equal(times, [100, 200, 300])
+        self.assertEquals(stats.keys(), ['temp'])
+        self.assertAlmostEqual(stats['temp']['mean'][1], self.values['temp'][200:300].mean())
+
+        # Finer than the first level needs the raw data
+        self.assertIsNone(pyramid.query(5))
+
+    def test_incremental(self):
+        expected = self.build(self.times, self.values, 1000)
+        for chunk in (1, 7, 333):
+            pyramid = self.build(self.times, self.values, chunk)
+            for level, summary in enumerate(pyramid.levels):
+                for key, value in summary.iteritems():
+                    np.testing.assert_allclose(value, expected.levels[level][key], err_msg='%s %s' % (level, key))
+
+        # Late data lands in the buckets it belongs to
+        order = np.concatenate([np.arange(500, 1000), np.arange(500)])
+        pyramid = self.build(self.times[order], dict((k, v[order]) for k, v in self.values.iteritems()), 250)
+        for level, summary in enumerate(pyramid.levels):
+            for key, value in summary.iteritems():
+                np.testing.assert_allclose(value, expected.levels[level][key], err_msg='%s %s' % (level, key))
+
+    def test_persistence(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        pyramid = self.build(self.times, self.values, 1000)
+        pyramid.save(os.path.join(path, SummaryPyramid.FILENAME))
+
+        SummaryPyramid._cache.clear()
+        loaded = SummaryPyramid.load(os.path.join(path, SummaryPyramid.FILENAME))
+        self.assertEquals(loaded.parameters, ['temp', 'pressure'])
+        self.assertEquals((loaded.count, loaded.base_width, loaded.factor), (1000, 10, 10))
+        np.testing.assert_array_equal(loaded.levels[1]['sum'], pyramid.levels[1]['sum'])
+
+    @patch.object(SummaryPyramid, 'summarized_parameters', return_value=['temp', 'pressure'])
+    def test_for_coverage(self, summarized_parameters):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.addCleanup(SummaryPyramid._cache.clear)
+        filename = os.path.join(path, SummaryPyramid.FILENAME)
+        with open(filename, 'wb') as f:
+            f.write('PK\x03\x04 truncated')
+
+        coverage = Mock(persistence_dir=path, num_timesteps=1000, temporal_parameter_name='time')
+        coverage.get_parameter_values = lambda name, tdoa: (self.times if name == 'time' else self.values[name])[tdoa]
+        coverage.get_parameter_context.return_value = Mock(fill_value=-9999.)
+
+        # A reader rebuilds the corrupt pyramid in memory and leaves the file to the ingestion worker
+        pyramid = SummaryPyramid.for_coverage(coverage)
+        self.assertEquals(pyramid.count, 1000)
+        with open(filename, 'rb') as f:
+            self.assertEquals(f.read(), 'PK\x03\x04 truncated')
+
+        SummaryPyramid._cache.clear()
+        SummaryPyramid.for_coverage(coverage, persist=True)
+        SummaryPyramid._cache.clear()
+        self.assertEquals(SummaryPyramid.load(filename).count, 1000)
+        self.assertEquals(os.listdir(path), [SummaryPyramid.FILENAME])
+
+
+@attr('BENCHMARK')
+class BenchmarkSummaryPyramid(PyonTestCase):
+    def test_overview(self):
+        # Three years of one minute samples, appended a day at a time
+        times = np.arange(0, 3 * 365 * 86400, 60, dtype='float64')
+        values = np.random.random(times.shape[0])
+        pyramid = SummaryPyramid(['temp'])
+        then = time.time()
+        for i in xrange(0, times.shape[0], 1440):
+            pyramid.append(times[i:i+1440], {'temp' : values[i:i+1440]})
+        log.info('Summarized %d timesteps in %.3fs', times.shape[0], time.time() - then)
+
+        then = time.time()
+        level, buckets, stats = pyramid.query(times[-1] / 1000.)
+        elapsed = time.time() - then
+        log.info('Overview of %d buckets from level %d in %.4fs', buckets.shape[0], level, elapsed)
+        self.assertTrue(buckets.shape[0] < 2000)
+        self.assertLess(elapsed, 0.1)
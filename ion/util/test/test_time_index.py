@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+@file ion/util/test/test_time_index.py
+@brief Tests for the coverage time index
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.util.time_index import TimeIndex
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+@attr('UNIT')
+class TestTimeIndex(PyonTestCase):
+    def build(self, arr, block_size, chunk):
+        index = TimeIndex(block_size)
+        for i in xrange(0, arr.shape[0], chunk):
+            index.append(arr[i:i+chunk])
+        return index
+
+    def assert_matches_scan(self, arr, index):
+        reads = []
+        def reader(slice_):
+            reads.append(slice_)
+            return arr[slice_]
+        for val in np.linspace(arr.min() - 10, arr.max() + 10, 200):
+            del reads[:]
+            self.assertEquals(index.nearest(reader, val), np.abs(arr - val).argmin())
+            if index.monotonic:
+                self.assertTrue(len(reads) <= 2)
+
+    def test_monotonic(self):
+        arr = np.cumsum(np.random.randint(0, 3, 1000)).astype('float64')
+        index = self.build(arr, 16, 37)
+        self.assertTrue(index.monotonic)
+        self.assertEquals(index.count, 1000)
+        self.assertEquals(index.block_min.shape[0], 63)
+        self.assert_matches_scan(arr, index)
+
+    def test_bound(self):
+        arr = np.cumsum(np.random.randint(0, 3, 1000)).astype('float64')
+        index = self.build(arr, 16, 37)
+        reads = []
+        def reader(slice_):
+            reads.append(slice_)
+            return arr[slice_]
+        for val in np.linspace(arr.min() - 10, arr.max() + 10, 200).tolist() + arr[::50].tolist():
+            for side in ('left', 'right'):
+                del reads[:]
+                self.assertEquals(index.bound(reader, val, side), np.searchsorted(arr, val, side=side))
+                self.assertTrue(len(reads) <= 1)
+
+        index.append([0.])
+        with self.assertRaises(ValueError):
+            index.bound(reader, 10.)
+
+    def test_non_monotonic(self):
+        arr = np.arange(1000, dtype='float64')
+        arr[500:] -= 250
+        arr[[10, 700]] = -5
+        index = self.build(arr, 16, 100)
+        self.assertEquals(list(index.breaks), [10, 500, 700])
+        self.assertFalse(index.block_sorted(0))
+        self.assertTrue(index.block_sorted(1))
+        self.assert_matches_scan(arr, index)
+
+    def test_persistence(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        index = self.build(np.arange(100, dtype='float64'), 16, 100)
+        index.save(os.path.join(path, TimeIndex.FILENAME))
+
+        TimeIndex._cache.clear()
+        loaded = TimeIndex.load(os.path.join(path, TimeIndex.FILENAME))
+        self.assertEquals(loaded.count, 100)
+        np.testing.assert_array_equal(loaded.block_max, index.block_max)
+
+        loaded.append(np.arange(100, 150, dtype='float64'))
+        self.assertEquals(loaded.count, 150)
+        self.assertEquals(loaded.block_max[-1], 149)
+
+    def test_corrupt_file(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.addCleanup(TimeIndex._cache.clear)
+        with open(os.path.join(path, TimeIndex.FILENAME), 'wb') as f:
+            f.write('PK\x03\x04 truncated')
+
+        arr = np.arange(100, dtype='float64')
+        coverage = Mock(persistence_dir=path, num_timesteps=100, temporal_parameter_name='time')
+        coverage.get_parameter_values = lambda name, tdoa: arr[tdoa]
+        index = TimeIndex.for_coverage(coverage)
+        self.assertEquals(index.count, 100)
+
+        # Rebuilt and saved in place, without leaving temporary files behind
+        TimeIndex._cache.clear()
+        self.assertEquals(TimeIndex.load(os.path.join(path, TimeIndex.FILENAME)).count, 100)
+        self.assertEquals(os.listdir(path), [TimeIndex.FILENAME])
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+'''
+@file ion/util/time_index.py
+@description Sparse, incrementally maintained index over the temporal parameter of a coverage
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+import tempfile
+import os
+
+
+def save_npz(path, **arrays):
+    '''
+    Writes arrays to an npz file through a uniquely named temporary file in the
+    same directory, so concurrent writers don't clobber each other and readers
+    never see a partial file.
+    '''
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class TimeIndex(object):
+    '''
+    Summary of a coverage's temporal axis used to resolve a time to the index of
+    the nearest timestep without reading the whole axis.
+
+    The axis is split into fixed blocks of BLOCK_SIZE timesteps, for each block
+    the minimum and maximum time are kept.  The axis is also split into monotonic
+    segments, `breaks` lists the indices where time decreases.  Lookups inside
+    monotonic data are a binary search over the block summary followed by a read
+    of at most one block, blocks containing a break are scanned.
+
+    The index is persisted inside the coverage's persistence directory and kept
+    in sync by appending the tail of the temporal axis it hasn't seen yet.
+    '''
+    BLOCK_SIZE = 4096
+    FILENAME   = 'time_index.npz'
+    CACHE_SIZE = 100
+
+    _cache = OrderedDict()
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or self.BLOCK_SIZE
+        self.count      = 0
+        self.last_value = None
+        self.block_min  = np.empty(0, dtype='float64')
+        self.block_max  = np.empty(0, dtype='float64')
+        self.breaks     = np.empty(0, dtype='int64')
+
+    #--------------------------------------------------------------------------------
+    # Maintenance
+    #--------------------------------------------------------------------------------
+
+    def append(self, values):
+        '''
+        Extends the index with the next values of the temporal axis
+        '''
+        values = np.asanyarray(values, dtype='float64').ravel()
+        n = values.shape[0]
+        if not n:
+            return
+        start = self.count
+
+        breaks = np.nonzero(np.diff(values) < 0)[0] + (start + 1)
+        if start and values[0] < self.last_value:
+            breaks = np.concatenate([[start], breaks])
+        self.breaks = np.concatenate([self.breaks, breaks]).astype('int64')
+
+        block_ids = np.arange(start, start + n) // self.block_size
+        offsets = np.concatenate([[0], np.nonzero(np.diff(block_ids))[0] + 1])
+        mins = np.fmin.reduceat(values, offsets)
+        maxs = np.fmax.reduceat(values, offsets)
+        if start % self.block_size:
+            # The first values complete the last, partially filled block
+            self.block_min[-1] = np.fmin(self.block_min[-1], mins[0])
+            self.block_max[-1] = np.fmax(self.block_max[-1], maxs[0])
+            mins = mins[1:]
+            maxs = maxs[1:]
+        self.block_min = np.concatenate([self.block_min, mins])
+        self.block_max = np.concatenate([self.block_max, maxs])
+
+        self.count = start + n
+        self.last_value = values[-1]
+
+    @property
+    def monotonic(self):
+        return not self.breaks.shape[0]
+
+    def block_sorted(self, block):
+        '''
+        True if the block doesn't contain a break within it
+        '''
+        lower = block * self.block_size
+        i = np.searchsorted(self.breaks, lower, side='right')
+        return i == self.breaks.shape[0] or self.breaks[i] >= lower + self.block_size
+
+    #--------------------------------------------------------------------------------
+    # Lookups
+    #--------------------------------------------------------------------------------
+
+    def _block_values(self, reader, block, blocks):
+        if block not in blocks:
+            lower = block * self.block_size
+            blocks[block] = np.asanyarray(reader(slice(lower, min(lower + self.block_size, self.count))), dtype='float64')
+        return blocks[block]
+
+    def _nearest_in_block(self, reader, block, val, blocks):
+        '''
+        Returns (index, distance) of the nearest value inside a block
+        '''
+        values = self._block_values(reader, block, blocks)
+        lower = block * self.block_size
+        if self.block_sorted(block):
+            i = np.searchsorted(values, val)
+            candidates = [j for j in (i - 1, i) if 0 <= j < values.shape[0]]
+            j = min(candidates, key=lambda j: abs(values[j] - val))
+            j = np.searchsorted(values, values[j]) # First of any repeated values
+        else:
+            j = np.abs(values - val).argmin()
+        return lower + j, abs(values[j] - val)
+
+    def nearest(self, reader, val, blocks=None):
+        '''
+        Index of the timestep nearest to val, reader is a callable returning the
+        temporal values for a slice.  Ties resolve to the lowest index.
+        '''
+        if not self.count:
+            return None
+        blocks = {} if blocks is None else blocks
+        last_block = self.block_min.shape[0] - 1
+
+        if self.monotonic:
+            b = np.searchsorted(self.block_max, val)
+            if b > last_block:
+                b = last_block
+                value = self.block_max[b]
+            elif val <= self.block_min[b]:
+                if b and val - self.block_max[b-1] <= self.block_min[b] - val:
+                    b -= 1
+                    value = self.block_max[b]
+                else:
+                    value = self.block_min[b]
+            else:
+                value = val
+            idx = self._nearest_in_block(reader, b, value, blocks)[0]
+            # Repeated values may continue from the previous blocks
+            while idx == b * self.block_size and b and self.block_max[b-1] == self._block_values(reader, b, blocks)[0]:
+                b -= 1
+                idx = self._nearest_in_block(reader, b, self.block_max[b], blocks)[0]
+            return idx
+
+        # Non-monotonic axis, blocks are visited closest range first and only
+        # until no remaining block can hold a nearer value
+        distance = np.fmax(np.fmax(self.block_min - val, val - self.block_max), 0)
+        best_idx, best_dist = None, None
+        for b in np.argsort(distance, kind='mergesort'):
+            if np.isnan(distance[b]) or (best_dist is not None and distance[b] > best_dist):
+                break
+            idx, dist = self._nearest_in_block(reader, b, val, blocks)
+            if best_dist is None or dist < best_dist or (dist == best_dist and idx < best_idx):
+                best_idx, best_dist = idx, dist
+        return best_idx
+
+    def bound(self, reader, val, side='left'):
+        '''
+        Index where val would be inserted into a monotonic axis to keep it
+        sorted, like numpy.searchsorted.  Reads at most one block.
+        '''
+        if not self.monotonic:
+            raise ValueError('The temporal axis is not monotonic')
+        b = np.searchsorted(self.block_max, val, side=side)
+        if b >= self.block_max.shape[0]:
+            return self.count
+        values = self._block_values(reader, b, {})
+        return b * self.block_size + int(np.searchsorted(values, val, side=side))
+
+    #--------------------------------------------------------------------------------
+    # Persistence
+    #--------------------------------------------------------------------------------
+
+    @classmethod
+    def index_path(cls, coverage):
+        return os.path.join(coverage.persistence_dir, cls.FILENAME)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        if path in cls._cache:
+            cached_mtime, index = cls._cache.pop(path)
+            if cached_mtime == mtime:
+                cls._cache[path] = (mtime, index)
+                return index
+        npz = np.load(path)
+        try:
+            index = cls(int(npz['block_size']))
+            index.count      = int(npz['count'])
+            index.last_value = float(npz['last_value']) if index.count else None
+            index.block_min  = npz['block_min']
+            index.block_max  = npz['block_max']
+            index.breaks     = npz['breaks']
+        finally:
+            npz.close()
+        cls._remember(path, mtime, index)
+        return index
+
+    def save(self, path):
+        save_npz(path, block_size=self.block_size, count=self.count,
+                 last_value=self.last_value if self.count else 0.,
+                 block_min=self.block_min, block_max=self.block_max, breaks=self.breaks)
+        self._remember(path, os.path.getmtime(path), self)
+
+    @classmethod
+    def _remember(cls, path, mtime, index):
+        cls._cache.pop(path, None)
+        while len(cls._cache) >= cls.CACHE_SIZE:
+            cls._cache.popitem(last=False)
+        cls._cache[path] = (mtime, index)
+
+    @classmethod
+    def for_coverage(cls, coverage, persist=True):
+        '''
+        Returns the index for a coverage, reading only the part of the temporal
+        axis that was appended since the index was last saved.
+        '''
+        path = cls.index_path(coverage)
+        try:
+            index = cls.load(path)
+        except Exception:
+            # Unreadable, e.g. truncated, the index is rebuilt
+            index = None
+        num_timesteps = coverage.num_timesteps
+        if index is None or index.count > num_timesteps:
+            index = cls()
+        if index.count < num_timesteps:
+            tname = coverage.temporal_parameter_name
+            index.append(coverage.get_parameter_values(tname, tdoa=slice(index.count, num_timesteps)))
+            if persist:
+                try:
+                    index.save(path)
+                except (IOError, OSError):
+                    pass # Read-only persistence, the index is still usable in memory
+        return index
+
+    @classmethod
+    def reader(cls, coverage):
+        tname = coverage.temporal_parameter_name
+        return lambda slice_: coverage.get_parameter_values(tname, tdoa=slice_)
@@ -5,6 +5,8 @@ import time
 import netCDF4
 import numpy as np
 
+from ion.util.time_index import TimeIndex
+
 class TimeUtils(object):
 
     @classmethod
@@ -18,8 +20,23 @@ class TimeUtils(object):
         units = pc.uom
         if 'iso' in units:
             return None # Not sure how to implement this....  How do you compare iso strings effectively?
-        values = coverage.get_parameter_values(time_name)
-        return cls.find_nearest(values,time)
+        index = TimeIndex.for_coverage(coverage)
+        return index.nearest(TimeIndex.reader(coverage), time)
+
+    @classmethod
+    def get_relative_times(cls, coverage, times):
+        '''
+        Determines the relative time in the coverage for each of the given times,
+        blocks of the temporal axis are read at most once for the whole lookup.
+        '''
+        time_name = coverage.temporal_parameter_name
+        units = coverage.get_parameter_context(time_name).uom
+        if 'iso' in units:
+            return [None for t in times]
+        index = TimeIndex.for_coverage(coverage)
+        reader = TimeIndex.reader(coverage)
+        blocks = {}
+        return [index.nearest(reader, t, blocks) for t in times]
 
     @classmethod
     def ts_to_units(cls,units, val):